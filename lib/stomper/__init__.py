@@ -2,6 +2,10 @@ from __future__ import absolute_import
 from .stomp_11 import (
     Engine,
     Frame,
+    FrameBatch,
+    FrameRecord,
+    LazyFrame,
+    SendTemplate,
     FrameError,
 
     abort,
@@ -11,10 +15,14 @@ from .stomp_11 import (
     commit,
     connect,
     disconnect,
+    escape_header,
+    pack_frames,
     send,
     subscribe,
+    unescape_header,
     unpack_frame,
     unsubscribe,
+    with_receipt,
 
     VALID_COMMANDS,
 
@@ -22,3 +30,6 @@ from .stomp_11 import (
     NO_REPONSE_NEEDED,
     NULL,
 )
+
+# Imported after stomp_11 as StompBuffer builds on its definitions.
+from . import stompbuffer
@@ -0,0 +1,155 @@
+"""
+Acknowledgement coalescing.
+
+AckBatcher collects the acknowledgements for received messages and
+releases them in batches, bounded by a count and a time window, rather
+than one ACK frame per MESSAGE. For 'client' subscriptions an ACK
+acknowledges every message received on the subscription up to and
+including the one given, so only the latest message per subscription is
+acknowledged. For 'client-individual' subscriptions every message is
+acknowledged but the ACK frames are joined together for a single write.
+
+It is used from an Engine subclass e.g.
+
+    class MyEngine(stomper.Engine):
+
+        def __init__(self):
+            super(MyEngine, self).__init__()
+            self.acks = AckBatcher(maxCount=100, maxDelay=0.05)
+            self.acks.setMode('1', 'client')
+
+        def ack(self, msg):
+            ... process the message ...
+            return self.acks.addMessage(msg)
+
+with the transport also writing whatever poll() returns from a timer, so
+the acknowledgements are not held for longer than maxDelay.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import time
+
+from . import stomp_11
+
+
+# The ack modes that need acknowledgements:
+CLIENT = 'client'
+CLIENT_INDIVIDUAL = 'client-individual'
+
+
+class AckBatcher(object):
+    """This class batches up ACK frames.
+
+    maxCount:
+        The acknowledgements are released once this many messages are
+        waiting to be acknowledged.
+
+    maxDelay:
+        The acknowledgements are released by poll() once the oldest
+        has waited this many seconds.
+
+    defaultMode:
+        The ack mode of subscriptions not given to setMode(...).
+        'client-individual' is always safe as each message is
+        acknowledged.
+
+    clock:
+        The function returning the current time in seconds.
+
+    """
+    def __init__(self, maxCount=100, maxDelay=0.1,
+                 defaultMode=CLIENT_INDIVIDUAL, clock=time.monotonic):
+        """Setup the internal state."""
+        self.maxCount = maxCount
+        self.maxDelay = maxDelay
+        self.defaultMode = defaultMode
+        self.clock = clock
+        self._modes = {}
+        self._reset()
+
+    def _reset(self):
+        # (subscription, transaction) : latest message id, for 'client':
+        self._cumulative = {}
+        # (message id, subscription, transaction), for 'client-individual':
+        self._individual = []
+        self._count = 0
+        self._oldest = None
+
+    def __len__(self):
+        """The number of messages waiting to be acknowledged."""
+        return self._count
+
+    def setMode(self, subscriptionid, ack):
+        """Set the ack mode ('client' or 'client-individual') that a
+        subscription was made with.
+        """
+        if ack not in (CLIENT, CLIENT_INDIVIDUAL):
+            raise ValueError("Unknown ack mode '%s'" % ack)
+        self._modes[str(subscriptionid)] = ack
+
+    def add(self, messageid, subscriptionid, transactionid=None, now=None):
+        """Queue the acknowledgement of a message.
+
+        returned:
+            The ACK frames to send if maxCount has been reached, else
+            NO_RESPONSE_NEEDED.
+
+        """
+        subscriptionid = str(subscriptionid)
+        mode = self._modes.get(subscriptionid, self.defaultMode)
+
+        if mode == CLIENT:
+            self._cumulative[(subscriptionid, transactionid)] = messageid
+        else:
+            self._individual.append((messageid, subscriptionid, transactionid))
+
+        if self._oldest is None:
+            self._oldest = self.clock() if now is None else now
+        self._count += 1
+
+        if self._count >= self.maxCount:
+            return self.flush()
+
+        return stomp_11.NO_RESPONSE_NEEDED
+
+    def addMessage(self, msg, now=None):
+        """Queue the acknowledgement of a received MESSAGE, as returned
+        by unpack_frame(...). See add(...).
+        """
+        headers = msg['headers']
+        return self.add(
+            headers['message-id'], headers['subscription'],
+            headers.get('transaction-id'), now)
+
+    def due(self, now=None):
+        """Return True if the oldest acknowledgement has waited maxDelay."""
+        if self._oldest is None:
+            return False
+        if now is None:
+            now = self.clock()
+        return now - self._oldest >= self.maxDelay
+
+    def poll(self, now=None):
+        """Return the ACK frames to send if they are due, else
+        NO_RESPONSE_NEEDED.
+        """
+        if self.due(now):
+            return self.flush()
+        return stomp_11.NO_RESPONSE_NEEDED
+
+    def flush(self):
+        """Return all the waiting ACK frames as a single string."""
+        frames = [
+            stomp_11.ack(messageid, subscriptionid, transactionid)
+            for (subscriptionid, transactionid), messageid
+            in self._cumulative.items()
+        ]
+        frames.extend([
+            stomp_11.ack(messageid, subscriptionid, transactionid)
+            for messageid, subscriptionid, transactionid in self._individual
+        ])
+        self._reset()
+
+        return ''.join(frames)
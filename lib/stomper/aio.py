@@ -0,0 +1,488 @@
+"""
+An asyncio transport for stomper.
+
+StompProtocol feeds the data it receives through a StompBuffer and hands
+each complete frame to an Engine, writing back whatever the engine
+returns. As with the twisted examples, received messages are processed by
+overriding Engine.ack(...) e.g.
+
+    class MyEngine(stomper.Engine):
+
+        def ack(self, msg):
+            print(msg['body'])
+            return super(MyEngine, self).ack(msg)
+
+    async def main():
+        stomp = await stomper.aio.open_connection(
+            'localhost', 61613, engine=MyEngine(), username='bob',
+            password='123')
+        await stomp.subscribe('/queue/a', 1, ack='client')
+        await stomp.send('/queue/a', 'hello')
+        ...
+        await stomp.disconnect()
+
+The coroutines that write to the transport wait while the transport's
+write buffer is over its high water mark (see pause_writing(...)).
+
+If heart-beats are asked for in connect(...) the intervals negotiated with
+the server are registered with a HeartbeatDriver, by default one shared by
+every connection on the event loop, which sends the heart-beats and aborts
+connections the server has gone quiet on.
+
+Receipts are tracked by the engine's stomper.receipts.ReceiptTracker, so
+sendFrame(frame, receipt=True) returns a concurrent future (which can be
+awaited with asyncio.wrap_future(...)) and a receipts.PublishWindow can
+be used over a StompProtocol as over a StompConnection.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import weakref
+import asyncio
+import logging
+import concurrent.futures
+
+import stomper
+from stomper import heartbeat
+from stomper import stompbuffer
+
+
+def get_log():
+    return logging.getLogger("stomper.aio")
+
+
+class HeartbeatDriver(object):
+    """This class drives a HeartbeatManager from a single event loop
+    timer for all the connections registered with it.
+
+    manager:
+        The HeartbeatManager to use. If not given a new one is created
+        using the event loop's clock.
+
+    The event loop is only referred to weakly, so the default driver
+    kept for each loop (see get_heartbeat_driver()) doesn't keep the loop
+    alive once it has been closed and dropped.
+
+    """
+    def __init__(self, manager=None, loop=None):
+        """Setup the internal state."""
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        loopRef = weakref.ref(loop)
+        if manager is None:
+            manager = heartbeat.HeartbeatManager(
+                clock=lambda: loopRef().time())
+        self._loopRef = loopRef
+        self.manager = manager
+        self._handle = None
+
+    @property
+    def loop(self):
+        """The event loop, or None if it has gone."""
+        return self._loopRef()
+
+    def register(self, protocol, send, receive):
+        """Start heart-beating a connection with the negotiated intervals
+        (in milliseconds).
+        """
+        self.manager.register(protocol, send, receive)
+        if self._handle is None and len(self.manager):
+            self._schedule()
+
+    def unregister(self, protocol):
+        """Stop heart-beating a connection."""
+        self.manager.unregister(protocol)
+        if self._handle is not None and not len(self.manager):
+            # The timer holds on to the loop, so don't leave it pending.
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        self._handle = self.loop.call_later(self.manager.resolution, self._tick)
+
+    def _tick(self):
+        """Send the heart-beats due and abort the silent connections."""
+        self._handle = None
+        send, dead = self.manager.tick()
+
+        for protocol in send:
+            protocol.sendHeartbeat()
+
+        for protocol in dead:
+            protocol.heartbeatTimeout()
+
+        if len(self.manager):
+            self._schedule()
+
+
+# The default HeartbeatDriver for each event loop:
+_drivers = weakref.WeakKeyDictionary()
+
+
+def get_heartbeat_driver(loop=None):
+    """Return the HeartbeatDriver shared by the connections on a loop."""
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    driver = _drivers.get(loop)
+    if driver is None:
+        driver = _drivers[loop] = HeartbeatDriver(loop=loop)
+
+    return driver
+
+
+class StompProtocol(asyncio.Protocol):
+    """This class is an asyncio protocol speaking STOMP through an Engine.
+
+    engine:
+        This is the Engine (or subclass) instance used to react to
+        received frames. If not given a plain Engine is used.
+
+    heartbeatDriver:
+        This is the HeartbeatDriver used if heart-beats are negotiated.
+        If not given the one shared by the event loop is used.
+
+    stompBuffer:
+        This is the binary StompBuffer received data is fed through, e.g.
+        one set up with size limits. If it raises LimitExceeded the
+        connection is aborted. If not given a plain one is used.
+
+    readHighWater, readLowWater:
+        If given, reading from the transport is paused while the
+        StompBuffer holds readHighWater bytes or more, until it is back
+        down to readLowWater. See StompBuffer.setWaterMarks(...).
+
+    """
+    def __init__(self, engine=None, heartbeatDriver=None, stompBuffer=None,
+                 readHighWater=None, readLowWater=None):
+        """Setup the internal state."""
+        if engine is None:
+            engine = stomper.Engine()
+        self.engine = engine
+        self.heartbeatDriver = heartbeatDriver
+        self.heartbeats = (0, 0)
+        if stompBuffer is None:
+            stompBuffer = stompbuffer.StompBuffer(binary=True)
+        self.stompBuffer = stompBuffer
+        self.readHighWater = readHighWater
+        self.readLowWater = readLowWater
+        self.transport = None
+        self.log = get_log()
+        # The receipts waited on, shared with the engine:
+        self.receipts = engine.receipts
+
+        self._paused = False
+        self._drainWaiters = []
+        self._connectedWaiter = None
+        self._expiryHandle = None
+        self._expiryDeadline = None
+        self._closed = None
+
+    # asyncio.Protocol interface:
+
+    def connection_made(self, transport):
+        """Store the transport to write to."""
+        self.transport = transport
+        self._closed = asyncio.get_event_loop().create_future()
+        if self.readHighWater is not None:
+            self.stompBuffer.setWaterMarks(
+                self.readHighWater, self.readLowWater,
+                transport.pause_reading, transport.resume_reading)
+
+    def data_received(self, data):
+        """Data received, react to each complete frame and respond if
+        needed.
+        """
+        if self.heartbeats != (0, 0):
+            self.heartbeatDriver.manager.dataReceived(self)
+
+        try:
+            self.stompBuffer.appendData(data)
+            messages = self.stompBuffer.getAllMessages()
+        except stompbuffer.LimitExceeded as e:
+            self.log.error("Aborting the connection: %s" % e)
+            self.transport.abort()
+            return
+
+        for msg in messages:
+            returned = self.engine.react(msg)
+            if returned:
+                self.write(returned)
+
+            self.frameReceived(msg)
+
+    def connection_lost(self, exc):
+        """Fail anything still waiting on the connection."""
+        self.transport = None
+        if self.heartbeats != (0, 0):
+            self.heartbeatDriver.unregister(self)
+            self.heartbeats = (0, 0)
+
+        if exc is None:
+            exc = ConnectionError("The connection was closed.")
+
+        waiters = self._drainWaiters
+        if self._connectedWaiter is not None:
+            waiters.append(self._connectedWaiter)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+        self._drainWaiters = []
+        self._connectedWaiter = None
+
+        self._cancelExpiry()
+        if len(self.receipts):
+            self.receipts.failAll(exc)
+
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self):
+        """The transport's write buffer is over its high water mark."""
+        self._paused = True
+
+    def resume_writing(self):
+        """The transport's write buffer has drained below its low water
+        mark, so wake anything waiting to write.
+        """
+        self._paused = False
+        waiters, self._drainWaiters = self._drainWaiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # Frame handling:
+
+    def frameReceived(self, msg):
+        """Called after the engine has reacted to a received frame.
+
+        This resolves the connect() and disconnect() (or other receipt)
+        waits. It can be overridden to see every frame, in which case
+        call this base version too.
+
+        """
+        cmd = msg['cmd']
+
+        if cmd == 'CONNECTED':
+            waiter, self._connectedWaiter = self._connectedWaiter, None
+            if waiter is not None and not waiter.done():
+                waiter.set_result(msg)
+
+        elif cmd == 'RECEIPT':
+            # In case an engine subclass hasn't resolved it:
+            self.receipts.received(msg['headers'].get('receipt-id'), msg)
+
+        elif cmd == 'ERROR':
+            waiter, self._connectedWaiter = self._connectedWaiter, None
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(stomper.FrameError(
+                    "Connect failed: %s" % msg['headers'].get('message', '')))
+
+    def write(self, frame):
+        """Write a frame (str or bytes) to the transport."""
+        if self.transport is None:
+            raise ConnectionError("Not connected.")
+        if not isinstance(frame, bytes):
+            frame = frame.encode('utf-8')
+        self.transport.write(frame)
+        if self.heartbeats != (0, 0):
+            self.heartbeatDriver.manager.dataSent(self)
+
+    def sendHeartbeat(self):
+        """Called by the HeartbeatDriver when a heart-beat is due."""
+        if self.transport is not None:
+            self.transport.write(b'\n')
+
+    def heartbeatTimeout(self):
+        """Called by the HeartbeatDriver when nothing has been received
+        from the server for too long. The connection is aborted.
+        """
+        self.heartbeats = (0, 0)
+        self.log.error("No heart-beat received from the server, aborting.")
+        if self.transport is not None:
+            self.transport.abort()
+
+    def sendFrame(self, frame, receipt=None, timeout=None):
+        """Write a frame as it is. The frame can be text, bytes or
+        anything with a pack() method e.g. Frame.
+
+        receipt:
+            If given a receipt header is added to the frame, with this
+            receipt id or a generated one if it is True.
+
+        timeout:
+            The seconds to wait for the receipt, see
+            stomper.receipts.ReceiptTracker.track(...). The receipt's
+            future fails with TimeoutError once this has passed.
+
+        returned:
+            The concurrent.futures.Future of the receipt, if one was
+            asked for.
+
+        """
+        if hasattr(frame, 'pack'):
+            frame = frame.pack()
+
+        future = None
+        if receipt:
+            if receipt is True:
+                receipt = None
+            receipt, future = self.receipts.track(receipt, timeout)
+            frame = stomper.with_receipt(frame, receipt)
+            self._scheduleExpiry()
+
+        try:
+            self.write(frame)
+        except Exception:
+            if future is not None:
+                self.receipts.cancel(receipt)
+            raise
+        return future
+
+    def _scheduleExpiry(self):
+        """Set the timer for the next receipt timeout, if there is one.
+
+        A pending timer is kept unless the next timeout is earlier than
+        it. If it goes off early the expiry just sets it again.
+
+        """
+        deadline = self.receipts.nextDeadline()
+        if deadline is None:
+            self._cancelExpiry()
+            return
+        if self._expiryHandle is not None and deadline >= self._expiryDeadline:
+            return
+
+        self._cancelExpiry()
+        self._expiryDeadline = deadline
+        self._expiryHandle = asyncio.get_event_loop().call_later(
+            max(0, deadline - self.receipts.clock()), self._expireReceipts)
+
+    def _cancelExpiry(self):
+        if self._expiryHandle is not None:
+            self._expiryHandle.cancel()
+        self._expiryHandle = None
+        self._expiryDeadline = None
+
+    def _expireReceipts(self):
+        self._expiryHandle = None
+        self._expiryDeadline = None
+        self.receipts.expire()
+        self._scheduleExpiry()
+
+    async def drain(self):
+        """Wait until the transport is ready for more data."""
+        if self.transport is None:
+            raise ConnectionError("Not connected.")
+        if not self._paused:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._drainWaiters.append(waiter)
+        await waiter
+
+    async def writeAndDrain(self, frame):
+        """Write a frame and wait until the transport can take more."""
+        self.write(frame)
+        await self.drain()
+
+    # STOMP commands:
+
+    async def connect(self, username='', password='', host='localhost',
+                      heartbeats=(0, 0)):
+        """Send the CONNECT frame and wait for the server's CONNECTED
+        frame, which is returned. If the server responds with an ERROR
+        frame FrameError is raised.
+
+        heartbeats:
+            The (cx, cy) heart-beat intervals to ask for in milliseconds.
+            The intervals negotiated with the server are stored as the
+            member heartbeats.
+
+        """
+        self._connectedWaiter = asyncio.get_event_loop().create_future()
+        waiter = self._connectedWaiter
+        self.write(stomper.connect(username, password, host, heartbeats))
+        msg = await waiter
+
+        self.heartbeats = heartbeat.negotiate(
+            heartbeats, self.engine.serverHeartbeats)
+        if self.heartbeats != (0, 0):
+            if self.heartbeatDriver is None:
+                self.heartbeatDriver = get_heartbeat_driver()
+            self.heartbeatDriver.register(self, *self.heartbeats)
+
+        return msg
+
+    async def subscribe(self, dest, idx, ack='auto', headers=None):
+        """Subscribe to a destination, see stomper.subscribe(...)."""
+        await self.writeAndDrain(stomper.subscribe(dest, idx, ack, headers))
+
+    async def unsubscribe(self, idx):
+        """Cancel a subscription, see stomper.unsubscribe(...)."""
+        await self.writeAndDrain(stomper.unsubscribe(idx))
+
+    async def send(self, dest, msg, transactionid=None,
+                   content_type='text/plain'):
+        """Send a message, see stomper.send(...)."""
+        await self.writeAndDrain(
+            stomper.send(dest, msg, transactionid, content_type))
+
+    async def disconnect(self, receipt=None, timeout=None):
+        """Send the DISCONNECT frame, wait for the server to confirm it
+        with a RECEIPT and close the transport.
+
+        timeout:
+            The number of seconds to wait for the receipt. If this is
+            exceeded asyncio.TimeoutError is raised, after the transport
+            has been closed.
+
+        """
+        receipt, future = self.receipts.track(receipt, timeout)
+        self._scheduleExpiry()
+        self.write(stomper.disconnect(receipt))
+
+        try:
+            await asyncio.wrap_future(future)
+        except concurrent.futures.TimeoutError:
+            raise asyncio.TimeoutError(
+                "No receipt '%s' for the DISCONNECT" % receipt)
+        finally:
+            self.receipts.cancel(receipt)
+            if self.transport is not None:
+                self.transport.close()
+
+    async def wait_closed(self):
+        """Wait until the connection has been lost."""
+        if self._closed is not None:
+            await self._closed
+
+
+async def open_connection(host='localhost', port=61613, engine=None,
+                          username='', password='', vhost=None,
+                          heartbeats=(0, 0), protocol_factory=StompProtocol,
+                          **kwargs):
+    """Connect to a STOMP server and wait until it has accepted us.
+
+    vhost:
+        The value of the CONNECT host header. If not given this is the
+        host connected to.
+
+    Any further keyword arguments are passed to loop.create_connection(...)
+    e.g. ssl.
+
+    returned:
+        The connected StompProtocol instance.
+
+    """
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_connection(
+        lambda: protocol_factory(engine), host, port, **kwargs)
+
+    try:
+        await protocol.connect(username, password, vhost or host, heartbeats)
+    except Exception:
+        transport.close()
+        raise
+
+    return protocol
@@ -0,0 +1,232 @@
+"""
+The benchmarks package measures the speed of packing and unpacking frames.
+
+It times Frame.pack(), unpack_frame(...), the send(...) and ack(...)
+builders, StompBuffer (text and binary) and the whole receive path of a
+sans-IO StompConnection for a range of body sizes. The
+StompBuffer runs also vary how the data is fed in, from whole frames down
+to single bytes, which is where any rescanning or copying of the buffer
+shows up. Each result gives frames/second and bytes/second. Run it with:
+
+    python -m stomper.benchmarks --output results.json
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+import platform
+
+import stomper
+from stomper.stompbuffer import StompBuffer
+from stomper.connection import StompConnection, CONNECTED
+
+
+# Body sizes in bytes:
+SIZES = [0, 64, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+# StompBuffer feed sizes in bytes, None meaning whole frames:
+CHUNKS = [None, 1400, 64, 1]
+
+DESTINATION = '/queue/benchmark'
+
+
+def measure(func, nframes, nbytes, minTime=0.2):
+    """Call func() repeatedly for at least minTime seconds.
+
+    nframes, nbytes:
+        The number of frames and bytes handled by each call.
+
+    returned:
+        A dict of the results.
+
+    """
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < minTime or calls == 0:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+
+    return {
+        'calls': calls,
+        'seconds': elapsed,
+        'frames_per_sec': calls * nframes / elapsed,
+        'bytes_per_sec': calls * nbytes / elapsed,
+    }
+
+
+def make_frame(size, binary=False):
+    """Return a packed MESSAGE frame with a content-length body of size."""
+    frame = stomper.Frame()
+    frame.cmd = 'MESSAGE'
+    frame.headers = {
+        'destination': DESTINATION,
+        'message-id': 'ID:benchmark-1',
+        'subscription': '1',
+        'content-length': size,
+    }
+    frame.body = 'x' * size
+    packed = frame.pack()
+    if binary:
+        packed = packed.encode('utf-8')
+    return packed
+
+
+def bench_pack(size, minTime):
+    frame = stomper.Frame()
+    frame.cmd = 'SEND'
+    frame.headers = {'destination': DESTINATION, 'content-length': size}
+    frame.body = 'x' * size
+    return measure(frame.pack, 1, size, minTime)
+
+
+def bench_unpack(size, minTime):
+    packed = make_frame(size)
+    return measure(lambda: stomper.unpack_frame(packed), 1, len(packed), minTime)
+
+
+def bench_send(size, minTime):
+    body = 'x' * size
+    return measure(lambda: stomper.send(DESTINATION, body), 1, size, minTime)
+
+
+def bench_ack(minTime):
+    return measure(lambda: stomper.ack('ID:benchmark-1', '1'), 1, 0, minTime)
+
+
+def bench_stompbuffer(size, chunk, binary, minTime, streamSize=256 * 1024):
+    """Time feeding frames into a StompBuffer and draining it.
+
+    As many frames as fit in streamSize (at least one) are fed in, in
+    chunks of the given size or a frame at a time if chunk is None.
+
+    """
+    frame = make_frame(size, binary)
+    count = max(1, streamSize // len(frame))
+    if chunk is None:
+        pieces = [frame] * count
+    else:
+        stream = frame * count
+        pieces = [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+
+    def run():
+        sb = StompBuffer(binary=binary)
+        got = 0
+        for piece in pieces:
+            sb.appendData(piece)
+            got += len(sb.getAllMessages())
+        assert got == count, "%d != %d" % (got, count)
+
+    return measure(run, count, count * len(frame), minTime)
+
+
+def bench_connection(size, minTime, streamSize=256 * 1024):
+    """Time received MESSAGE frames going through a StompConnection,
+    from bytes in to events and ACKs out, with no socket involved.
+    """
+    frame = make_frame(size, True)
+    count = max(1, streamSize // len(frame))
+    stream = frame * count
+
+    def run():
+        conn = StompConnection()
+        conn.state = CONNECTED
+        events = conn.receiveData(stream)
+        assert len(events) == count, "%d != %d" % (len(events), count)
+        conn.dataToSend()
+
+    return measure(run, count, len(stream), minTime)
+
+
+def run(sizes=SIZES, chunks=CHUNKS, minTime=0.2, maxAppends=200000,
+        log=None):
+    """Run all the benchmarks.
+
+    maxAppends:
+        StompBuffer runs needing more appends than this are skipped (16MB
+        a byte at a time would take far too long to be of use).
+
+    log:
+        A callable given a line of text for each result as it arrives.
+
+    returned:
+        The list of results, each a dict naming the benchmark and its
+        parameters along with the measurements.
+
+    """
+    results = []
+
+    def record(name, result, **params):
+        result = dict(result, name=name, **params)
+        results.append(result)
+        if log:
+            log("%-22s %-40s %14.1f frames/s %14.1f MB/s" % (
+                name,
+                ' '.join(['%s=%s' % (k, params[k]) for k in sorted(params)]),
+                result['frames_per_sec'],
+                result['bytes_per_sec'] / 1e6))
+
+    record('ack', bench_ack(minTime))
+
+    for size in sizes:
+        record('Frame.pack', bench_pack(size, minTime), size=size)
+        record('unpack_frame', bench_unpack(size, minTime), size=size)
+        record('send', bench_send(size, minTime), size=size)
+        record('StompConnection', bench_connection(size, minTime), size=size)
+
+        for binary in (False, True):
+            for chunk in chunks:
+                length = len(make_frame(size))
+                if chunk is not None and length // chunk > maxAppends:
+                    continue
+                record(
+                    'StompBuffer', bench_stompbuffer(size, chunk, binary, minTime),
+                    size=size, chunk=chunk or 'frame', binary=binary)
+
+    return results
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m stomper.benchmarks', description=__doc__.split('\n\n')[1])
+    parser.add_argument(
+        '--output', '-o', help='Write the results as JSON to this file.')
+    parser.add_argument(
+        '--sizes', type=lambda v: [int(s) for s in v.split(',')], default=SIZES,
+        help='Comma separated body sizes in bytes.')
+    parser.add_argument(
+        '--chunks', type=lambda v: [int(s) or None for s in v.split(',')],
+        default=CHUNKS,
+        help='Comma separated StompBuffer feed sizes in bytes, 0 for whole frames.')
+    parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help='The minimum number of seconds to time each benchmark for.')
+    parser.add_argument(
+        '--max-appends', type=int, default=200000,
+        help='Skip StompBuffer runs needing more appends than this.')
+    parser.add_argument(
+        '--quiet', '-q', action='store_true', help="Don't print the results.")
+    args = parser.parse_args(argv)
+
+    log = None
+    if not args.quiet:
+        log = print
+
+    results = run(args.sizes, args.chunks, args.min_time, args.max_appends, log)
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({
+                'python': sys.version,
+                'platform': platform.platform(),
+                'results': results,
+            }, fd, indent=2)
+
+    return results
@@ -0,0 +1,9 @@
+"""
+Run the stomper benchmarks, see stomper.benchmarks.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from stomper.benchmarks import main
+
+main()
@@ -0,0 +1,398 @@
+"""
+A sans-IO STOMP connection.
+
+StompConnection holds the state of a connection to a STOMP server without
+doing any I/O itself. The transport hands it the data it receives with
+receiveData(...), getting back a list of events, and writes out whatever
+dataToSend() returns after calling the methods that send frames e.g.
+
+    conn = StompConnection()
+    conn.connect('bob', '123', 'localhost')
+    sock.sendall(conn.dataToSend())
+    while conn.state != CLOSED:
+        for event in conn.receiveData(sock.recv(65536)):
+            if isinstance(event, MessageReceived):
+                print(event.body)
+        sock.sendall(conn.dataToSend())
+
+Received data is framed by a StompBuffer and each frame is passed to an
+Engine as usual, so whatever the engine responds with (e.g. the ACKs for
+client subscriptions) is added to the data to send. The same core can be
+driven by asyncio, twisted, selectors or a test with no socket at all.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import uuid
+
+from . import stomp_11
+from . import heartbeat
+from . import stompbuffer
+
+
+# The connection states:
+IDLE = 'IDLE'
+CONNECTING = 'CONNECTING'
+CONNECTED = 'CONNECTED'
+DISCONNECTING = 'DISCONNECTING'
+CLOSED = 'CLOSED'
+
+
+class StateError(stomp_11.FrameError):
+    """Raised when a frame can't be sent in the connection's state."""
+
+
+class Event(object):
+    """The base class of the events returned by receiveData(...).
+
+    frame:
+        The received frame, as returned by the StompBuffer, or None for
+        events that have none.
+
+    """
+    __slots__ = ('frame',)
+
+    def __init__(self, frame=None):
+        self.frame = frame
+
+    @property
+    def headers(self):
+        return self.frame['headers']
+
+    @property
+    def body(self):
+        return self.frame['body']
+
+    def __repr__(self):
+        return '<%s>' % self.__class__.__name__
+
+
+class FrameReceived(Event):
+    """A frame with no more specific event was received."""
+    __slots__ = ()
+
+
+class Connected(Event):
+    """The server accepted the connection.
+
+    heartbeats:
+        The (send, receive) heart-beat intervals in milliseconds
+        negotiated with the server.
+
+    """
+    __slots__ = ('heartbeats',)
+
+    def __init__(self, frame, heartbeats=(0, 0)):
+        Event.__init__(self, frame)
+        self.heartbeats = heartbeats
+
+    @property
+    def session(self):
+        return self.frame['headers'].get('session')
+
+    @property
+    def version(self):
+        return self.frame['headers'].get('version', '1.0')
+
+
+class MessageReceived(Event):
+    """A MESSAGE frame was received."""
+    __slots__ = ()
+
+    @property
+    def destination(self):
+        return self.frame['headers'].get('destination')
+
+    @property
+    def subscription(self):
+        return self.frame['headers'].get('subscription')
+
+    @property
+    def messageId(self):
+        return self.frame['headers'].get('message-id')
+
+    def __repr__(self):
+        return '<MessageReceived %s>' % self.messageId
+
+
+class ReceiptReceived(Event):
+    """A RECEIPT frame was received."""
+    __slots__ = ()
+
+    @property
+    def receiptId(self):
+        return self.frame['headers'].get('receipt-id')
+
+    def __repr__(self):
+        return '<ReceiptReceived %s>' % self.receiptId
+
+
+class Disconnected(ReceiptReceived):
+    """The server has confirmed the DISCONNECT. It is safe to close the
+    transport."""
+    __slots__ = ()
+
+
+class ErrorReceived(Event):
+    """An ERROR frame was received."""
+    __slots__ = ()
+
+    @property
+    def message(self):
+        return self.frame['headers'].get('message', '')
+
+    def __repr__(self):
+        return '<ErrorReceived %s>' % self.message
+
+
+class HeartbeatReceived(Event):
+    """A heart-beat was received at the given time."""
+    __slots__ = ('time',)
+
+    def __init__(self, time):
+        Event.__init__(self)
+        self.time = time
+
+
+class ConnectionClosed(Event):
+    """The server closed the connection."""
+    __slots__ = ()
+
+
+class StompConnection(object):
+    """This class is the state of a STOMP connection, without the I/O.
+
+    engine:
+        This is the Engine (or subclass) instance used to react to
+        received frames. If not given a plain Engine is used.
+
+    stompBuffer:
+        This is the binary StompBuffer received data is fed through. If
+        not given a plain one is used.
+
+    """
+    def __init__(self, engine=None, stompBuffer=None):
+        """Setup the internal state."""
+        if engine is None:
+            engine = stomp_11.Engine()
+        if stompBuffer is None:
+            stompBuffer = stompbuffer.StompBuffer(binary=True)
+        if stompBuffer.onHeartbeat is None:
+            stompBuffer.onHeartbeat = self._heartbeatReceived
+
+        self.engine = engine
+        self.stompBuffer = stompBuffer
+        self.state = IDLE
+        # The negotiated (send, receive) heart-beat intervals:
+        self.heartbeats = (0, 0)
+        # id : (destination, ack mode)
+        self.subscriptions = {}
+        # The receipts asked for and not yet received, shared with the
+        # engine:
+        self.receipts = engine.receipts
+
+        self._requestedHeartbeats = (0, 0)
+        self._disconnectReceipt = None
+        self._outbound = bytearray()
+        self._events = []
+
+    @property
+    def sessionId(self):
+        """The session id given by the server."""
+        return self.engine.sessionId
+
+    # Received data:
+
+    def receiveData(self, data):
+        """Called with the data received from the transport. An empty
+        string means the server closed the connection.
+
+        returned:
+            The list of events for the frames (and heart-beats)
+            completed by the data.
+
+        """
+        events = self._events = []
+
+        if not data:
+            self.connectionLost()
+            events.append(ConnectionClosed())
+            return events
+
+        self.stompBuffer.appendData(data)
+        for msg in self.stompBuffer.getAllMessages():
+            returned = self.engine.react(msg)
+            if returned:
+                self._queue(returned)
+            events.append(self._frameEvent(msg))
+
+        return events
+
+    def _heartbeatReceived(self, now):
+        self._events.append(HeartbeatReceived(now))
+
+    def _frameEvent(self, msg):
+        """Update the state for a received frame and return its event."""
+        cmd = msg['cmd']
+
+        if cmd == 'MESSAGE':
+            return MessageReceived(msg)
+
+        elif cmd == 'CONNECTED':
+            self.state = CONNECTED
+            self.heartbeats = heartbeat.negotiate(
+                self._requestedHeartbeats, self.engine.serverHeartbeats)
+            return Connected(msg, self.heartbeats)
+
+        elif cmd == 'RECEIPT':
+            receiptId = msg['headers'].get('receipt-id')
+            # In case an engine subclass hasn't resolved it:
+            self.receipts.received(receiptId, msg)
+            if receiptId is not None and receiptId == self._disconnectReceipt:
+                self.state = CLOSED
+                return Disconnected(msg)
+            return ReceiptReceived(msg)
+
+        elif cmd == 'ERROR':
+            if self.state == CONNECTING:
+                self.state = CLOSED
+            return ErrorReceived(msg)
+
+        return FrameReceived(msg)
+
+    def connectionLost(self):
+        """Called when the transport has gone. Any receipts waited on
+        fail with ConnectionError."""
+        self.state = CLOSED
+        if len(self.receipts):
+            self.receipts.failAll(ConnectionError("The connection was lost."))
+
+    # Data to send:
+
+    def dataToSend(self):
+        """Return the bytes waiting to be sent, which are then forgotten.
+        """
+        data = bytes(self._outbound)
+        del self._outbound[:]
+        return data
+
+    def outboundLen(self):
+        """Return the number of bytes waiting to be sent."""
+        return len(self._outbound)
+
+    def _queue(self, frame):
+        if not isinstance(frame, (bytes, bytearray)):
+            frame = frame.encode('utf-8')
+        self._outbound += frame
+
+    def _checkConnected(self):
+        if self.state != CONNECTED:
+            raise StateError("Can't send frames in the %s state." % self.state)
+
+    def sendFrame(self, frame, receipt=None, timeout=None):
+        """Queue a frame as it is, whatever the state. The frame can be
+        text, bytes or anything with a pack() method e.g. Frame.
+
+        receipt:
+            If given a receipt header is added to the frame, with this
+            receipt id or a generated one if it is True.
+
+        timeout:
+            The seconds to wait for the receipt, see
+            stomper.receipts.ReceiptTracker.track(...).
+
+        returned:
+            The future of the receipt, if one was asked for.
+
+        """
+        if hasattr(frame, 'pack'):
+            frame = frame.pack()
+
+        future = None
+        if receipt:
+            if receipt is True:
+                receipt = None
+            receipt, future = self.receipts.track(receipt, timeout)
+            frame = stomp_11.with_receipt(frame, receipt)
+
+        self._queue(frame)
+        return future
+
+    def sendHeartbeat(self):
+        """Queue a heart-beat."""
+        self._queue(b'\n')
+
+    def connect(self, username='', password='', host='localhost',
+                heartbeats=(0, 0)):
+        """Queue the CONNECT frame, see stomper.connect(...)."""
+        if self.state != IDLE:
+            raise StateError("Can't connect in the %s state." % self.state)
+        self._queue(stomp_11.connect(username, password, host, heartbeats))
+        self._requestedHeartbeats = tuple(heartbeats)
+        self.state = CONNECTING
+
+    def subscribe(self, dest, idx, ack='auto', headers=None):
+        """Queue a SUBSCRIBE frame, see stomper.subscribe(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.subscribe(dest, idx, ack, headers))
+        self.subscriptions[str(idx)] = (dest, ack)
+
+    def unsubscribe(self, idx):
+        """Queue an UNSUBSCRIBE frame, see stomper.unsubscribe(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.unsubscribe(idx))
+        self.subscriptions.pop(str(idx), None)
+
+    def send(self, dest, msg, transactionid=None, content_type='text/plain'):
+        """Queue a SEND frame, see stomper.send(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.send(dest, msg, transactionid, content_type))
+
+    def ack(self, messageid, subscriptionid, transactionid=None):
+        """Queue an ACK frame, see stomper.ack(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.ack(messageid, subscriptionid, transactionid))
+
+    def nack(self, messageid, subscriptionid, transactionid=None):
+        """Queue a NACK frame, see stomper.nack(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.nack(messageid, subscriptionid, transactionid))
+
+    def begin(self, transactionid=None):
+        """Queue a BEGIN frame.
+
+        returned:
+            The transaction id, generated if not given.
+
+        """
+        self._checkConnected()
+        if not transactionid:
+            transactionid = str(uuid.uuid4())
+        self._queue(stomp_11.begin(transactionid))
+        return transactionid
+
+    def commit(self, transactionid):
+        """Queue a COMMIT frame, see stomper.commit(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.commit(transactionid))
+
+    def abort(self, transactionid):
+        """Queue an ABORT frame, see stomper.abort(...)."""
+        self._checkConnected()
+        self._queue(stomp_11.abort(transactionid))
+
+    def disconnect(self, receipt=None):
+        """Queue the DISCONNECT frame. A Disconnected event follows once
+        the server has confirmed it.
+
+        returned:
+            The receipt id, generated if not given.
+
+        """
+        self._checkConnected()
+        receipt, future = self.receipts.track(receipt)
+        self._queue(stomp_11.disconnect(receipt))
+        self._disconnectReceipt = receipt
+        self.state = DISCONNECTING
+        return receipt
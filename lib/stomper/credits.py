@@ -0,0 +1,161 @@
+"""
+Credit based consumer flow control.
+
+A broker delivers a subscription's messages ahead of them being
+acknowledged, up to its prefetch size, which for ActiveMQ can be set
+with a subscribe header e.g.
+
+    stomper.subscribe('/queue/a', 1, 'client-individual',
+                      {'activemq.prefetchSize': 50})
+
+The messages then wait in the application's queue until its handlers
+get to them. If the handlers are slower than the broker this queue
+grows without bound. CreditManager stops acknowledging a subscription's
+messages once more than 'limit' of them are waiting to be processed, so
+the broker stops delivering once the prefetch window is used up. The
+held back acknowledgements are released once the handlers have brought
+the queue down to 'lowWater'.
+
+It is used from an Engine subclass e.g.
+
+    class MyEngine(stomper.Engine):
+
+        def __init__(self):
+            super(MyEngine, self).__init__()
+            self.credits = CreditManager(limit=100)
+
+        def ack(self, msg):
+            self.queue.put(msg)
+            return self.credits.received(msg)
+
+with the transport writing whatever processed(...) returns as the
+handlers finish with each message. Only subscriptions made with the
+'client' or 'client-individual' ack modes are held back, as the broker
+doesn't wait for acknowledgements in 'auto' mode.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+
+from . import stomp_11
+from .ackbatch import CLIENT, CLIENT_INDIVIDUAL
+
+
+class CreditManager(object):
+    """This class holds back ACK frames for the subscriptions whose
+    messages aren't being processed fast enough.
+
+    limit:
+        The acknowledgements of a subscription are held back once more
+        than this many of its messages are waiting to be processed.
+
+    lowWater:
+        The held back acknowledgements are released once no more than
+        this many messages are waiting. It defaults to half the limit.
+
+    defaultMode:
+        The ack mode of subscriptions not given to setMode(...). For
+        'client' subscriptions only the latest held back message is
+        acknowledged as that acknowledges all those before it.
+
+    """
+    def __init__(self, limit=100, lowWater=None,
+                 defaultMode=CLIENT_INDIVIDUAL):
+        """Setup the internal state."""
+        if lowWater is None:
+            lowWater = limit // 2
+        if lowWater > limit:
+            raise ValueError("lowWater can't be more than the limit")
+        self.limit = limit
+        self.lowWater = lowWater
+        self.defaultMode = defaultMode
+        self._modes = {}
+        # subscription : the number of messages waiting to be processed
+        self._waiting = {}
+        # subscription : [(message id, transaction id), ...] held back
+        self._held = {}
+
+    def setMode(self, subscriptionid, ack):
+        """Set the ack mode ('client' or 'client-individual') that a
+        subscription was made with.
+        """
+        if ack not in (CLIENT, CLIENT_INDIVIDUAL):
+            raise ValueError("Unknown ack mode '%s'" % ack)
+        self._modes[str(subscriptionid)] = ack
+
+    def waiting(self, subscriptionid):
+        """Return the number of messages waiting to be processed."""
+        return self._waiting.get(str(subscriptionid), 0)
+
+    def held(self, subscriptionid):
+        """Return the number of acknowledgements held back."""
+        return len(self._held.get(str(subscriptionid), ()))
+
+    def paused(self, subscriptionid):
+        """Return True if the subscription's acknowledgements are being
+        held back."""
+        return str(subscriptionid) in self._held
+
+    def received(self, msg):
+        """Count a received MESSAGE, as returned by unpack_frame(...), as
+        waiting to be processed.
+
+        returned:
+            The ACK frame for the message, or NO_RESPONSE_NEEDED if the
+            subscription has too many messages waiting.
+
+        """
+        headers = msg['headers']
+        subscriptionid = str(headers['subscription'])
+        messageid = headers['message-id']
+        transactionid = headers.get('transaction-id')
+
+        waiting = self._waiting.get(subscriptionid, 0) + 1
+        self._waiting[subscriptionid] = waiting
+
+        held = self._held.get(subscriptionid)
+        if held is None and waiting > self.limit:
+            held = self._held[subscriptionid] = []
+        if held is None:
+            return stomp_11.ack(messageid, subscriptionid, transactionid)
+
+        if self._modes.get(subscriptionid, self.defaultMode) == CLIENT:
+            del held[:]
+        held.append((messageid, transactionid))
+        return stomp_11.NO_RESPONSE_NEEDED
+
+    def processed(self, subscriptionid, count=1):
+        """Called when the handlers have finished with count messages of
+        the subscription.
+
+        returned:
+            The held back ACK frames if the subscription is down to
+            lowWater messages waiting, else NO_RESPONSE_NEEDED.
+
+        """
+        subscriptionid = str(subscriptionid)
+        waiting = max(0, self._waiting.get(subscriptionid, 0) - count)
+        self._waiting[subscriptionid] = waiting
+
+        if subscriptionid in self._held and waiting <= self.lowWater:
+            return ''.join([
+                stomp_11.ack(messageid, subscriptionid, transactionid)
+                for messageid, transactionid in self._held.pop(subscriptionid)
+            ])
+
+        return stomp_11.NO_RESPONSE_NEEDED
+
+    def processedMessage(self, msg):
+        """Called when the handlers have finished with a MESSAGE, as
+        returned by unpack_frame(...). See processed(...).
+        """
+        return self.processed(msg['headers']['subscription'])
+
+    def forget(self, subscriptionid):
+        """Drop the state of a subscription e.g. once it is unsubscribed.
+        """
+        subscriptionid = str(subscriptionid)
+        self._modes.pop(subscriptionid, None)
+        self._waiting.pop(subscriptionid, None)
+        self._held.pop(subscriptionid, None)
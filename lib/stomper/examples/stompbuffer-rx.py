@@ -75,11 +75,7 @@ class StompProtocol(Protocol):
         """
         self.stompBuffer.appendData(data)
 
-        while True:
-           msg = self.stompBuffer.getOneMessage()
-           if msg is None:
-               break
-
+        for msg in self.stompBuffer.getAllMessages():
            returned = self.sm.react(msg)
            if returned:
                self.transport.write(returned)
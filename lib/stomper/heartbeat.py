@@ -0,0 +1,234 @@
+"""
+STOMP 1.1 heart-beating.
+
+The client asks for heart-beats with the heart-beat header of the CONNECT
+frame (see stomper.connect(...)) and the server answers with its own in
+the CONNECTED frame. negotiate(...) works out the intervals actually in
+use from the two.
+
+HeartbeatManager keeps track of when heart-beats need sending and which
+connections have gone quiet for any number of connections, using a single
+timer wheel. It is transport neutral: the transport calls tick() from its
+own timer and acts on the result.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import time
+
+
+def parse_heart_beat(value):
+    """Parse a heart-beat header value 'cx,cy' into a 2-tuple of ints.
+
+    A missing or empty value means no heart-beating i.e. (0, 0).
+
+    """
+    if not value:
+        return (0, 0)
+
+    try:
+        cx, cy = value.split(',')
+        returned = (int(cx), int(cy))
+    except ValueError:
+        raise ValueError('Invalid heart-beat %r' % value)
+
+    if returned[0] < 0 or returned[1] < 0:
+        raise ValueError('Invalid heart-beat %r' % value)
+
+    return returned
+
+
+def negotiate(client, server):
+    """Work out the heart-beat intervals in use on a connection.
+
+    client:
+        The (cx, cy) heart-beats the client sent in CONNECT.
+
+    server:
+        The (sx, sy) heart-beats the server sent in CONNECTED, or the
+        header value itself.
+
+    returned:
+        (send, receive) the number of milliseconds between heart-beats
+        the client must send and may expect to receive. Zero means no
+        heart-beats in that direction.
+
+    """
+    if not isinstance(server, tuple):
+        server = parse_heart_beat(server)
+
+    cx, cy = client
+    sx, sy = server
+
+    send = 0
+    if cx and sy:
+        send = max(cx, sy)
+
+    receive = 0
+    if sx and cy:
+        receive = max(sx, cy)
+
+    return (send, receive)
+
+
+class _Entry(object):
+    """The heart-beat state of one connection."""
+    __slots__ = (
+        'key', 'send', 'receive', 'lastSent', 'lastReceived', 'dead',
+    )
+
+    def __init__(self, key, send, receive, now):
+        self.key = key
+        self.send = send
+        self.receive = receive
+        self.lastSent = now
+        self.lastReceived = now
+        self.dead = False
+
+    def deadline(self, grace):
+        """When this entry next needs looking at."""
+        deadlines = []
+        if self.send:
+            deadlines.append(self.lastSent + self.send)
+        if self.receive:
+            deadlines.append(self.lastReceived + self.receive * grace)
+        return min(deadlines)
+
+
+class HeartbeatManager(object):
+    """This class schedules heart-beats for many connections on one
+    timer wheel.
+
+    Connections are registered with their negotiated intervals and
+    identified by any hashable key (e.g. the protocol instance). The
+    transport tells the manager whenever it sends or receives data on a
+    connection, which only updates a time stamp. A single timer then
+    calls tick() every 'resolution' seconds, which returns the
+    connections that need to send a heart-beat (an EOL) and those that
+    have not received anything for too long.
+
+    resolution:
+        The number of seconds covered by each slot of the wheel.
+
+    slots:
+        The number of slots in the wheel.
+
+    grace:
+        A connection is considered dead when nothing has been received
+        for this multiple of its receive interval, to allow for timing
+        inaccuracies as the specification suggests.
+
+    clock:
+        The function returning the current time in seconds.
+
+    """
+    def __init__(self, resolution=0.1, slots=512, grace=2.0,
+                 clock=time.monotonic):
+        """Setup the internal state."""
+        self.resolution = resolution
+        self.grace = grace
+        self.clock = clock
+        self._slots = [set() for i in range(slots)]
+        self._entries = {}
+        self._current = int(clock() / resolution)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def register(self, key, send, receive, now=None):
+        """Start tracking a connection.
+
+        send, receive:
+            The negotiated intervals in milliseconds (see negotiate(...)).
+            If both are zero the connection isn't tracked.
+
+        """
+        self.unregister(key)
+        if not send and not receive:
+            return
+
+        if now is None:
+            now = self.clock()
+        entry = _Entry(key, send / 1000.0, receive / 1000.0, now)
+        self._entries[key] = entry
+        self._schedule(entry)
+
+    def unregister(self, key):
+        """Stop tracking a connection."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            # Anything left on the wheel is ignored when its slot is reached.
+            entry.dead = True
+
+    def dataSent(self, key, now=None):
+        """Note that data (a frame or heart-beat) was sent."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.lastSent = self.clock() if now is None else now
+
+    def dataReceived(self, key, now=None):
+        """Note that data (a frame or heart-beat) was received."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.lastReceived = self.clock() if now is None else now
+
+    def _schedule(self, entry):
+        """Put the entry in the slot for its next deadline."""
+        tick = max(
+            int(entry.deadline(self.grace) / self.resolution),
+            self._current + 1)
+        self._slots[tick % len(self._slots)].add(entry)
+
+    def tick(self, now=None):
+        """Process the slots that have come due.
+
+        returned:
+            (send, dead) lists of the keys of the connections which
+            must send a heart-beat now and those which have been silent
+            for too long. The send time stamp of the former is updated,
+            as the caller is expected to send the heart-beats. The
+            latter are no longer tracked.
+
+        """
+        if now is None:
+            now = self.clock()
+
+        send = []
+        dead = []
+
+        target = int(now / self.resolution)
+        # There is no point going round the wheel more than once.
+        first = max(self._current + 1, target - len(self._slots) + 1)
+
+        for tick in range(first, target + 1):
+            # Entries rescheduled from here on go into later slots.
+            self._current = tick
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            entries = list(slot)
+            slot.clear()
+
+            for entry in entries:
+                if entry.dead:
+                    continue
+
+                if entry.receive and (
+                        now - entry.lastReceived >= entry.receive * self.grace):
+                    dead.append(entry.key)
+                    self.unregister(entry.key)
+                    continue
+
+                if entry.send and now - entry.lastSent >= entry.send:
+                    send.append(entry.key)
+                    entry.lastSent = now
+
+                self._schedule(entry)
+
+        self._current = max(self._current, target)
+
+        return (send, dead)
@@ -0,0 +1,94 @@
+"""
+Sharing of repeated header strings between received frames.
+
+Every parsed frame normally has its own copy of each header name and of
+values such as the destination and subscription, although only a few
+dozen distinct strings cover most traffic. An InternTable hands back the
+first copy of a string it has seen instead, so frames held in memory
+share them. It is bounded, discarding the least recently used strings
+once it is full.
+
+It is used by giving the same table to the parsers e.g.
+
+    table = InternTable()
+    msg = stomper.unpack_frame(data, interner=table)
+    sb = StompBuffer(interner=table)
+
+A table is not safe to use from more than one thread at once.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import collections
+
+
+# The headers whose values are interned, rather than just their names.
+# These take few distinct values, unlike e.g. message-id.
+VALUE_HEADERS = (
+    'ack', 'content-type', 'destination', 'persistent', 'priority',
+    'subscription', 'version', 'server',
+)
+
+
+class InternTable(object):
+    """This class is a bounded table of shared strings.
+
+    maxSize:
+        The number of strings kept before the least recently used is
+        discarded.
+
+    maxLength:
+        Strings longer than this aren't interned.
+
+    values:
+        The names of the headers whose values are interned. Only the
+        names are interned for other headers.
+
+    """
+    def __init__(self, maxSize=4096, maxLength=128, values=VALUE_HEADERS):
+        """Setup the internal state."""
+        self.maxSize = maxSize
+        self.maxLength = maxLength
+        self.values = frozenset(values)
+        self._strings = collections.OrderedDict()
+
+    def __len__(self):
+        """The number of strings in the table."""
+        return len(self._strings)
+
+    def __contains__(self, string):
+        return string in self._strings
+
+    def clear(self):
+        """Empty the table."""
+        self._strings.clear()
+
+    def intern(self, string):
+        """Return the shared copy of a string, adding it to the table if
+        this is the first time it has been seen.
+        """
+        strings = self._strings
+        found = strings.get(string)
+        if found is not None:
+            strings.move_to_end(string)
+            return found
+
+        if len(string) > self.maxLength:
+            return string
+
+        if len(strings) >= self.maxSize:
+            strings.popitem(last=False)
+        strings[string] = string
+
+        return string
+
+    def header(self, name, value):
+        """Return (name, value) for a parsed header, interning the name
+        and, for the headers in values, the value too.
+        """
+        name = self.intern(name)
+        if name in self.values:
+            value = self.intern(value)
+
+        return name, value
@@ -0,0 +1,259 @@
+"""
+Receipt tracking and confirmed publishing.
+
+A client can add a receipt header to any frame (see
+stomper.with_receipt(...)) and the server answers with a RECEIPT frame
+once it has processed it. ReceiptTracker hands out a future for each
+receipt asked for, which is resolved with the RECEIPT frame when it
+arrives, or failed with a TimeoutError if it doesn't arrive in time.
+The futures are concurrent.futures.Future instances, which need no
+executor or event loop; asyncio code can wait on them with
+asyncio.wrap_future(...).
+
+Every Engine has a ReceiptTracker as its member receipts, which it
+resolves from Engine.receipt(...) and fails from Engine.error(...) for
+an ERROR frame carrying a receipt-id. StompConnection.sendFrame(frame,
+receipt=True) (or StompProtocol.sendFrame(...) in stomper.aio) adds the
+header and returns the future.
+
+PublishWindow builds confirmed publishing on this: up to 'size' frames
+are sent before their receipts come back, and the rest wait their turn,
+so the throughput approaches pipelined sending rather than waiting for
+each receipt in turn e.g.
+
+    window = PublishWindow(conn, size=100, timeout=5.0)
+    futures = [window.publish(stomper.send('/queue/a', m)) for m in msgs]
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import time
+import uuid
+import heapq
+import functools
+import collections
+from concurrent.futures import Future, TimeoutError
+
+
+class ReceiptTracker(object):
+    """This class keeps the futures of the receipts waited on.
+
+    timeout:
+        The default number of seconds to wait for a receipt, None
+        meaning for ever. expire() must be called from time to time for
+        timeouts to happen.
+
+    clock:
+        The function returning the current time in seconds.
+
+    """
+    def __init__(self, timeout=None, clock=time.monotonic):
+        """Setup the internal state."""
+        self.timeout = timeout
+        self.clock = clock
+        # receipt id : future
+        self._pending = {}
+        # A heap of (deadline, receipt id). Entries for receipts that
+        # have already arrived are dropped when they come to the top.
+        self._deadlines = []
+
+    def __len__(self):
+        """The number of receipts waited on."""
+        return len(self._pending)
+
+    def __contains__(self, receiptid):
+        return receiptid in self._pending
+
+    def track(self, receiptid=None, timeout=None, callback=None):
+        """Start waiting for a receipt.
+
+        receiptid:
+            The receipt id, a uuid is generated if this isn't given.
+
+        timeout:
+            The seconds to wait, if not the default timeout.
+
+        callback:
+            Called with the future when it is resolved or failed.
+
+        returned:
+            (receiptid, future)
+
+        """
+        if not receiptid:
+            receiptid = str(uuid.uuid4())
+        receiptid = str(receiptid)
+
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._pending[receiptid] = future
+
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is not None:
+            heapq.heappush(self._deadlines, (self.clock() + timeout, receiptid))
+
+        return (receiptid, future)
+
+    def received(self, receiptid, frame=None):
+        """Resolve the future of a receipt with the RECEIPT frame.
+
+        returned:
+            True if the receipt was being waited on.
+
+        """
+        future = self._pending.pop(receiptid, None)
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(frame)
+        return True
+
+    def failed(self, receiptid, exc):
+        """Fail the future of a receipt with the exception, e.g. when the
+        server has sent an ERROR frame for it instead.
+
+        returned:
+            True if the receipt was being waited on.
+
+        """
+        future = self._pending.pop(receiptid, None)
+        if future is None:
+            return False
+        if not future.done():
+            future.set_exception(exc)
+        return True
+
+    def cancel(self, receiptid):
+        """Stop waiting for a receipt, cancelling its future."""
+        future = self._pending.pop(receiptid, None)
+        if future is not None:
+            future.cancel()
+
+    def receiptReceived(self, msg):
+        """Resolve the future for a received RECEIPT frame, as returned
+        by unpack_frame(...). See received(...).
+        """
+        return self.received(msg['headers'].get('receipt-id'), msg)
+
+    def nextDeadline(self):
+        """Return the time the next timeout is due, or None."""
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][1] not in self._pending:
+            heapq.heappop(deadlines)
+        if deadlines:
+            return deadlines[0][0]
+        return None
+
+    def expire(self, now=None):
+        """Fail the futures of the receipts that have timed out with
+        TimeoutError.
+
+        returned:
+            The list of receipt ids that timed out.
+
+        """
+        if now is None:
+            now = self.clock()
+
+        expired = []
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, receiptid = heapq.heappop(deadlines)
+            future = self._pending.pop(receiptid, None)
+            if future is None:
+                continue
+            expired.append(receiptid)
+            if not future.done():
+                future.set_exception(
+                    TimeoutError("No receipt '%s' received" % receiptid))
+
+        return expired
+
+    def failAll(self, exc):
+        """Fail every future waited on with the exception, e.g. when the
+        connection is lost."""
+        pending, self._pending = self._pending, {}
+        self._deadlines = []
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+
+class PublishWindow(object):
+    """This class sends frames with receipts, with up to size of them
+    waiting for their receipts at once.
+
+    connection:
+        What the frames are sent with. It needs a sendFrame(frame,
+        receipt, timeout) method returning the receipt's future, as
+        StompConnection has.
+
+    size:
+        The number of frames that can await their receipts at once.
+
+    timeout:
+        The seconds to wait for each receipt once its frame is sent, if
+        not the tracker's default.
+
+    """
+    def __init__(self, connection, size=100, timeout=None):
+        """Setup the internal state."""
+        if size < 1:
+            raise ValueError("The window size must be at least 1")
+        self.connection = connection
+        self.size = size
+        self.timeout = timeout
+        self.inFlight = 0
+        # (frame, future) not yet sent:
+        self._queue = collections.deque()
+
+    def __len__(self):
+        """The number of frames not yet confirmed."""
+        return self.inFlight + len(self._queue)
+
+    def full(self):
+        """Return True if any more frames published will have to wait."""
+        return self.inFlight >= self.size
+
+    def publish(self, frame):
+        """Send a frame (e.g. from stomper.send(...)) once the window has
+        room for it.
+
+        returned:
+            A future resolved with the RECEIPT frame once the server has
+            confirmed the frame, or failed if it doesn't.
+
+        """
+        future = Future()
+        self._queue.append((frame, future))
+        self._release()
+        return future
+
+    def _release(self):
+        """Send the waiting frames the window has room for."""
+        while self._queue and self.inFlight < self.size:
+            frame, future = self._queue.popleft()
+            try:
+                sent = self.connection.sendFrame(
+                    frame, receipt=True, timeout=self.timeout)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.inFlight += 1
+            sent.add_done_callback(functools.partial(self._confirmed, future))
+
+    def _confirmed(self, future, sent):
+        """Pass on the outcome of a sent frame and make room for the next.
+        """
+        self.inFlight -= 1
+        if sent.cancelled():
+            future.cancel()
+        elif not future.done():
+            if sent.exception() is not None:
+                future.set_exception(sent.exception())
+            else:
+                future.set_result(sent.result())
+        self._release()
@@ -0,0 +1,182 @@
+"""
+MESSAGE routing by subscription and destination.
+
+MessageRouter finds the handlers for a received MESSAGE frame. Handlers
+are registered either for a subscription id or for a destination pattern
+using the ActiveMQ wildcards, where destinations are split into elements
+on '.':
+
+ * '*' matches any one element e.g. '/topic/PRICE.*' matches
+   '/topic/PRICE.IBM' but not '/topic/PRICE.IBM.NYSE'
+
+ * '>' matches one or more trailing elements e.g. '/topic/PRICE.>'
+   matches both of the above
+
+Note the '/topic/' or '/queue/' prefix is part of the first element, so
+wildcards can only be used after it.
+
+The patterns are kept in a prefix trie, so finding the handlers for a
+destination depends on the number of elements in it rather than the
+number of patterns. The result for each destination is also cached.
+
+Engine uses a MessageRouter, see Engine.addHandler(...).
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+
+
+class _Node(object):
+    """A node of the pattern trie."""
+    __slots__ = ('children', 'star', 'handlers', 'rest')
+
+    def __init__(self):
+        # element : _Node
+        self.children = {}
+        # The node for a '*' element, if any:
+        self.star = None
+        # The handlers for patterns ending at this node:
+        self.handlers = []
+        # The handlers for patterns ending with '>' after this node:
+        self.rest = []
+
+
+class MessageRouter(object):
+    """This class looks up the handlers for received messages.
+
+    separator:
+        The character separating the elements of a destination.
+
+    cacheSize:
+        The number of destinations whose handlers are cached. The cache
+        is emptied when it fills up and whenever handlers change.
+
+    """
+    def __init__(self, separator='.', cacheSize=1024):
+        """Setup the internal state."""
+        self.separator = separator
+        self.cacheSize = cacheSize
+        self._root = _Node()
+        self._subscriptions = {}
+        self._cache = {}
+        self._count = 0
+
+    def __len__(self):
+        """The number of handlers registered."""
+        return self._count + sum(
+            [len(handlers) for handlers in self._subscriptions.values()])
+
+    def addSubscription(self, subscriptionid, handler):
+        """Call handler for every message received on a subscription.
+        """
+        self._subscriptions.setdefault(str(subscriptionid), []).append(handler)
+
+    def removeSubscription(self, subscriptionid, handler=None):
+        """Remove a handler (or all of them) for a subscription."""
+        subscriptionid = str(subscriptionid)
+        handlers = self._subscriptions.get(subscriptionid, [])
+        if handler is None:
+            del handlers[:]
+        elif handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self._subscriptions.pop(subscriptionid, None)
+
+    def add(self, pattern, handler):
+        """Call handler for every message whose destination matches the
+        pattern.
+        """
+        node, rest = self._find(pattern, True)
+        if rest:
+            node.rest.append(handler)
+        else:
+            node.handlers.append(handler)
+        self._count += 1
+        self._cache.clear()
+
+    def remove(self, pattern, handler):
+        """Remove a handler added for a pattern."""
+        node, rest = self._find(pattern, False)
+        if node is None:
+            return
+        handlers = node.rest if rest else node.handlers
+        if handler in handlers:
+            handlers.remove(handler)
+            self._count -= 1
+        self._cache.clear()
+
+    def _find(self, pattern, create):
+        """Return the trie node for a pattern and whether it ends in '>'.
+        """
+        elements = pattern.split(self.separator)
+        rest = elements[-1] == '>'
+        if rest:
+            elements.pop()
+
+        node = self._root
+        for element in elements:
+            if element == '*':
+                if node.star is None and create:
+                    node.star = _Node()
+                node = node.star
+            else:
+                child = node.children.get(element)
+                if child is None and create:
+                    child = node.children[element] = _Node()
+                node = child
+            if node is None:
+                return (None, rest)
+
+        return (node, rest)
+
+    def match(self, destination):
+        """Return a tuple of the handlers whose patterns match a
+        destination.
+        """
+        handlers = self._cache.get(destination)
+        if handlers is not None:
+            return handlers
+
+        handlers = []
+        nodes = [self._root]
+        for element in destination.split(self.separator):
+            matched = []
+            for node in nodes:
+                # '>' matches this element and anything after it:
+                handlers.extend(node.rest)
+                child = node.children.get(element)
+                if child is not None:
+                    matched.append(child)
+                if node.star is not None:
+                    matched.append(node.star)
+            nodes = matched
+            if not nodes:
+                break
+
+        for node in nodes:
+            handlers.extend(node.handlers)
+        handlers = tuple(handlers)
+
+        if len(self._cache) >= self.cacheSize:
+            self._cache.clear()
+        self._cache[destination] = handlers
+
+        return handlers
+
+    def handlers(self, subscriptionid=None, destination=None):
+        """Return the handlers for a message.
+
+        The handlers registered for the subscription are returned if
+        there are any, otherwise those matching the destination.
+
+        """
+        if subscriptionid is not None and self._subscriptions:
+            handlers = self._subscriptions.get(str(subscriptionid))
+            if handlers:
+                return handlers
+
+        if destination is not None and self._count:
+            return self.match(destination)
+
+        return ()
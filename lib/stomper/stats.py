@@ -0,0 +1,122 @@
+"""
+Optional instrumentation for Engine and StompBuffer.
+
+A Stats instance can be given to Engine and StompBuffer (the same one to
+both if you like) to count what they do:
+
+ * StompBuffer counts the frames and bytes received per command and the
+   number of times it had to resynchronise, along with the bytes it threw
+   away doing so.
+
+ * Engine counts the frames it reacts to per command and times the
+   handlers in a histogram. It also counts received frames when it is
+   handed the raw message rather than an unpacked one.
+
+snapshot() returns all of this as a dict. Without a Stats instance
+neither class does any of this work.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import bisect
+import time
+
+
+# The upper bounds in seconds of the handler time histogram buckets. There
+# is a final bucket for anything slower.
+BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+    1.0, 5.0,
+)
+
+
+class Stats(object):
+    """This class accumulates the counters and histograms.
+
+    buckets:
+        The upper bounds of the handler time histogram buckets.
+
+    clock:
+        The function timing the handlers.
+
+    """
+    def __init__(self, buckets=BUCKETS, clock=time.perf_counter):
+        """Setup the internal state."""
+        self.buckets = tuple(buckets)
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """Zero everything."""
+        # command : [frames, bytes]
+        self.received = {}
+        # command : [frames, seconds, histogram]
+        self.handled = {}
+        self.resyncs = 0
+        self.discardedBytes = 0
+
+    def frameReceived(self, cmd, nbytes):
+        """Count a received frame of nbytes."""
+        counts = self.received.get(cmd)
+        if counts is None:
+            counts = self.received[cmd] = [0, 0]
+        counts[0] += 1
+        counts[1] += nbytes
+
+    def frameHandled(self, cmd, seconds):
+        """Count a frame whose handler took the given time."""
+        counts = self.handled.get(cmd)
+        if counts is None:
+            counts = self.handled[cmd] = [0, 0.0, [0] * (len(self.buckets) + 1)]
+        counts[0] += 1
+        counts[1] += seconds
+        counts[2][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def resync(self, discarded):
+        """Count a resynchronisation of the buffer which threw away the
+        given number of bytes.
+        """
+        self.resyncs += 1
+        self.discardedBytes += discarded
+
+    def snapshot(self):
+        """Return a copy of the current figures as a dict:
+
+        {
+            'received': {
+                'MESSAGE': {'frames': 10, 'bytes': 1234},
+                ...
+            },
+            'handled': {
+                'MESSAGE': {
+                    'frames': 10,
+                    'seconds': 0.0012,
+                    # [(upper bound, count), ...], the last bound is None:
+                    'histogram': [(1e-05, 2), ..., (None, 0)],
+                },
+                ...
+            },
+            'resyncs': 0,
+            'discarded_bytes': 0,
+        }
+
+        """
+        bounds = list(self.buckets) + [None]
+
+        return {
+            'received': dict([
+                (cmd, {'frames': frames, 'bytes': nbytes})
+                for cmd, (frames, nbytes) in self.received.items()
+            ]),
+            'handled': dict([
+                (cmd, {
+                    'frames': frames,
+                    'seconds': seconds,
+                    'histogram': list(zip(bounds, histogram)),
+                })
+                for cmd, (frames, seconds, histogram) in self.handled.items()
+            ]),
+            'resyncs': self.resyncs,
+            'discarded_bytes': self.discardedBytes,
+        }
@@ -36,10 +36,13 @@ import re
 import uuid
 import types
 import logging
+import collections
 
 
 from . import utils
-from . import stompbuffer
+from . import router
+from . import heartbeat
+from . import receipts
 
 # This is used as a return from message responses functions.
 # It is used more for readability more then anything or reason.
@@ -78,6 +81,75 @@ class FrameError(Exception):
     """
 
 
+# The header names and values of these frames are never escaped, for
+# backwards compatibility with STOMP 1.0:
+UNESCAPED_COMMANDS = ('CONNECT', 'CONNECTED')
+
+_unescape_re = re.compile(r'\\(.)', re.DOTALL)
+
+_unescapes = {'\\': '\\', 'n': '\n', 'c': ':', 'r': '\r'}
+
+
+def escape_header(value):
+    """Escape a header name or value as STOMP 1.1 requires.
+
+    Backslash, newline and colon characters become '\\\\', '\\n' and
+    '\\c' respectively.
+
+    """
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(':', '\\c')
+
+
+def unescape_header(value):
+    """Undo escape_header(...).
+
+    The STOMP 1.2 '\\r' escape is understood too. Any other escape
+    sequence is left as it is.
+
+    """
+    if '\\' not in value:
+        return value
+
+    return _unescape_re.sub(_unescape, value)
+
+
+def _unescape(match):
+    return _unescapes.get(match.group(1), match.group(0))
+
+
+def _escape(value):
+    """Return a value as header text, only escaping it if needed."""
+    value = '%s' % (value,)
+    if '\\' in value or ':' in value or '\n' in value:
+        value = escape_header(value)
+
+    return value
+
+
+def _pack_headers(headers, escape=True):
+    """Return the header lines for a dictionary of headers.
+
+    The lines are built without escaping first. Then a single check of
+    the whole block (no backslashes and exactly one colon and newline
+    per header) shows whether anything needed escaping, which it
+    almost never does. Only then are the lines built again escaped.
+
+    """
+    block = ''.join(
+        ['%s:%s\n' % (f, v) for f, v in sorted(headers.items())]
+    )
+
+    count = len(headers)
+    if escape and ('\\' in block or block.count(':') != count or
+                   block.count('\n') != count):
+        block = ''.join([
+            '%s:%s\n' % (escape_header('%s' % f), escape_header('%s' % v))
+            for f, v in sorted(headers.items())
+        ])
+
+    return block
+
+
 class Frame(object):
     """This class is used to create or read STOMP message frames.
 
@@ -131,10 +203,13 @@ class Frame(object):
 
     def pack(self):
         """Called to create a STOMP message from the internal values.
+
+        The header names and values are escaped as needed, other than
+        for CONNECT frames.
+
         """
-        headers = ''.join(
-            ['%s:%s\n' % (f, v) for f, v in sorted(self.headers.items())]
-        )
+        headers = _pack_headers(
+            self.headers, self._cmd not in UNESCAPED_COMMANDS)
         stomp_message = "%s\n%s\n%s%s\n" % (self._cmd, headers, self.body, NULL)
 
         return stomp_message
@@ -169,7 +244,175 @@ class Frame(object):
         return msg
 
 
-def unpack_frame(message):
+class LazyFrame(object):
+    """This class is a light weight, read only alternative to Frame
+    for received STOMP message frames.
+
+    The raw header block is kept as it was received and the headers
+    are only parsed into a dictionary when the 'headers' member is
+    first used. The dictionary is cached after that. The header(...)
+    method looks up a single header without building the dictionary,
+    which is all that is needed to route most messages.
+
+    A LazyFrame can be indexed like the dictionary returned by
+    unpack_frame(...) (msg['cmd'], msg['headers'], msg['body']) so it
+    can be handed to Engine.react(...) directly.
+
+    """
+    __slots__ = ('cmd', 'body', '_head', '_cmdEnd', '_headers')
+
+    def __init__(self, cmd='', head=None, body=''):
+        """Setup the internal state.
+
+        cmd:
+            The STOMP command.
+
+        head:
+            The raw header block, starting with the command line. If
+            this is not given the frame has no headers.
+
+        body:
+            The message body.
+
+        """
+        self.cmd = cmd
+        self.body = body
+        if head is None:
+            head = cmd
+        self._head = head
+        self._cmdEnd = len(cmd)
+        self._headers = None
+
+    def unpack(self, message):
+        """Called to extract a STOMP message into this instance.
+
+        message:
+            This is a text string (or bytes) representing a valid
+            STOMP (v1.1) message.
+
+        The body is recovered in the same way unpack_frame(...) does
+        it, however only the content-length header is looked at.
+
+        retuned:
+            This instance.
+
+        """
+        if not message:
+            raise FrameError("Unpack error! The given message isn't valid '%s'!" % message)
+
+        head, body_start = _split_head(message)
+        cmd_end = head.find('\n')
+        if cmd_end < 0:
+            cmd_end = len(head)
+
+        self.cmd = head[:cmd_end]
+        self._head = head
+        self._cmdEnd = cmd_end
+        self._headers = None
+        self.body = _frame_body(
+            message, body_start, self.header('content-length'))
+
+        return self
+
+    def header(self, name, default=None):
+        """Return the value of a single header, or default if the frame
+        doesn't have it.
+
+        If the headers haven't been parsed yet, this finds the header in
+        the raw header block rather than parsing all of them.
+
+        """
+        if self._headers is not None:
+            return self._headers.get(name, default)
+
+        head = self._head
+        key = _escape(name)
+        # The last occurrence wins, as it does in the parsed dictionary.
+        index = head.rfind('\n%s:' % key, self._cmdEnd)
+        if index < 0:
+            if name not in head:
+                return default
+            # It could still be there with white space around the name:
+            return self.headers.get(name, default)
+
+        start = index + len(key) + 2
+        end = head.find('\n', start)
+        if end < 0:
+            end = len(head)
+
+        value = head[start:end].strip()
+        if '\\' in value and self.cmd not in UNESCAPED_COMMANDS:
+            value = unescape_header(value)
+
+        return value
+
+    @property
+    def headers(self):
+        """The dictionary of headers, parsed on first use."""
+        if self._headers is None:
+            self._headers = {}
+            if self._cmdEnd < len(self._head):
+                head = self._head[self._cmdEnd + 1:]
+                _parse_header_lines(
+                    head.split('\n'), self._headers,
+                    '\\' in head and self.cmd not in UNESCAPED_COMMANDS)
+
+        return self._headers
+
+    def __getitem__(self, key):
+        """Allow msg['cmd'], msg['headers'] and msg['body'] access."""
+        if key == 'cmd':
+            return self.cmd
+        elif key == 'headers':
+            return self.headers
+        elif key == 'body':
+            return self.body
+        raise KeyError(key)
+
+    def __repr__(self):
+        return '<LazyFrame %s>' % self.cmd
+
+
+# The commands as interned strings, so every FrameRecord shares them:
+_COMMANDS = dict([(cmd, cmd) for cmd in VALID_COMMANDS])
+
+_FIELDS = {'cmd': 0, 'headers': 1, 'body': 2}
+
+
+class FrameRecord(collections.namedtuple('FrameRecord', 'cmd headers body')):
+    """This class is a compact, read only result for received frames.
+
+    It is a tuple of (cmd, headers, body), so it costs less to build than
+    the dictionary returned by unpack_frame(...), and the command is
+    shared with VALID_COMMANDS rather than being a new string for every
+    frame. The fields can be used as attributes (msg.headers) or by name
+    (msg['headers']) so it can be handed to Engine.react(...) and the
+    Engine methods in place of the dictionary.
+
+    unpack_frame(message, compact=True) and StompBuffer(compact=True)
+    return these.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, cmd, headers, body):
+        return tuple.__new__(cls, (_COMMANDS.get(cmd, cmd), headers, body))
+
+    def __getitem__(self, key):
+        """Allow msg['cmd'], msg['headers'] and msg['body'] access as
+        well as tuple indexing."""
+        index = _FIELDS.get(key, key) if isinstance(key, str) else key
+        if isinstance(index, str):
+            raise KeyError(key)
+        return tuple.__getitem__(self, index)
+
+
+# The first blank line in a frame ends the headers:
+header_end_re = re.compile('\n[ \t\r]*\n')
+header_end_bytes_re = re.compile(b'\n[ \t\r]*\n')
+
+
+def unpack_frame(message, compact=False, interner=None):
     """Called to unpack a STOMP message into a dictionary.
 
     returned = {
@@ -188,50 +431,134 @@ def unpack_frame(message):
         'body' : '...1234...\x00',
     }
 
+    The headers are split from the body at the first blank line. If
+    there is a content-length header the body is taken as exactly that
+    many bytes following the blank line, so binary and multi-line
+    bodies are returned unchanged. Without one the body lines are
+    stripped and joined and any null characters are removed, as has
+    always been done.
+
+    The message may also be given as bytes, in which case the command
+    and headers are decoded as UTF-8 and the body is returned as bytes.
+
+    If compact is True a FrameRecord is returned instead of the
+    dictionary.
+
+    If an interning.InternTable is given as the interner the header
+    names and common values are shared with previously parsed frames.
+
     """
-    body = []
-    returned = dict(cmd='', headers={}, body='')
+    head, body_start = _split_head(message)
 
-    breakdown = message.split('\n')
+    breakdown = head.split('\n')
 
     # Get the message command:
-    returned['cmd'] = breakdown[0]
-    breakdown = breakdown[1:]
+    cmd = breakdown[0]
+
+    # Recover the header fields, only unescaping them if there is any
+    # escaping to undo:
+    headers = {}
+    _parse_header_lines(
+        breakdown[1:], headers,
+        '\\' in head and cmd not in UNESCAPED_COMMANDS, interner)
+
+    body = _frame_body(message, body_start, headers.get('content-length'))
+
+    if compact:
+        return FrameRecord(cmd, headers, body)
+
+    return dict(cmd=cmd, headers=headers, body=body)
+
+
+def _split_head(message):
+    """Find the end of the headers in a text or bytes message.
+
+    returned:
+        (head, body_start) where head is the text of the command and
+        header lines and body_start is the index the body starts at.
+
+    """
+    if isinstance(message, (bytes, bytearray)):
+        match = header_end_bytes_re.search(message)
+    else:
+        match = header_end_re.search(message)
+
+    if match:
+        head = message[:match.start()]
+        body_start = match.end()
+    else:
+        head = message
+        body_start = len(message)
+
+    if not isinstance(head, stringTypes):
+        head = head.decode('utf-8')
+
+    return head, body_start
+
 
-    def headD(field):
+def _parse_header_lines(lines, headers, unescape=False, interner=None):
+    """Parse 'name:value' header lines into the headers dictionary,
+    unescaping the names and values if asked to and interning them if
+    an interner is given.
+    """
+    for field in lines:
         # find the first ':' everything to the left of this is a
         # header, everything to the right is data:
         index = field.find(':')
         if index:
             header = field[:index].strip()
             data = field[index+1:].strip()
-#            print "header '%s' data '%s'" % (header, data)
-            returned['headers'][header.strip()] = data.strip()
-
-    def bodyD(field):
-        field = field.strip()
-        if field:
-            body.append(field)
+            if unescape:
+                header = unescape_header(header)
+                data = unescape_header(data)
+            if interner is not None:
+                header, data = interner.header(header, data)
+            headers[header] = data
 
-    # Recover the header fields and body data
-    handler = headD
-    for field in breakdown:
-#        print "field:", field
-        if field.strip() == '':
-            # End of headers, it body data next.
-            handler = bodyD
-            continue
 
-        handler(field)
+def _frame_body(message, body_start, content_length):
+    """Recover the body of a message starting at body_start.
 
-    # Stich the body data together:
-#    print "1. body: ", body
-    body = "".join(body)
-    returned['body'] = body.replace('\x00', '')
+    If content_length (the content-length header value) is given the
+    body is that many bytes following body_start. For a text message
+    the body is measured in UTF-8 encoded bytes. Otherwise the body
+    lines are stripped and joined and any null characters are removed.
 
-#    print "2. body: <%s>" % returned['body']
+    """
+    binary = isinstance(message, (bytes, bytearray))
+    if binary:
+        empty, eol, null = b'', b'\n', b'\x00'
+    else:
+        empty, eol, null = '', '\n', '\x00'
+
+    if content_length is not None and content_length.isdigit():
+        # Fast path: the body is a single slice of the given length.
+        length = int(content_length)
+        body = message[body_start:body_start + length]
+        if binary:
+            if isinstance(body, bytearray):
+                body = bytes(body)
+        elif not body.isascii():
+            # Characters and bytes differ, so count the encoded bytes:
+            body = message[body_start:].encode('utf-8')[:length].decode(
+                'utf-8', 'replace')
+
+    else:
+        # Stich the body data together:
+        body = [field.strip() for field in message[body_start:].split(eol)]
+        body = empty.join([field for field in body if field])
+        body = body.replace(null, empty)
+
+    return body
+
+
+def _text_body(body):
+    """Return a received body as text for logging, without null characters.
+    """
+    if isinstance(body, (bytes, bytearray)):
+        body = body.decode('utf-8', 'replace')
 
-    return returned
+    return body.replace(NULL, '')
 
 
 def abort(transactionid):
@@ -243,7 +570,7 @@ def abort(transactionid):
         This is the id that all actions in this transaction.
 
     """
-    return "ABORT\ntransaction:%s\n\n\x00\n" % transactionid
+    return "ABORT\ntransaction:%s\n\n\x00\n" % _escape(transactionid)
 
 
 def ack(messageid, subscriptionid, transactionid=None):
@@ -264,10 +591,11 @@ def ack(messageid, subscriptionid, transactionid=None):
         will be generated for this.
 
     """
-    header = 'subscription:%s\nmessage-id:%s' % (subscriptionid, messageid)
+    header = 'subscription:%s\nmessage-id:%s' % (
+        _escape(subscriptionid), _escape(messageid))
 
     if transactionid:
-        header += '\ntransaction:%s' % transactionid
+        header += '\ntransaction:%s' % _escape(transactionid)
 
     return "ACK\n%s\n\n\x00\n" % header
 
@@ -293,10 +621,11 @@ def nack(messageid, subscriptionid, transactionid=None):
         will be generated for this.
 
     """
-    header = 'subscription:%s\nmessage-id:%s' % (subscriptionid, messageid)
+    header = 'subscription:%s\nmessage-id:%s' % (
+        _escape(subscriptionid), _escape(messageid))
 
     if transactionid:
-        header += '\ntransaction:%s' % transactionid
+        header += '\ntransaction:%s' % _escape(transactionid)
 
     return "NACK\n%s\n\n\x00\n" % header
 
@@ -316,7 +645,7 @@ def begin(transactionid=None):
         # Generate a random UUID:
         transactionid = uuid.uuid4()
 
-    return "BEGIN\ntransaction:%s\n\n\x00\n" % transactionid
+    return "BEGIN\ntransaction:%s\n\n\x00\n" % _escape(transactionid)
 
 
 def commit(transactionid):
@@ -329,7 +658,7 @@ def commit(transactionid):
         This is the id that all actions in this transaction.
 
     """
-    return "COMMIT\ntransaction:%s\n\n\x00\n" % transactionid
+    return "COMMIT\ntransaction:%s\n\n\x00\n" % _escape(transactionid)
 
 
 def connect(username, password, host, heartbeats=(0,0)):
@@ -358,7 +687,7 @@ def disconnect(receipt=None):
     """
     if not receipt:
         receipt = uuid.uuid4()
-    return "DISCONNECT\nreceipt:%s\n\x00\n" % receipt
+    return "DISCONNECT\nreceipt:%s\n\n\x00\n" % _escape(receipt)
 
 
 def send(dest, msg, transactionid=None, content_type='text/plain'):
@@ -378,13 +707,221 @@ def send(dest, msg, transactionid=None, content_type='text/plain'):
     transheader = ''
 
     if transactionid:
-        transheader = 'transaction:%s\n' % transactionid
+        transheader = 'transaction:%s\n' % _escape(transactionid)
 
     return "SEND\ndestination:%s\ncontent-type:%s\n%s\n%s\x00\n" % (
-        dest, content_type, transheader, msg)
+        _escape(dest), _escape(content_type), transheader, msg)
+
+
+class SendTemplate(object):
+    """This class is used to create SEND frames for a fixed destination
+    and set of headers.
+
+    The constant part of the frame is built (and encoded) once when the
+    template is created, so creating each message only needs the body
+    (and optional transaction id) to be filled in. The frames generated
+    are the same as those from send(...).
+
+    dest:
+        This is the destination messages are sent to.
+
+    content_type:
+        This is the content-type header of the messages.
+
+    extra_headers:
+        This is an optional dictionary of further headers that are
+        sent with every message.
+
+    content_length:
+        If this is True a content-length header is added to each
+        message.
+
+    """
+    def __init__(self, dest, content_type='text/plain', extra_headers=None,
+                 content_length=False):
+        """Build the constant part of the frame."""
+        self.dest = dest
+        self.content_type = content_type
+        self.content_length = content_length
+
+        head = "SEND\ndestination:%s\ncontent-type:%s\n" % (
+            _escape(dest), _escape(content_type))
+        if extra_headers:
+            head += _pack_headers(extra_headers)
+
+        self._head = head
+        self._prefix = head + '\n'
+        self._bhead = head.encode('utf-8')
+        self._bprefix = self._prefix.encode('utf-8')
+
+    def pack(self, msg, transactionid=None):
+        """Called to create a SEND frame with the given body.
+
+        msg:
+            This is the message body to be sent. If this is bytes then
+            the frame is returned as bytes.
+
+        transactionid:
+            This is an optional field and is not needed
+            by default.
+
+        """
+        binary = isinstance(msg, (bytes, bytearray))
+
+        if not transactionid and not self.content_length:
+            # The common case: one concatenation.
+            if binary:
+                return self._bprefix + msg + b'\x00\n'
+            return self._prefix + msg + '\x00\n'
+
+        headers = ''
+        if self.content_length:
+            # The header counts bytes, not characters:
+            size = len(msg) if binary else len(msg.encode('utf-8'))
+            headers += 'content-length:%d\n' % size
+        if transactionid:
+            headers += 'transaction:%s\n' % _escape(transactionid)
+        headers += '\n'
+
+        if binary:
+            return self._bhead + headers.encode('utf-8') + msg + b'\x00\n'
+        return self._head + headers + msg + '\x00\n'
+
+
+# What a frame in a FrameBatch can be, once any builder has been called:
+_FRAME_TYPES = stringTypes + (bytes, bytearray, memoryview)
+
 
+class FrameBatch(object):
+    """This class is used to pack many frames into one buffer so they
+    can be written to the transport together.
 
-def subscribe(dest, idx, ack='auto'):
+    Frames can be added as Frame instances, as the strings or bytes
+    returned by the builder functions (or SendTemplate.pack), or as a
+    builder function or SendTemplate and its arguments e.g.
+
+        batch = FrameBatch()
+        batch.add(send, '/queue/a', 'hello')
+        batch.add(ack, message_id, subscription_id)
+        batch.add(template, 'hello')
+        transport.write(batch.pack())
+
+    extend(...) and pack_frames(...) take the same frames, with a
+    builder and its arguments given as a tuple e.g. (send, '/queue/a',
+    'hello'). Anything that doesn't give a str, bytes, bytearray or
+    memoryview frame is refused with TypeError.
+
+    pack() returns one contiguous bytes buffer while buffers() returns
+    a list of bytes, one per frame, suitable for writelines(...) or
+    socket.sendmsg(...). Text frames are encoded using the given
+    encoding.
+
+    """
+    def __init__(self, frames=None, encoding='utf-8'):
+        """Setup the internal state, adding any frames given."""
+        self.encoding = encoding
+        self._frames = []
+        if frames:
+            self.extend(frames)
+
+    def add(self, frame, *args, **kwargs):
+        """Add a frame to the batch.
+
+        frame:
+            This is a Frame instance, a string or bytes frame, a
+            builder function (send, ack, ...) which is called with the
+            remaining arguments to generate the frame, or anything with
+            a pack() method (e.g. a SendTemplate) which is called with
+            the remaining arguments.
+
+        """
+        if callable(frame):
+            frame = frame(*args, **kwargs)
+        elif hasattr(frame, 'pack'):
+            frame = frame.pack(*args, **kwargs)
+        if not isinstance(frame, _FRAME_TYPES):
+            raise TypeError(
+                "A frame must be text or bytes, not %s" % type(frame).__name__)
+        self._frames.append(frame)
+
+    def extend(self, frames):
+        """Add each of the frames from an iterable to the batch. A tuple
+        is taken as a builder (or SendTemplate) and its arguments.
+        """
+        for frame in frames:
+            if isinstance(frame, tuple) and frame:
+                self.add(*frame)
+            else:
+                self.add(frame)
+
+    def clear(self):
+        """Remove all the frames from the batch."""
+        self._frames = []
+
+    def __len__(self):
+        return len(self._frames)
+
+    def buffers(self):
+        """Return the frames as a list of bytes, one per frame."""
+        returned = []
+        for frame in self._frames:
+            if isinstance(frame, stringTypes):
+                frame = frame.encode(self.encoding)
+            elif not isinstance(frame, bytes):
+                # A bytearray or memoryview:
+                frame = bytes(frame)
+            returned.append(frame)
+
+        return returned
+
+    def pack(self):
+        """Return all the frames joined into a single bytes buffer."""
+        frames = self._frames
+        for frame in frames:
+            if not isinstance(frame, stringTypes):
+                return b''.join(self.buffers())
+
+        # All text, so only encode once:
+        return ''.join(frames).encode(self.encoding)
+
+
+def pack_frames(frames, encoding='utf-8'):
+    """Pack an iterable of frames into one bytes buffer.
+
+    See FrameBatch for the frames that can be given.
+
+    """
+    return FrameBatch(frames, encoding).pack()
+
+
+def with_receipt(frame, receiptid):
+    """Add a receipt header to a frame, so the server answers it with a
+    RECEIPT frame whose receipt-id is receiptid.
+
+    frame:
+        A packed frame, as text or bytes, or a Frame.
+
+    returned:
+        The packed frame with the header added after the command line.
+
+    """
+    if hasattr(frame, 'pack'):
+        frame = frame.pack()
+
+    header = 'receipt:%s\n' % _escape(receiptid)
+    eol = '\n'
+    if isinstance(frame, (bytes, bytearray)):
+        header = header.encode('utf-8')
+        eol = b'\n'
+
+    index = frame.find(eol)
+    if index < 0:
+        raise FrameError("No command line in the frame '%s'!" % frame[:80])
+
+    return frame[:index + 1] + header + frame[index + 1:]
+
+
+def subscribe(dest, idx, ack='auto', headers=None):
     """STOMP subscribe command.
 
     dest:
@@ -398,9 +935,17 @@ def subscribe(dest, idx, ack='auto'):
         have to have an acknowledge as a reply. Otherwise the server
         will assume delivery failure.
 
+    headers:
+        This is an optional dictionary of further headers e.g. the
+        broker's prefetch setting {'activemq.prefetchSize': 10}.
+
     """
-    return "SUBSCRIBE\nid:%s\ndestination:%s\nack:%s\n\n\x00\n" % (
-        idx, dest, ack)
+    extra = ''
+    if headers:
+        extra = _pack_headers(headers)
+
+    return "SUBSCRIBE\nid:%s\ndestination:%s\nack:%s\n%s\n\x00\n" % (
+        _escape(idx), _escape(dest), _escape(ack), extra)
 
 
 def unsubscribe(idx):
@@ -413,7 +958,7 @@ def unsubscribe(idx):
     further messages for the given subscription.
 
     """
-    return "UNSUBSCRIBE\nid:%s\n\n\x00\n" % idx
+    return "UNSUBSCRIBE\nid:%s\n\n\x00\n" % _escape(idx)
 
 
 class Engine(object):
@@ -421,20 +966,33 @@ class Engine(object):
     message if needed.
 
     """
-    def __init__(self, testing=False):
+    def __init__(self, testing=False, stats=None):
         self.testing = testing
 
+        # An optional stomper.stats.Stats instance to count frames and
+        # time the handlers:
+        self.stats = stats
+
         self.log = logging.getLogger("stomper.Engine")
 
         self.sessionId = ''
 
+        # The heart-beat header of the CONNECTED frame as (sx, sy):
+        self.serverHeartbeats = (0, 0)
+
+        # The MESSAGE handlers, see addHandler(...):
+        self.router = router.MessageRouter()
+
+        # The receipts waited on, resolved by receipt(...):
+        self.receipts = receipts.ReceiptTracker()
+
         # Entry Format:
         #
         #    COMMAND : Handler_Function
         #
         self.states = {
             'CONNECTED' : self.connected,
-            'MESSAGE' : self.ack,
+            'MESSAGE' : self.message,
             'ERROR' : self.error,
             'RECEIPT' : self.receipt,
         }
@@ -444,8 +1002,9 @@ class Engine(object):
         """Called to provide a response to a message if needed.
 
         msg:
-            This is a dictionary as returned by unpack_frame(...)
-            or it can be a straight STOMP message. This function
+            This is a dictionary as returned by unpack_frame(...),
+            a FrameRecord, a LazyFrame or it can be a straight STOMP
+            message, as text or bytes. This function
             will attempt to determine which an deal with it.
 
         returned:
@@ -454,18 +1013,32 @@ class Engine(object):
         """
         returned = ""
 
-        # If its not a string assume its a dict.
+        # If its not a string (or bytes) assume its a dict.
         mtype = type(msg)
-        if mtype in stringTypes:
+        if mtype in stringTypes or mtype is bytes or mtype is bytearray:
+            if self.stats is not None:
+                # Count the bytes received, not the characters:
+                if mtype is bytes or mtype is bytearray:
+                    nbytes = len(msg)
+                else:
+                    nbytes = len(msg.encode('utf-8'))
             msg = unpack_frame(msg)
-        elif mtype == dict:
+            if self.stats is not None:
+                self.stats.frameReceived(msg['cmd'], nbytes)
+        elif mtype == dict or mtype == FrameRecord or mtype == LazyFrame:
             pass
         else:
             raise FrameError("Unknown message type '%s', I don't know what to do with this!" % mtype)
 
-        if msg['cmd'] in self.states:
+        cmd = msg['cmd']
+        if cmd in self.states:
 #            print("reacting to message - %s" % msg['cmd'])
-            returned = self.states[msg['cmd']](msg)
+            if self.stats is None:
+                returned = self.states[cmd](msg)
+            else:
+                start = self.stats.clock()
+                returned = self.states[cmd](msg)
+                self.stats.frameHandled(cmd, self.stats.clock() - start)
 
         return returned
 
@@ -474,18 +1047,76 @@ class Engine(object):
         """No response is needed to a connected frame.
 
         This method stores the session id as the
-        member sessionId for later use.
+        member sessionId for later use. The server's heart-beat
+        header is stored as the member serverHeartbeats, see
+        stomper.heartbeat.negotiate(...).
 
         returned:
             NO_RESPONSE_NEEDED
 
         """
         self.sessionId = msg['headers']['session']
+        self.serverHeartbeats = heartbeat.parse_heart_beat(
+            msg['headers'].get('heart-beat'))
         #print "connected: session id '%s'." % self.sessionId
 
         return NO_RESPONSE_NEEDED
 
 
+    def addHandler(self, handler, destination=None, subscription=None):
+        """Register a handler for received MESSAGE frames.
+
+        handler:
+            This is called with the message, as the ack(...) method
+            is, and returns the response to it (if any).
+
+        destination:
+            The handler is called for messages whose destination
+            matches this pattern. The ActiveMQ '*' and '>' wildcards
+            can be used, see stomper.router.
+
+        subscription:
+            The handler is called for messages received on the
+            subscription with this id. A message with handlers for
+            its subscription isn't routed by destination.
+
+        """
+        if subscription is not None:
+            self.router.addSubscription(subscription, handler)
+        if destination is not None:
+            self.router.add(destination, handler)
+        if subscription is None and destination is None:
+            raise ValueError("A destination or subscription must be given.")
+
+    def removeHandler(self, handler, destination=None, subscription=None):
+        """Remove a handler registered with addHandler(...)."""
+        if subscription is not None:
+            self.router.removeSubscription(subscription, handler)
+        if destination is not None:
+            self.router.remove(destination, handler)
+
+    def message(self, msg):
+        """Called when a MESSAGE has been received.
+
+        The message is passed to the handlers registered for it with
+        addHandler(...), the responses of which are joined together and
+        returned. If there are none the ack(...) method is used.
+
+        """
+        header = getattr(msg, 'header', None)
+        if header is None:
+            # A dict or FrameRecord:
+            header = msg['headers'].get
+        # A LazyFrame finds the two headers without parsing the rest.
+        handlers = self.router.handlers(
+            header('subscription'), header('destination'))
+        if not handlers:
+            return self.ack(msg)
+
+        returned = [handler(msg) for handler in handlers]
+
+        return ''.join([response for response in returned if response])
+
     def ack(self, msg):
         """Called when a MESSAGE has been received.
 
@@ -510,13 +1141,15 @@ class Engine(object):
     def error(self, msg):
         """Called to handle an error message received from the server.
 
-        This method just logs the error message
+        This method logs the error message and, if it has a receipt-id
+        header, fails the future of that receipt in the member receipts
+        with FrameError.
 
         returned:
             NO_RESPONSE_NEEDED
 
         """
-        body = msg['body'].replace(NULL, '')
+        body = _text_body(msg['body'])
 
         brief_msg = ""
         if 'message' in msg['headers']:
@@ -524,6 +1157,11 @@ class Engine(object):
 
         self.log.error("Received server error - message%s\n\n%s" % (brief_msg, body))
 
+        receiptid = msg['headers'].get('receipt-id')
+        if receiptid is not None:
+            self.receipts.failed(receiptid, FrameError(
+                "Received an ERROR for receipt '%s': %s" % (receiptid, brief_msg)))
+
         returned = NO_RESPONSE_NEEDED
         if self.testing:
             returned = 'error'
@@ -534,13 +1172,15 @@ class Engine(object):
     def receipt(self, msg):
         """Called to handle a receipt message received from the server.
 
-        This method just logs the receipt message
+        This method logs the receipt message and resolves its future if
+        it is being waited on in the member receipts (see
+        stomper.receipts.ReceiptTracker).
 
         returned:
             NO_RESPONSE_NEEDED
 
         """
-        body = msg['body'].replace(NULL, '')
+        body = _text_body(msg['body'])
 
         brief_msg = ""
         if 'receipt-id' in msg['headers']:
@@ -548,6 +1188,8 @@ class Engine(object):
 
         self.log.info("Received server receipt message - receipt-id:%s\n\n%s" % (brief_msg, body))
 
+        self.receipts.receiptReceived(msg)
+
         returned = NO_RESPONSE_NEEDED
         if self.testing:
             returned = 'receipt'
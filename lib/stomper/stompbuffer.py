@@ -9,42 +9,208 @@ License: http://www.apache.org/licenses/LICENSE-2.0
 from builtins import object
 
 import re
+import time
+import codecs
 import stomper
 
-# regexp to check that the buffer starts with a command.
-command_re = re.compile ( '^(.*?)\n' )
-
-# regexp to remove everything up to and including the first
-# instance of '\x00\n' (used in resynching the buffer).
-sync_re = re.compile ( '^.*?\x00\n' )
-
 # regexp to determine the content length. The buffer should always start
 # with a command followed by the headers, so the content-length header will
-# always be preceded by a newline.
-content_length_re = re.compile ( '\ncontent-length\s*:\s*(\d+)\s*\n' )
+# always be preceded by a newline. It is either followed by a newline or
+# is the last header in the block.
+content_length_re = re.compile ( r'\ncontent-length\s*:\s*(\d+)\s*(?:\n|$)' )
 
 # Separator between the header and the body.
 len_sep = len ( '\n\n' )
 # Footer after the message body.
 len_footer = len ( '\x00\n' )
 
+# Once this many bytes at the front of the buffer have been consumed (and
+# they make up at least half of it) the buffer is compacted. Until then
+# consumed frames are skipped over by advancing the read offset, which
+# avoids copying the remainder of the buffer for every frame pulled off.
+COMPACT_THRESHOLD = 64 * 1024
+
+
+class LimitExceeded ( stomper.FrameError ):
+    """
+    I am raised (or handed to the onLimit callback) when a StompBuffer
+    limit is exceeded. what is 'header', 'body' or 'buffer', size is how
+    big it got and limit is the limit it went over.
+    """
+    def __init__ ( self, what, size, limit ):
+        stomper.FrameError.__init__ (
+            self, "%s of %d bytes exceeds the limit of %d bytes" % (
+                what, size, limit ) )
+        self.what  = what
+        self.size  = size
+        self.limit = limit
+
+
+class _Tokens ( object ):
+    """
+    I hold the framing tokens in the representation used by the buffer,
+    which is bytes in text mode too.
+    """
+    def __init__ ( self, convert ):
+        self.eol    = convert ( '\n' )
+        self.cr     = convert ( '\r' )
+        self.sep    = convert ( '\n\n' )
+        self.footer = convert ( '\x00\n' )
+        self.null   = convert ( '\x00' )
+        # The valid command lines, as a set for a constant time check.
+        self.commands = frozenset ( [ convert ( c )
+                                      for c in stomper.VALID_COMMANDS ] )
+
+_TOKENS = _Tokens ( lambda s: s.encode ( 'ascii' ) )
+
+
 class StompBuffer ( object ):
     """
     I can be used to deal with partial frames if your transport does
     not guarantee complete frames. I maintain an internal buffer of
     received bytes and offer a way of pulling off the first complete
     message off the buffer.
+
+    By default I work on text (str) data. If binary is True I accept the
+    bytes objects handed over by sockets and return message bodies as
+    bytes. Either way the received data is kept UTF-8 encoded in a
+    bytearray, so appending to it takes time in proportion to the data
+    appended rather than to the size of the buffer, and the frames are
+    only decoded once they are complete. The command and headers are
+    always returned as text (decoded as UTF-8), and a content-length is
+    always a count of bytes.
+
+    Frames are pulled off by advancing a read offset into the buffer
+    rather than slicing the remainder off for every frame; the consumed
+    space is reclaimed once it makes up most of the buffer.
+
+    The state of the scan for the frame at the front of the buffer (where
+    its header ends, its content-length and how far the terminator search
+    got) is kept between calls, so a frame arriving in many small pieces
+    is only scanned once rather than from the start for every piece.
+
+    If lazy is True I return stomper.LazyFrame instances rather than
+    dicts, leaving the headers unparsed until they are needed. If compact
+    is True I return stomper.FrameRecord tuples rather than dicts.
+
+    If I am given a stomper.interning.InternTable as the interner, the
+    header names and common values of the frames I return are shared
+    with earlier frames rather than being new strings each time.
+
+    If I am given a stomper.stats.Stats instance I count the frames and
+    bytes received and any resynchronisation of the buffer in it.
+
+    If I am given a sinkFactory, the bodies of frames whose content-length
+    is at least streamThreshold are streamed rather than buffered. Once
+    the header of such a frame is in, I call sinkFactory ( cmd, headers )
+    for a file-like object and hand each piece of the body to its write
+    method as it arrives, so the frame is never held in memory whole.
+    When the terminator arrives I return the frame as usual, with the
+    sink as its body. Closing the sink is up to the caller.
+
+    My memory use can be bounded with maxHeaderBytes, maxBodyBytes (which
+    does not apply to streamed bodies) and maxBufferBytes, which limits
+    the incomplete frame at the end of the buffer rather than complete
+    frames waiting to be pulled off. When a limit
+    is exceeded I throw the buffer away, as the data stream can't be
+    trusted after that, and raise LimitExceeded, or hand it to onLimit
+    if that is given. See also setWaterMarks for flow control.
+
+    The bare EOLs ('\n' or '\r\n') sent between frames as STOMP 1.1
+    heart-beats are skipped. If onHeartbeat is given I call it with the
+    time (from clock) for each one.
     """
 
-    def __init__ ( self ):
-        self.buffer = ''
+    def __init__ ( self, binary = False, lazy = False, stats = None,
+                   compact = False, interner = None, sinkFactory = None,
+                   streamThreshold = 1024 * 1024, maxHeaderBytes = None,
+                   maxBodyBytes = None, maxBufferBytes = None,
+                   onLimit = None, onHeartbeat = None,
+                   clock = time.monotonic ):
+        self.binary = binary
+        self.lazy = lazy
+        self.compact = compact
+        self.interner = interner
+        self.stats = stats
+        self.sinkFactory = sinkFactory
+        self.streamThreshold = streamThreshold
+        self.maxHeaderBytes = maxHeaderBytes
+        self.maxBodyBytes = maxBodyBytes
+        self.maxBufferBytes = maxBufferBytes
+        self.onLimit = onLimit
+        self.onHeartbeat = onHeartbeat
+        self.clock = clock
+        # Flow control, see setWaterMarks.
+        self.paused = False
+        self._highWater = None
+        self._lowWater = 0
+        self._pause = None
+        self._resume = None
+        self._tokens = _TOKENS
+        self._reset()
+        # The frame whose body is being streamed, if any.
+        self._stream = None
+
+
+    def _reset ( self, data = None ):
+        """
+        I replace the buffer contents with data (or nothing).
+        """
+        if isinstance ( data, str ):
+            data = data.encode ( 'utf-8' )
+        self._buf = bytearray ( data or b'' )
+        self._pos = 0
+        # Just past the last '\x00\n' seen in the buffer, as an offset
+        # from its start. The frames before it are (almost certainly, as
+        # a body can contain '\x00\n') complete.
+        self._completeEnd = 0
+        self._noteTerminators ( 0 )
+        self._resetScan()
+
+
+    def _resetScan ( self ):
+        """
+        I forget the scan state of the frame at the front of the buffer.
+        All the offsets are relative to the read offset.
+        """
+        # Whether the command line of the frame has been checked.
+        self._synced = False
+        # Where to resume looking for the '\n\n' ending the header.
+        self._hdrScan = 0
+        # The length of the header once it is known, else -1.
+        self._hdrLen = -1
+        # The decoded header block, once it is known.
+        self._header = None
+        # The value of the content-length header, if there is one.
+        self._contentLength = None
+        # Where to resume looking for the '\x00\n' terminator.
+        self._nulScan = 0
+
+
+    def _getBuffer ( self ):
+        """
+        I return a copy of the unconsumed part of the buffer.
+        """
+        data = bytes ( self._buf[self._pos:] )
+        if self.binary:
+            return data
+        # The end may be part way through a character.
+        return data.decode ( 'utf-8', 'replace' )
+
+
+    def _setBuffer ( self, data ):
+        self._reset ( data )
+        self._stream = None
+        self._checkWaterMarks()
+
+    buffer = property ( _getBuffer, _setBuffer )
 
 
     def bufferLen ( self ):
         """
         I return the length of the buffer, in bytes.
         """
-        return len ( self.buffer )
+        return len ( self._buf ) - self._pos
     
     
     def bufferIsEmpty ( self ):
@@ -54,16 +220,129 @@ class StompBuffer ( object ):
         return self.bufferLen() == 0
         
 
+    def setWaterMarks ( self, high, low = None, pause = None, resume = None ):
+        """
+        I set the flow control water marks of the buffer. Once it holds
+        high bytes or more of complete frames that haven't been pulled
+        off I set paused and call pause(), then once enough has been
+        pulled off for it to hold low bytes (a quarter of high by
+        default) or fewer of them I clear paused and call resume(). A
+        transport can use these to stop reading, e.g. with asyncio's
+        transport.pause_reading and transport.resume_reading, so the
+        sender is held up by TCP flow control rather than filling memory.
+        A high of None turns this off.
+
+        The incomplete frame at the end of the buffer isn't counted, as
+        it can only be completed by reading more; I always resume once
+        nothing but an incomplete frame is left. Use maxBufferBytes to
+        bound the size of that frame.
+        """
+        if low is None:
+            low = ( high or 0 ) // 4
+        if high is not None and low > high:
+            raise ValueError ( "low (%d) must not exceed high (%d)" % (
+                low, high ) )
+        self._highWater = high
+        self._lowWater = low
+        self._pause = pause
+        self._resume = resume
+        self._checkWaterMarks()
+
+
+    def _completeLen ( self ):
+        """
+        I return the number of bytes of complete frames in the buffer.
+        """
+        return max ( 0, self._completeEnd - self._pos )
+
+
+    def _noteTerminators ( self, start ):
+        """
+        I move _completeEnd past the last '\x00\n' from start on, where
+        start is where the newly appended data begins.
+        """
+        end = self._buf.rfind ( self._tokens.footer,
+                                max ( self._pos, start - 1 ) )
+        if end >= 0:
+            self._completeEnd = end + len_footer
+
+
+    def _checkWaterMarks ( self, incomplete = False ):
+        """
+        I pause or resume the reading if a water mark has been crossed.
+        incomplete is True when all that is left is an incomplete frame.
+        """
+        if self.paused:
+            if self._highWater is None or incomplete or \
+               self._completeLen() <= self._lowWater:
+                self.paused = False
+                if self._resume is not None:
+                    self._resume()
+        elif self._highWater is not None and not incomplete and \
+             self._completeLen() >= self._highWater:
+            self.paused = True
+            if self._pause is not None:
+                self._pause()
+
+
+    def _limitExceeded ( self, what, size, limit ):
+        """
+        I throw the buffer away and report the exceeded limit.
+        """
+        self._reset()
+        self._stream = None
+        self._checkWaterMarks()
+        error = LimitExceeded ( what, size, limit )
+        if self.onLimit is None:
+            raise error
+        self.onLimit ( error )
+        return ( 0, 0 )
+
+
     def appendData ( self, data ):
         """
         I should be called by a transport that receives a raw
         sequence of bytes that may or may not contain a complete
         message. I return
+
+        In binary mode data can be any bytes-like object, e.g. a
+        memoryview of the buffer a socket was read into with recv_into,
+        which is copied straight into my buffer. In text mode it is
+        encoded as UTF-8 first.
         """
         # log.msg ( "Received [%s] bytes in dataReceived()" % ( len ( data ), ) )
         # import pprint
         # pprint.pprint ( data )
-        self.buffer += data
+        if not self.binary:
+            data = data.encode ( 'utf-8' )
+        start = len ( self._buf )
+        self._buf += data
+        # Only the new data (and the byte before it, in case a '\x00\n'
+        # straddles the two) needs searching for terminators.
+        self._noteTerminators ( start )
+        if self.maxBufferBytes is not None and \
+           self.bufferLen() > self.maxBufferBytes:
+            # Complete frames are about to be pulled off, so only the
+            # incomplete one after the last terminator counts.
+            self._checkBufferLimit ( self._tailLen() )
+        if self._highWater is not None and not self.paused:
+            self._checkWaterMarks()
+
+
+    def _tailLen ( self ):
+        """
+        I return the length of the buffer after the last '\x00\n', which
+        is where the incomplete frame (if any) starts.
+        """
+        return len ( self._buf ) - max ( self._pos, self._completeEnd )
+
+
+    def _checkBufferLimit ( self, size ):
+        """
+        I report the buffer limit as exceeded if size is over it.
+        """
+        if self.maxBufferBytes is not None and size > self.maxBufferBytes:
+            self._limitExceeded ( 'buffer', size, self.maxBufferBytes )
 
 
     def getOneMessage ( self ):
@@ -73,18 +352,122 @@ class StompBuffer ( object ):
         return None.
 
         Note that the buffer can contain more than once message. You
-        should therefore call me in a loop until I return None.
+        should therefore call me in a loop until I return None, or call
+        getAllMessages instead.
+        """
+        msg = self._takeMessage()
+        self._compact()
+        return msg
+
+
+    def getAllMessages ( self ):
+        """
+        I pull every complete message off the buffer in a single pass and
+        return them as a list of dicts (see getOneMessage), which is empty
+        if there is no complete message in the buffer. The buffer is only
+        compacted once, after the last message has been taken.
+        """
+        messages = []
+        msg = self._takeMessage()
+        while msg is not None:
+            messages.append ( msg )
+            msg = self._takeMessage()
+        self._compact()
+        return messages
+
+
+    def iterMessages ( self ):
+        """
+        I am the generator version of getAllMessages: I yield each complete
+        message in the buffer in turn, compacting the buffer once I am
+        exhausted (or closed).
+        """
+        try:
+            msg = self._takeMessage()
+            while msg is not None:
+                yield msg
+                msg = self._takeMessage()
+        finally:
+            self._compact()
+
+
+    def _takeMessage ( self ):
         """
-        ( mbytes, hbytes ) = self._findMessageBytes ( self.buffer )
+        I pull the first complete message off the buffer without compacting
+        it, returning None if there isn't one.
+        """
+        if self._stream is not None:
+            return self._streamBody()
+
+        ( mbytes, hbytes ) = self._findMessageBytes()
+        if self._hdrLen >= 0 and self._streams ( self._contentLength ):
+            self._startStream()
+            return self._streamBody()
         if not mbytes:
+            # What is left is an incomplete frame (a '\x00\n' in a body
+            # can make _tailLen underestimate it), so check it in full.
+            self._checkBufferLimit ( self.bufferLen() )
+            if self.paused:
+                self._checkWaterMarks ( incomplete = True )
             return None
-        
-        msgdata = self.buffer[:mbytes]
-        self.buffer = self.buffer[mbytes:]
-        hdata = msgdata[:hbytes]
-        elems = hdata.split ( '\n' )
+
+        start = self._pos
+        # hbytes points to the start of the '\n\n' at the end of the header,
+        # so 2 bytes beyond this is the start of the body. The body EXCLUDES
+        # the final two bytes, which are '\x00\n'. Note that these 2 bytes
+        # are UNRELATED to the 2-byte '\n\n' that Frame.pack() used to insert
+        # into the data stream.
+        body_start = start + hbytes + len_sep
+        body_end   = start + mbytes - len_footer
+        body = self._slice ( body_start, body_end )
+        header = self._header
+        self._consume ( mbytes )
+
+        if self.lazy:
+            cmd = header.split ( '\n', 1 ) [0]
+            headers = None
+        else:
+            ( cmd, headers ) = self._parseHeader ( header )
+        if self.stats is not None:
+            self.stats.frameReceived ( cmd, mbytes )
+        return self._makeMessage ( cmd, header, headers, body )
+
+
+    def _streams ( self, contentLength ):
+        """
+        I return True if a body of contentLength bytes is to be streamed.
+        """
+        return self.sinkFactory is not None and contentLength is not None \
+               and contentLength >= self.streamThreshold
+
+
+    def _slice ( self, start, end ):
+        """
+        I return a copy of part of the buffer, as bytes in binary mode
+        and decoded text otherwise.
+        """
+        view = memoryview ( self._buf )
+        try:
+            data = view[start:end].tobytes()
+        finally:
+            view.release()
+        if self.binary:
+            return data
+        return data.decode ( 'utf-8' )
+
+
+    def _parseHeader ( self, header ):
+        """
+        I split a header block into the command and a dict of the headers.
+        """
+        elems = header.split ( '\n' )
         cmd     = elems.pop ( 0 )
         headers = {}
+        # Only unescape the headers (as STOMP 1.1 does for everything but
+        # CONNECT and CONNECTED) if there is any escaping to undo.
+        unescape = '\\' in header and \
+                   cmd not in stomper.stomp_11.UNESCAPED_COMMANDS
+        interner = self.interner
         # We can't use a simple split because the value can legally contain
         # colon characters (for example, the session returned by ActiveMQ).
         for e in elems:
@@ -94,14 +477,25 @@ class StompBuffer ( object ):
                 continue
             k = e[:i].strip()
             v = e[i+1:].strip()
+            if unescape:
+                k = stomper.unescape_header ( k )
+                v = stomper.unescape_header ( v )
+            if interner is not None:
+                k, v = interner.header ( k, v )
             headers [ k ] = v
+        return ( cmd, headers )
+
+
+    def _makeMessage ( self, cmd, header, headers, body ):
+        """
+        I build the message returned for a frame in the form asked for.
+        """
+        if self.lazy:
+            return stomper.LazyFrame ( cmd, header, body )
+
+        if self.compact:
+            return stomper.FrameRecord ( cmd, headers, body )
 
-        # hbytes points to the start of the '\n\n' at the end of the header,
-        # so 2 bytes beyond this is the start of the body. The body EXCLUDES
-        # the final two bytes, which are '\x00\n'. Note that these 2 bytes
-        # are UNRELATED to the 2-byte '\n\n' that Frame.pack() used to insert
-        # into the data stream.
-        body = msgdata[hbytes+2:-2]
         msg = { 'cmd'     : cmd,
                 'headers' : headers,
                 'body'    : body,
@@ -109,9 +503,88 @@ class StompBuffer ( object ):
         return msg
 
 
-    def _findMessageBytes ( self, data ):
+    def _startStream ( self ):
         """
-        I examine the data passed to me and return a 2-tuple of the form:
+        I start streaming the body of the frame at the front of the buffer,
+        whose header is complete, to a new sink.
+        """
+        header = self._header
+        length = self._contentLength
+        ( cmd, headers ) = self._parseHeader ( header )
+        sink = self.sinkFactory ( cmd, headers )
+        # In text mode a piece of the body can end part way through a
+        # character, which the incremental decoder holds on to.
+        decoder = None
+        if not self.binary:
+            decoder = codecs.getincrementaldecoder ( 'utf-8' ) ()
+        self._stream = [ cmd, header, headers, sink, length,
+                         self._hdrLen + len_sep + length + len_footer,
+                         decoder ]
+        self._consume ( self._hdrLen + len_sep )
+
+
+    def _streamBody ( self ):
+        """
+        I hand whatever has arrived of the body being streamed to its sink
+        and return the message once the terminator is in, else None.
+        """
+        stream = self._stream
+        left = stream[4]
+        if left:
+            n = min ( left, self.bufferLen() )
+            if not n:
+                return None
+            view = memoryview ( self._buf )
+            try:
+                piece = view[self._pos:self._pos + n].tobytes()
+            finally:
+                view.release()
+            left = stream[4] = left - n
+            if stream[6] is not None:
+                piece = stream[6].decode ( piece, not left )
+            stream[3].write ( piece )
+            self._consume ( n )
+            if left:
+                return None
+
+        if self.bufferLen() < len_footer:
+            return None
+        self._consume ( len_footer )
+        self._stream = None
+
+        ( cmd, header, headers, sink, left, mbytes, decoder ) = stream
+        if self.stats is not None:
+            self.stats.frameReceived ( cmd, mbytes )
+        return self._makeMessage ( cmd, header, headers, sink )
+
+
+    def _consume ( self, nbytes ):
+        """
+        I mark nbytes at the front of the buffer as consumed.
+        """
+        self._pos += nbytes
+        self._resetScan()
+        if self._pos >= len ( self._buf ):
+            # Everything has been consumed; start afresh for free.
+            self._reset()
+        if self.paused:
+            self._checkWaterMarks()
+
+
+    def _compact ( self ):
+        """
+        I drop the consumed part of the buffer once enough of it has built
+        up.
+        """
+        if self._pos >= COMPACT_THRESHOLD and self._pos * 2 >= len ( self._buf ):
+            del self._buf[:self._pos]
+            self._completeEnd = max ( 0, self._completeEnd - self._pos )
+            self._pos = 0
+
+
+    def _findMessageBytes ( self ):
+        """
+        I examine the buffer and return a 2-tuple of the form:
         
           ( message_length, header_length )
           
@@ -121,62 +594,93 @@ class StompBuffer ( object ):
         
         If message_length is non-zero, header_length contains the length in
         bytes of the header. If message_length is zero, header_length should
-        be ignored.
+        be ignored. Both lengths are relative to the current read offset.
 
         You should probably not call me directly. Call getOneMessage instead.
         """
 
-        # Sanity check. See the docstring for the method to see what it
-        # does an why we need it.
-        self.syncBuffer()
-        
-        # If the string '\n\n' does not exist, we don't even have the complete
-        # header yet and we MUST exit.
-        try:
-            i = data.index ( '\n\n' )
-        except ValueError:
-            return ( 0, 0 )
-        # If the string '\n\n' exists, then we have the entire header and can
-        # check for the content-length header. If it exists, we can check
-        # the length of the buffer for the number of bytes, else we check for
-        # the existence of a null byte.
-
-        # Pull out the header before we perform the regexp search. This
-        # prevents us from matching (possibly malicious) strings in the
-        # body.
-        _hdr = self.buffer[:i]
-        match = content_length_re.search ( _hdr )
-        if match:
-            # There was a content-length header, so read out the value.
-            content_length = int ( match.groups()[0] )
-
-            # THIS IS NO LONGER THE CASE IF WE REMOVE THE '\n\n' in
-            # Frame.pack()
-            
+        tokens = self._tokens
+        if not self._synced and (
+                self._buf.startswith ( tokens.eol, self._pos ) or
+                self._buf.startswith ( tokens.cr, self._pos ) ):
+            self._skipHeartbeats()
+
+        data = self._buf
+        start = self._pos
+
+        if self._hdrLen < 0:
+            # If the string '\n\n' does not exist, we don't even have the
+            # complete header yet and we MUST exit. The search carries on
+            # from where the last one stopped, backing up one byte in case
+            # the separator straddles the previous end of the buffer.
+            i = data.find ( tokens.sep, start + self._hdrScan )
+            if not self._synced:
+                # Sanity check the command line of the frame, once. When
+                # the whole header is in this is just a set lookup of its
+                # first line; syncBuffer (see its docstring) only runs if
+                # that is bad or the header is still incomplete.
+                if i >= 0:
+                    nl = data.find ( tokens.eol, start, i )
+                    if nl < 0:
+                        nl = i
+                    cmd = bytes ( data[start:nl] )
+                    self._synced = cmd in tokens.commands
+                if not self._synced and start < len ( data ) and \
+                   self.syncBuffer():
+                    # Rubbish was skipped, so start again on what is left.
+                    return self._findMessageBytes()
+            maxHeader = self.maxHeaderBytes
+            if i < 0:
+                if maxHeader is not None and self.bufferLen() > maxHeader:
+                    return self._limitExceeded ( 'header', self.bufferLen(),
+                                                 maxHeader )
+                self._hdrScan = max ( 0, self.bufferLen() - 1 )
+                return ( 0, 0 )
+            if maxHeader is not None and i - start > maxHeader:
+                return self._limitExceeded ( 'header', i - start, maxHeader )
+            # If the string '\n\n' exists, then we have the entire header
+            # and can check for the content-length header. If it exists, we
+            # can check the length of the buffer for the number of bytes,
+            # else we check for the existence of a null byte.
+
+            # Pull out the header before we perform the regexp search. This
+            # prevents us from matching (possibly malicious) strings in the
+            # body.
+            _hdr = data[start:i].decode ( 'utf-8' )
+            match = content_length_re.search ( _hdr )
+            if match:
+                # There was a content-length header, so read out the value.
+                length = int ( match.groups()[0] )
+                # Refuse an oversized body before any of it is buffered.
+                if self.maxBodyBytes is not None and \
+                   length > self.maxBodyBytes and not self._streams ( length ):
+                    return self._limitExceeded ( 'body', length,
+                                                 self.maxBodyBytes )
+                self._contentLength = length
+            self._header = _hdr
+            # From here on this is the count of bytes in the header, which
+            # is where the body search starts.
+            self._hdrLen = i - start
+            self._nulScan = self._hdrLen
+
+        i = self._hdrLen
+        if self._contentLength is not None:
             # This is the content length of the body up until the null
-            # byte, not the entire message. Note that this INCLUDES the 2
-            # '\n\n' bytes inserted by the STOMP encoder after the body
-            # (see the calculation of content_length in
-            # StompEngine.callRemote()), so we only need to add 2 final bytes
-            # for the footer.
+            # byte, not the entire message.
             #
             #The message looks like:
             #
-            #   <header>\n\n<body>\n\n\x00\n
-            #           ^         ^^^^
-            #          (i)         included in content_length!
+            #   <header>\n\n<body>\x00\n
+            #           ^
+            #          (i)
             #
             # We have the location of the end of the header (i), so we
             # need to ensure that the message contains at least:
             #
             #     i + len ( '\n\n' ) + content_length + len ( '\x00\n' )
             #
-            # Note that i is also the count of bytes in the header, because
-            # of the fact that str.index() returns a 0-indexed value.
-            req_len = i + len_sep + content_length + len_footer
-            # log.msg ( "We have [%s] bytes and need [%s] bytes" %
-            #           ( len ( data ), req_len, ) )
-            if len ( data ) < req_len:
+            req_len = i + len_sep + self._contentLength + len_footer
+            if self.bufferLen() < req_len:
                 # We don't have enough bytes in the buffer.
                 return ( 0, 0 )
             else:
@@ -184,15 +688,53 @@ class StompBuffer ( object ):
                 return ( req_len, i )
         else:
             # There was no content-length header, so just look for the
-            # message terminator ('\x00\n' ).
-            try:
-                j = data.index ( '\x00\n' )
-            except ValueError:
+            # message terminator ('\x00\n' ), carrying on from where the
+            # last search stopped.
+            j = data.find ( tokens.footer, start + self._nulScan )
+            maxBody = self.maxBodyBytes
+            if j < 0:
+                if maxBody is not None and \
+                   self.bufferLen() - i - len_sep > maxBody:
+                    return self._limitExceeded (
+                        'body', self.bufferLen() - i - len_sep, maxBody )
+                self._nulScan = max ( i, self.bufferLen() - 1 )
                 return ( 0, 0 )
+            if maxBody is not None and j - start - i - len_sep > maxBody:
+                return self._limitExceeded (
+                    'body', j - start - i - len_sep, maxBody )
             # j points to the 0-indexed location of the null byte. However,
             # we need to add 1 (to turn it into a byte count) and 1 to take
             # account of the final '\n' character after the null byte.
-            return ( j + 2, i )
+            return ( j - start + 2, i )
+
+
+    def _skipHeartbeats ( self ):
+        """
+        I consume the heart-beat EOLs at the front of the buffer, where a
+        frame would start, reporting each to onHeartbeat.
+        """
+        data = self._buf
+        tokens = self._tokens
+        pos = self._pos
+        end = len ( data )
+        count = 0
+        while pos < end:
+            if data.startswith ( tokens.eol, pos ):
+                pos += 1
+            elif data.startswith ( tokens.cr, pos ) and \
+                 data.startswith ( tokens.eol, pos + 1 ):
+                pos += 2
+            else:
+                # A lone '\r' may be followed by its '\n' later.
+                break
+            count += 1
+
+        if count:
+            self._consume ( pos - self._pos )
+            if self.onHeartbeat is not None:
+                now = self.clock()
+                for i in range ( count ):
+                    self.onHeartbeat ( now )
 
 
     def syncBuffer( self ):
@@ -230,35 +772,58 @@ class StompBuffer ( object ):
         a buffer containing the string 'BUNK' with no newline is clearly
         corrupt, but we sit and wait until the buffer contains a newline before
         attempting to see if it's a STOMP command.
+
+        Heart-beat EOLs at the front of the buffer, including those after
+        a skipped '\x00\n', are consumed as heart-beats rather than being
+        taken for corruption.
+
+        I am only called when the command line of a frame fails to check
+        out (or can't be checked yet), never for a frame known to be good.
+        I return the number of bytes skipped, which are also counted by
+        the stats instance if there is one.
         """
+        tokens = self._tokens
+        skipped = 0
         while True:
-            if not self.buffer:
+            # A frame boundary may be followed by heart-beats, which would
+            # otherwise look like an empty (and so bad) command line.
+            self._skipHeartbeats()
+            if self.bufferIsEmpty():
                 # Buffer is empty; no need to do anything.
                 break
-            m = command_re.match ( self.buffer )
-            if m is None:
+            nl = self._buf.find ( tokens.eol, self._pos )
+            if nl < 0:
                 # Buffer doesn't even contain a single newline, so we can't
                 # determine whether it's corrupt or not. Assume it's OK.
                 break
-            cmd = m.groups()[0]
-            if cmd in stomper.VALID_COMMANDS:
+            cmd = bytes ( self._buf[self._pos:nl] )
+            if cmd in tokens.commands:
                 # Good: the buffer starts with a command.
+                self._synced = True
                 break
             else:
-                # Bad: the buffer starts with bunk, so strip it out. We first
-                # try to strip to the first occurrence of '\x00\n', which
-                # is likely to be a frame boundary, but if this fails, we
-                # strip until the first newline.
-                ( self.buffer, nsubs ) = sync_re.subn ( '', self.buffer )
-
-                if nsubs:
+                # Bad: the buffer starts with bunk, so strip it out. We
+                # find the first '\x00\n' after the read offset and strip
+                # up to and including it, as it is likely to be a frame
+                # boundary.
+                end = self._buf.find ( tokens.footer, self._pos )
+                if end >= 0:
                     # Good: we managed to strip something out, so restart the
                     # loop to see if things look better.
+                    n = end + len_footer - self._pos
+                    if self.stats is not None:
+                        self.stats.resync ( n )
+                    self._consume ( n )
+                    skipped += n
                     continue
                 else:
                     # Bad: we failed to strip anything out, so kill the
                     # entire buffer. Since this resets the buffer to a
                     # known good state, we can break out of the loop.
-                    self.buffer = ''
+                    n = self.bufferLen()
+                    if self.stats is not None:
+                        self.stats.resync ( n )
+                    self._reset()
+                    skipped += n
                     break
-
+        return skipped
@@ -0,0 +1,326 @@
+"""
+A selectors based socket client for stomper, with no framework needed.
+
+StompClient drives a sans-IO StompConnection over a non-blocking socket.
+Received data is read with recv_into(...) into a buffer allocated once
+and appended to the StompBuffer straight from it, so no bytes object is
+created per read. The frames waiting to be sent are batched up by the
+connection and written out together.
+
+It can be used in a blocking fashion e.g.
+
+    with StompClient('localhost', 61613) as client:
+        client.connect('bob', '123')
+        client.subscribe('/queue/a', 1, ack='client')
+        client.send('/queue/a', 'hello')
+        for event in client.poll(1.0):
+            if isinstance(event, connection.MessageReceived):
+                print(event.body)
+        client.disconnect()
+
+or from an existing event loop by registering fileno() for reading and
+calling poll(0) when it is readable, and whenever wantsWrite() is True
+for writing.
+
+Received frames are handed to the Engine as usual, and heart-beats are
+sent and checked, and receipts timed out, as part of poll(...).
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import time
+import socket
+import selectors
+
+from . import stomp_11
+from . import connection
+
+
+# The connection is treated as dead once nothing has been received for
+# this many receive heart-beat intervals:
+GRACE = 2.0
+
+
+class StompClient(object):
+    """This class is a STOMP client over a socket.
+
+    host, port:
+        The server to connect to when open() is called.
+
+    engine:
+        This is the Engine (or subclass) instance used to react to
+        received frames. If not given a plain Engine is used.
+
+    stompBuffer:
+        This is the binary StompBuffer received data is fed through. If
+        not given a plain one is used.
+
+    bufferSize:
+        The size of the buffer received data is read into.
+
+    clock:
+        The function returning the current time in seconds.
+
+    """
+    def __init__(self, host='localhost', port=61613, engine=None,
+                 stompBuffer=None, bufferSize=64 * 1024, clock=time.monotonic):
+        """Setup the internal state."""
+        self.host = host
+        self.port = port
+        self.clock = clock
+        self.connection = connection.StompConnection(engine, stompBuffer)
+        self.sock = None
+        self.selector = None
+
+        self._recvBuffer = bytearray(bufferSize)
+        self._recvView = memoryview(self._recvBuffer)
+        self._outbound = bytearray()
+        self._backlog = []
+        self._lastSent = 0
+        self._lastReceived = 0
+
+    @property
+    def engine(self):
+        return self.connection.engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # The socket:
+
+    def open(self, sock=None, timeout=None):
+        """Connect the socket to the server, or use the given connected
+        socket instead.
+        """
+        if sock is None:
+            sock = socket.create_connection((self.host, self.port), timeout)
+        sock.setblocking(False)
+        self.sock = sock
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        self._lastSent = self._lastReceived = self.clock()
+
+    def close(self):
+        """Close the socket."""
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self.connection.connectionLost()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def wantsWrite(self):
+        """Return True if there is data waiting for the socket to be
+        writable."""
+        return bool(self._outbound) or self.connection.outboundLen() > 0
+
+    def _read(self):
+        """Read what is available and return its events."""
+        try:
+            nbytes = self.sock.recv_into(self._recvBuffer)
+        except (BlockingIOError, InterruptedError):
+            return []
+
+        self._lastReceived = self.clock()
+        events = self.connection.receiveData(self._recvView[:nbytes])
+        if not nbytes:
+            self.close()
+
+        return events
+
+    def flush(self):
+        """Write as much of the waiting data as the socket will take.
+        Whatever is left is written once the socket is writable again.
+        """
+        if self.sock is None:
+            return
+
+        if self.connection.outboundLen():
+            self._outbound += self.connection.dataToSend()
+
+        if self._outbound:
+            try:
+                sent = self.sock.send(self._outbound)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            if sent:
+                del self._outbound[:sent]
+                self._lastSent = self.clock()
+
+        events = selectors.EVENT_READ
+        if self._outbound:
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(self.sock).events != events:
+            self.selector.modify(self.sock, events)
+
+    # Heart-beats:
+
+    def _heartbeatTimeout(self, now):
+        """Return the seconds until heart-beating next needs attention,
+        or None if there is no heart-beating."""
+        send, receive = self.connection.heartbeats
+        deadlines = []
+        if send:
+            deadlines.append(self._lastSent + send / 1000.0)
+        if receive:
+            deadlines.append(self._lastReceived + receive / 1000.0 * GRACE)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - now)
+
+    def _checkHeartbeats(self, now):
+        """Send a heart-beat if one is due and close the connection if the
+        server has gone quiet.
+
+        returned:
+            The events resulting.
+
+        """
+        send, receive = self.connection.heartbeats
+        if receive and now - self._lastReceived > receive / 1000.0 * GRACE:
+            self.close()
+            return [connection.ConnectionClosed()]
+        if send and now - self._lastSent >= send / 1000.0 and \
+           not self.wantsWrite():
+            self.connection.sendHeartbeat()
+        return []
+
+    # Driving the connection:
+
+    def poll(self, timeout=0):
+        """Wait up to timeout seconds (None for ever) for something to
+        happen, reading and writing whatever the socket is ready for.
+
+        returned:
+            The list of events that resulted.
+
+        """
+        events, self._backlog = self._backlog, []
+        if events:
+            timeout = 0
+        if self.sock is None:
+            return events
+
+        self.flush()
+        now = self.clock()
+        due = self._heartbeatTimeout(now)
+        if due is not None and (timeout is None or due < timeout):
+            timeout = due
+        deadline = self.connection.receipts.nextDeadline()
+        if deadline is not None:
+            due = max(0, deadline - now)
+            if timeout is None or due < timeout:
+                timeout = due
+
+        for key, mask in self.selector.select(timeout):
+            if mask & selectors.EVENT_READ:
+                events.extend(self._read())
+            if self.sock is not None and mask & selectors.EVENT_WRITE:
+                self.flush()
+
+        self.connection.receipts.expire()
+        if self.sock is not None:
+            events.extend(self._checkHeartbeats(self.clock()))
+        if self.sock is not None:
+            # Send whatever the engine responded with.
+            self.flush()
+
+        return events
+
+    def waitFor(self, test, timeout=None):
+        """Poll until an event passes test(event), which is returned. The
+        other events are kept for the next poll(...).
+
+        If the timeout (in seconds) runs out socket.timeout is raised. If
+        the connection closes first ConnectionError is raised.
+
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = self.clock() + timeout
+
+        kept = []
+        try:
+            while True:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        raise socket.timeout(
+                            "Timed out waiting for the server.")
+
+                events = self.poll(remaining)
+                for i, event in enumerate(events):
+                    if test(event):
+                        kept.extend(events[i + 1:])
+                        return event
+                    kept.append(event)
+                    if isinstance(event, connection.ConnectionClosed):
+                        raise ConnectionError("The connection was closed.")
+
+                if self.sock is None:
+                    raise ConnectionError("The connection was closed.")
+        finally:
+            self._backlog = kept + self._backlog
+
+    # Frames:
+
+    def connect(self, username='', password='', vhost=None,
+                heartbeats=(0, 0), timeout=None):
+        """Open the socket if needed, send the CONNECT frame and wait for
+        the server to accept it. If it sends an ERROR frame instead
+        FrameError is raised.
+
+        returned:
+            The Connected event.
+
+        """
+        if self.sock is None:
+            self.open(timeout=timeout)
+
+        self.connection.connect(
+            username, password, vhost or self.host, heartbeats)
+        event = self.waitFor(
+            lambda e: isinstance(e, (connection.Connected,
+                                     connection.ErrorReceived)),
+            timeout)
+
+        if isinstance(event, connection.ErrorReceived):
+            self.close()
+            raise stomp_11.FrameError("Connect failed: %s" % event.message)
+
+        return event
+
+    def subscribe(self, dest, idx, ack='auto', headers=None):
+        """Subscribe to a destination, see stomper.subscribe(...)."""
+        self.connection.subscribe(dest, idx, ack, headers)
+        self.flush()
+
+    def unsubscribe(self, idx):
+        """Cancel a subscription, see stomper.unsubscribe(...)."""
+        self.connection.unsubscribe(idx)
+        self.flush()
+
+    def send(self, dest, msg, transactionid=None, content_type='text/plain'):
+        """Send a message, see stomper.send(...)."""
+        self.connection.send(dest, msg, transactionid, content_type)
+        self.flush()
+
+    def disconnect(self, receipt=None, timeout=None):
+        """Send the DISCONNECT frame, wait for the server to confirm it
+        and close the socket.
+        """
+        self.connection.disconnect(receipt)
+        try:
+            self.waitFor(
+                lambda e: isinstance(e, connection.Disconnected), timeout)
+        finally:
+            self.close()
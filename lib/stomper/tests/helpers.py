@@ -0,0 +1,44 @@
+"""
+The frames and fakes shared by the unittests.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import stomper
+from stomper.stompbuffer import StompBuffer
+
+
+def message_frame(messageid='m1', subscription='1', destination='/queue/a',
+                  body='hi'):
+    """Return the text of a MESSAGE frame."""
+    return "MESSAGE\nsubscription:%s\nmessage-id:%s\ndestination:%s\n\n%s\x00\n" % (
+        subscription, messageid, destination, body)
+
+
+def message(messageid='m1', subscription='1', destination='/queue/a',
+            body='hi'):
+    """Return a MESSAGE frame as unpack_frame(...) returns it."""
+    return stomper.unpack_frame(
+        message_frame(messageid, subscription, destination, body))
+
+
+def parse_frames(data):
+    """Return the frames in data (text or bytes), as a server would see
+    the data sent by a client.
+    """
+    sb = StompBuffer(binary=isinstance(data, bytes))
+    sb.appendData(data)
+    return sb.getAllMessages()
+
+
+class Clock(object):
+    """A clock for the clock arguments, which moves on by step seconds
+    each time it is read and can be set through now.
+    """
+    def __init__(self, now=0.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
@@ -0,0 +1,61 @@
+"""
+This is the unittest to verify the acknowledgement batching.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.ackbatch import AckBatcher
+from stomper.tests.helpers import message
+
+
+class AckBatcherTest(unittest.TestCase):
+
+    def testClientIndividual(self):
+        acks = AckBatcher(maxCount=3, maxDelay=1.0)
+        self.assertEqual(acks.add('m1', 1, now=0), '')
+        self.assertEqual(acks.add('m2', 1, 't1', now=0), '')
+        self.assertEqual(len(acks), 2)
+        correct = (
+            stomper.ack('m1', 1) + stomper.ack('m2', 1, 't1') + stomper.ack('m3', 2))
+        self.assertEqual(acks.add('m3', 2, now=0), correct)
+        self.assertEqual(len(acks), 0)
+        self.assertEqual(acks.flush(), '')
+
+    def testClientCumulative(self):
+        acks = AckBatcher(maxCount=20, maxDelay=1.0)
+        acks.setMode(1, 'client')
+        for i in range(5):
+            acks.add('m%d' % i, 1, now=0)
+            acks.add('n%d' % i, 2, now=0)
+        acks.add('t1', 1, 'tx', now=0)
+
+        self.assertEqual(len(acks), 11)
+        correct = (
+            stomper.ack('m4', 1) + stomper.ack('t1', 1, 'tx') +
+            ''.join([stomper.ack('n%d' % i, 2) for i in range(5)]))
+        self.assertEqual(acks.flush(), correct)
+
+        self.assertRaises(ValueError, acks.setMode, 1, 'auto')
+
+    def testPoll(self):
+        acks = AckBatcher(maxCount=10, maxDelay=1.0)
+        self.assertFalse(acks.due(now=100))
+        self.assertEqual(acks.poll(now=100), '')
+
+        acks.add('m1', 1, now=10)
+        acks.add('m2', 1, now=10.5)
+        self.assertEqual(acks.poll(now=10.9), '')
+        self.assertEqual(acks.poll(now=11), stomper.ack('m1', 1) + stomper.ack('m2', 1))
+        self.assertFalse(acks.due(now=100))
+
+    def testAddMessage(self):
+        acks = AckBatcher(maxCount=1)
+        msg = message()
+        self.assertEqual(acks.addMessage(msg), stomper.Engine().react(msg))
+
+
+if __name__ == "__main__":
+    unittest.main()
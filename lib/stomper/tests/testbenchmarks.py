@@ -0,0 +1,48 @@
+"""
+This is the unittest to check the benchmarks run.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from stomper import benchmarks
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def testRun(self):
+        results = benchmarks.run(sizes=[0, 100], chunks=[None, 1], minTime=0)
+        names = set([result['name'] for result in results])
+        self.assertEqual(names, set([
+            'ack', 'Frame.pack', 'unpack_frame', 'send', 'StompConnection',
+            'StompBuffer']))
+        # ack + 4 per size + 2 chunks * 2 modes of StompBuffer per size:
+        self.assertEqual(len(results), 1 + 2 * 4 + 2 * 4)
+        for result in results:
+            self.assertTrue(result['frames_per_sec'] > 0)
+
+    def testMaxAppends(self):
+        results = benchmarks.run(sizes=[100], chunks=[1], minTime=0, maxAppends=10)
+        self.assertEqual([r for r in results if r['name'] == 'StompBuffer'], [])
+
+    def testMain(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmp, 'results.json')
+            benchmarks.main(
+                ['--quiet', '--sizes', '10', '--chunks', '0', '--min-time', '0',
+                 '--output', output])
+            with open(output) as fd:
+                saved = json.load(fd)
+            self.assertEqual(len(saved['results']), 7)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
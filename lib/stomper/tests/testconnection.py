@@ -0,0 +1,123 @@
+"""
+This is the unittest to verify the sans-IO StompConnection.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper import connection
+from stomper.tests.helpers import parse_frames
+
+
+class StompConnectionTest(unittest.TestCase):
+
+    def connected(self, heartbeats=(0, 0)):
+        conn = connection.StompConnection()
+        conn.connect('bob', '123', 'localhost', heartbeats)
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual(frames[0]['cmd'], 'CONNECT')
+        self.assertEqual(conn.state, connection.CONNECTING)
+
+        events = conn.receiveData(
+            b'CONNECTED\nversion:1.1\nsession:s1\nheart-beat:100,200\n\n\x00\n')
+        self.assertEqual(len(events), 1)
+        self.assertTrue(isinstance(events[0], connection.Connected))
+        self.assertEqual(events[0].session, 's1')
+        self.assertEqual(conn.state, connection.CONNECTED)
+        self.assertEqual(conn.sessionId, 's1')
+        return conn
+
+    def testConversation(self):
+        conn = self.connected((500, 100))
+        self.assertEqual(conn.heartbeats, (500, 100))
+
+        conn.subscribe('/queue/a', 1, ack='client')
+        conn.send('/queue/a', 'hello')
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual([f['cmd'] for f in frames], ['SUBSCRIBE', 'SEND'])
+        self.assertEqual(conn.subscriptions, {'1': ('/queue/a', 'client')})
+        self.assertEqual(conn.dataToSend(), b'')
+
+        events = conn.receiveData(
+            b'\nMESSAGE\nsubscription:1\nmessage-id:m1\ndestination:/queue/a\n'
+            b'content-length:5\n\nhello\x00\n')
+        self.assertEqual(
+            [e.__class__ for e in events],
+            [connection.HeartbeatReceived, connection.MessageReceived])
+        message = events[1]
+        self.assertEqual(message.messageId, 'm1')
+        self.assertEqual(message.destination, '/queue/a')
+        self.assertEqual(message.subscription, '1')
+        self.assertEqual(message.body, b'hello')
+
+        # The engine's ACK is waiting to be sent:
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual(frames[0]['cmd'], 'ACK')
+        self.assertEqual(frames[0]['headers']['message-id'], 'm1')
+
+        receipt = conn.disconnect()
+        self.assertEqual(conn.state, connection.DISCONNECTING)
+        self.assertTrue(receipt in conn.receipts)
+        self.assertTrue(conn.outboundLen() > 0)
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual(frames[0]['cmd'], 'DISCONNECT')
+        self.assertEqual(frames[0]['headers']['receipt'], receipt)
+
+        events = conn.receiveData(
+            ('RECEIPT\nreceipt-id:%s\n\n\x00\n' % receipt).encode('utf-8'))
+        self.assertTrue(isinstance(events[0], connection.Disconnected))
+        self.assertEqual(conn.state, connection.CLOSED)
+        self.assertEqual(len(conn.receipts), 0)
+
+    def testStateErrors(self):
+        conn = connection.StompConnection()
+        self.assertRaises(connection.StateError, conn.send, '/queue/a', 'hi')
+        conn.connect()
+        self.assertRaises(connection.StateError, conn.connect)
+        self.assertRaises(stomper.FrameError, conn.subscribe, '/queue/a', 1)
+
+        events = conn.receiveData(b'ERROR\nmessage:bad login\n\n\x00\n')
+        self.assertTrue(isinstance(events[0], connection.ErrorReceived))
+        self.assertEqual(events[0].message, 'bad login')
+        self.assertEqual(conn.state, connection.CLOSED)
+
+    def testConnectionClosed(self):
+        conn = self.connected()
+        events = conn.receiveData(b'')
+        self.assertTrue(isinstance(events[0], connection.ConnectionClosed))
+        self.assertEqual(conn.state, connection.CLOSED)
+
+    def testReceipts(self):
+        conn = self.connected()
+        future = conn.sendFrame(stomper.send('/queue/a', 'hi'), receipt='r1')
+        lost = conn.sendFrame(stomper.send('/queue/a', 'hi'), receipt=True)
+        self.assertEqual(conn.sendFrame(stomper.send('/queue/a', 'hi')), None)
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual(frames[0]['headers']['receipt'], 'r1')
+        self.assertTrue(frames[1]['headers']['receipt'] in conn.receipts)
+        self.assertFalse('receipt' in frames[2]['headers'])
+
+        events = conn.receiveData(b'RECEIPT\nreceipt-id:r1\n\n\x00\n')
+        self.assertEqual(events[0].receiptId, 'r1')
+        self.assertEqual(future.result(0)['cmd'], 'RECEIPT')
+
+        conn.receiveData(b'')
+        self.assertTrue(isinstance(lost.exception(0), ConnectionError))
+
+    def testTransactions(self):
+        conn = self.connected()
+        transactionid = conn.begin()
+        conn.send('/queue/a', 'hi', transactionid)
+        conn.commit(transactionid)
+        conn.sendHeartbeat()
+        frames = parse_frames(conn.dataToSend())
+        self.assertEqual(
+            [f['cmd'] for f in frames], ['BEGIN', 'SEND', 'COMMIT'])
+        for f in frames:
+            self.assertEqual(f['headers']['transaction'], transactionid)
+
+
+if __name__ == "__main__":
+    unittest.main()
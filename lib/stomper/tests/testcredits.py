@@ -0,0 +1,60 @@
+"""
+This is the unittest to verify the credit based flow control.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.credits import CreditManager
+from stomper.tests.helpers import message
+
+
+class CreditManagerTest(unittest.TestCase):
+
+    def testHoldAndRelease(self):
+        credits = CreditManager(limit=2, lowWater=1)
+        self.assertEqual(credits.received(message('m1')), stomper.ack('m1', 1))
+        self.assertEqual(credits.received(message('m2')), stomper.ack('m2', 1))
+        self.assertFalse(credits.paused(1))
+
+        self.assertEqual(credits.received(message('m3')), '')
+        self.assertEqual(credits.received(message('m4')), '')
+        self.assertTrue(credits.paused(1))
+        self.assertEqual((credits.waiting(1), credits.held(1)), (4, 2))
+
+        # Other subscriptions aren't held back:
+        self.assertEqual(credits.received(message('n1', 2)), stomper.ack('n1', 2))
+
+        self.assertEqual(credits.processed(1), '')
+        self.assertEqual(credits.processed(1), '')
+        self.assertEqual(
+            credits.processedMessage(message('m3')),
+            stomper.ack('m3', 1) + stomper.ack('m4', 1))
+        self.assertFalse(credits.paused(1))
+        self.assertEqual(credits.waiting(1), 1)
+        self.assertEqual(credits.received(message('m5')), stomper.ack('m5', 1))
+
+    def testClientMode(self):
+        credits = CreditManager(limit=0)
+        credits.setMode(1, 'client')
+        for i in range(3):
+            self.assertEqual(credits.received(message('m%d' % i)), '')
+        self.assertEqual(credits.held(1), 1)
+        self.assertEqual(credits.processed(1, 3), stomper.ack('m2', 1))
+
+        self.assertRaises(ValueError, credits.setMode, 1, 'auto')
+        self.assertRaises(ValueError, CreditManager, 1, 2)
+
+    def testForget(self):
+        credits = CreditManager(limit=0)
+        credits.received(message('m1'))
+        credits.forget(1)
+        self.assertFalse(credits.paused(1))
+        self.assertEqual(credits.waiting(1), 0)
+        self.assertEqual(credits.processed(1), '')
+
+
+if __name__ == "__main__":
+    unittest.main()
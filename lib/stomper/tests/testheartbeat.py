@@ -0,0 +1,93 @@
+"""
+This is the unittest to verify the heart-beat negotiation and scheduling.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper import heartbeat
+from stomper.tests.helpers import Clock
+
+
+class HeartbeatTest(unittest.TestCase):
+
+    def testParse(self):
+        self.assertEqual(heartbeat.parse_heart_beat(None), (0, 0))
+        self.assertEqual(heartbeat.parse_heart_beat(''), (0, 0))
+        self.assertEqual(heartbeat.parse_heart_beat('10,20'), (10, 20))
+        self.assertRaises(ValueError, heartbeat.parse_heart_beat, '10')
+        self.assertRaises(ValueError, heartbeat.parse_heart_beat, 'a,b')
+        self.assertRaises(ValueError, heartbeat.parse_heart_beat, '-1,0')
+
+    def testNegotiate(self):
+        self.assertEqual(heartbeat.negotiate((0, 0), (1000, 1000)), (0, 0))
+        self.assertEqual(heartbeat.negotiate((1000, 1000), (0, 0)), (0, 0))
+        self.assertEqual(heartbeat.negotiate((1000, 500), '2000,300'), (1000, 2000))
+        self.assertEqual(heartbeat.negotiate((100, 0), (2000, 300)), (300, 0))
+
+    def testEngineConnected(self):
+        e = stomper.Engine()
+        e.react("CONNECTED\nsession:1\nheart-beat:500,1000\n\n\x00\n")
+        self.assertEqual(e.serverHeartbeats, (500, 1000))
+
+    def testManager(self):
+        clock = Clock(1000.0)
+        manager = heartbeat.HeartbeatManager(resolution=0.1, slots=8, clock=clock)
+        manager.register('a', 1000, 0)
+        manager.register('b', 0, 1000)
+        manager.register('c', 0, 0)
+        self.assertEqual(len(manager), 2)
+        self.assertFalse('c' in manager)
+
+        clock.now += 0.5
+        self.assertEqual(manager.tick(), ([], []))
+
+        # 'b' keeps receiving, 'a' needs a heart-beat.
+        manager.dataReceived('b')
+        clock.now += 0.55
+        self.assertEqual(manager.tick(), (['a'], []))
+        clock.now += 0.55
+        self.assertEqual(manager.tick(), ([], []))
+
+        # Sending data puts off the heart-beat.
+        manager.dataSent('a')
+        manager.dataReceived('b')
+        clock.now += 0.9
+        self.assertEqual(manager.tick(), ([], []))
+        clock.now += 0.2
+        self.assertEqual(manager.tick(), (['a'], []))
+
+        # 'b' has now been silent for over 2 seconds.
+        clock.now += 0.95
+        self.assertEqual(manager.tick(), ([], ['b']))
+        self.assertFalse('b' in manager)
+
+        manager.unregister('a')
+        clock.now += 10
+        self.assertEqual(manager.tick(), ([], []))
+        self.assertEqual(len(manager), 0)
+
+    def testManyConnections(self):
+        clock = Clock(1000.0)
+        manager = heartbeat.HeartbeatManager(resolution=0.1, slots=16, clock=clock)
+        for i in range(1000):
+            manager.register(i, 1000 + i, 0)
+
+        sent = []
+        for i in range(25):
+            clock.now += 0.1
+            sent.extend(manager.tick()[0])
+
+        # Each connection sent once, twice for those with short intervals.
+        counts = {}
+        for key in sent:
+            counts[key] = counts.get(key, 0) + 1
+        self.assertEqual(len(counts), 1000)
+        self.assertEqual(counts[0], 2)
+        self.assertEqual(counts[999], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+This is the unittest to verify the header string interning.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.interning import InternTable
+from stomper.stompbuffer import StompBuffer
+from stomper.tests.helpers import message_frame
+
+
+class InternTableTest(unittest.TestCase):
+
+    def testIntern(self):
+        table = InternTable(maxSize=2, maxLength=5)
+        a = ''.join(['a', 'b'])
+        b = ''.join(['a', 'b'])
+        self.assertFalse(a is b)
+        self.assertTrue(table.intern(a) is a)
+        self.assertTrue(table.intern(b) is a)
+        self.assertEqual(len(table), 1)
+
+        # Long strings are left alone:
+        self.assertEqual(table.intern('abcdef'), 'abcdef')
+        self.assertFalse('abcdef' in table)
+
+    def testLeastRecentlyUsedEviction(self):
+        table = InternTable(maxSize=2)
+        table.intern('a')
+        table.intern('b')
+        table.intern('a')
+        table.intern('c')
+        self.assertTrue('a' in table)
+        self.assertFalse('b' in table)
+        self.assertTrue('c' in table)
+        self.assertEqual(len(table), 2)
+
+        table.clear()
+        self.assertEqual(len(table), 0)
+
+    def testHeader(self):
+        table = InternTable()
+        table.header('destination', '/queue/a')
+        table.header('message-id', 'm1')
+        self.assertTrue('destination' in table)
+        self.assertTrue('/queue/a' in table)
+        self.assertTrue('message-id' in table)
+        self.assertFalse('m1' in table)
+
+    def testUnpackFrame(self):
+        table = InternTable()
+        first = stomper.unpack_frame(message_frame('m1'), interner=table)
+        second = stomper.unpack_frame(message_frame('m2'), interner=table)
+        self.assertTrue(
+            first['headers']['destination'] is second['headers']['destination'])
+        self.assertTrue(
+            first['headers']['subscription'] is second['headers']['subscription'])
+        self.assertEqual(second['headers']['message-id'], 'm2')
+        keys = dict([(k, k) for k in first['headers']])
+        for k in second['headers']:
+            self.assertTrue(keys[k] is k)
+
+    def testStompBuffer(self):
+        sb = StompBuffer(interner=InternTable())
+        sb.appendData(message_frame('m1') + message_frame('m2'))
+        first, second = sb.getAllMessages()
+        self.assertTrue(
+            first['headers']['destination'] is second['headers']['destination'])
+        self.assertEqual(second['headers']['message-id'], 'm2')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+This is the unittest to verify the receipt tracking and publish window.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+from concurrent.futures import TimeoutError
+
+import stomper
+from stomper.receipts import ReceiptTracker, PublishWindow
+from stomper.tests.helpers import Clock
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.clock = Clock()
+        self.receipts = ReceiptTracker(clock=self.clock)
+        self.sent = []
+
+    def sendFrame(self, frame, receipt=None, timeout=None):
+        receipt, future = self.receipts.track(None, timeout)
+        self.sent.append(receipt)
+        return future
+
+
+class ReceiptTrackerTest(unittest.TestCase):
+
+    def testTrack(self):
+        done = []
+        tracker = ReceiptTracker()
+        receipt, future = tracker.track('r1', callback=done.append)
+        self.assertEqual(receipt, 'r1')
+        self.assertTrue('r1' in tracker)
+        self.assertEqual(len(tracker), 1)
+        self.assertFalse(future.done())
+
+        self.assertFalse(tracker.received('other'))
+        self.assertTrue(tracker.receiptReceived(
+            stomper.unpack_frame('RECEIPT\nreceipt-id:r1\n\n\x00\n')))
+        self.assertEqual(future.result(0)['cmd'], 'RECEIPT')
+        self.assertEqual(done, [future])
+        self.assertEqual(len(tracker), 0)
+
+        receipt, future = tracker.track()
+        self.assertTrue(receipt in tracker)
+
+    def testExpire(self):
+        tracker = ReceiptTracker(timeout=1.0, clock=lambda: 10)
+        slow, slowFuture = tracker.track()
+        fast, fastFuture = tracker.track(timeout=0.5)
+        done, doneFuture = tracker.track(timeout=0.1)
+        tracker.received(done)
+        self.assertEqual(tracker.nextDeadline(), 10.5)
+
+        self.assertEqual(tracker.expire(10.6), [fast])
+        self.assertTrue(isinstance(fastFuture.exception(0), TimeoutError))
+        self.assertFalse(slowFuture.done())
+        self.assertEqual(tracker.expire(11), [slow])
+        self.assertEqual(tracker.nextDeadline(), None)
+        self.assertTrue(doneFuture.done())
+
+    def testFailAll(self):
+        tracker = ReceiptTracker()
+        receipt, future = tracker.track()
+        tracker.failAll(ConnectionError())
+        self.assertTrue(isinstance(future.exception(0), ConnectionError))
+        self.assertEqual(len(tracker), 0)
+
+    def testFailedAndCancel(self):
+        tracker = ReceiptTracker()
+        receipt, future = tracker.track('r1')
+        self.assertTrue(tracker.failed('r1', stomper.FrameError('nope')))
+        self.assertFalse(tracker.failed('r1', stomper.FrameError('nope')))
+        self.assertTrue(isinstance(future.exception(0), stomper.FrameError))
+
+        receipt, future = tracker.track('r2')
+        tracker.cancel('r2')
+        self.assertTrue(future.cancelled())
+        self.assertEqual(len(tracker), 0)
+
+        e = stomper.Engine()
+        receipt, future = e.receipts.track()
+        e.react('ERROR\nreceipt-id:%s\nmessage:nope\n\n\x00\n' % receipt)
+        self.assertTrue(isinstance(future.exception(0), stomper.FrameError))
+
+
+class PublishWindowTest(unittest.TestCase):
+
+    def testWindow(self):
+        conn = FakeConnection()
+        window = PublishWindow(conn, size=2)
+        futures = [window.publish('SEND\n\n%d\x00\n' % i) for i in range(5)]
+        self.assertEqual(len(conn.sent), 2)
+        self.assertEqual(window.inFlight, 2)
+        self.assertEqual(len(window), 5)
+        self.assertTrue(window.full())
+
+        conn.receipts.received(conn.sent[1], 'receipt 1')
+        self.assertEqual(futures[1].result(0), 'receipt 1')
+        self.assertFalse(futures[0].done())
+        self.assertEqual(len(conn.sent), 3)
+
+        # Each failure makes room for a waiting frame, which is sent:
+        conn.receipts.failAll(ConnectionError())
+        self.assertTrue(isinstance(futures[0].exception(0), ConnectionError))
+        self.assertTrue(isinstance(futures[2].exception(0), ConnectionError))
+        self.assertEqual(len(conn.sent), 5)
+        self.assertEqual(len(window), 2)
+
+        conn.receipts.received(conn.sent[3], 'receipt 3')
+        conn.receipts.received(conn.sent[4], 'receipt 4')
+        self.assertEqual(futures[4].result(0), 'receipt 4')
+        self.assertEqual(len(window), 0)
+        self.assertFalse(window.full())
+
+    def testTimeout(self):
+        conn = FakeConnection()
+        window = PublishWindow(conn, size=1, timeout=1.0)
+        first = window.publish('SEND\n\n1\x00\n')
+        second = window.publish('SEND\n\n2\x00\n')
+        conn.clock.now = 2
+        conn.receipts.expire()
+        self.assertTrue(isinstance(first.exception(0), TimeoutError))
+        # The second frame's timeout runs from when it was sent:
+        self.assertEqual(len(conn.sent), 2)
+        self.assertFalse(second.done())
+        self.assertEqual(conn.receipts.nextDeadline(), 3)
+
+        self.assertRaises(ValueError, PublishWindow, conn, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
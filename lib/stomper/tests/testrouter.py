@@ -0,0 +1,96 @@
+"""
+This is the unittest to verify the MESSAGE routing.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.router import MessageRouter
+from stomper.tests.helpers import message, message_frame
+
+
+class MessageRouterTest(unittest.TestCase):
+
+    def testWildcards(self):
+        router = MessageRouter()
+        router.add('/topic/PRICE.IBM', 'exact')
+        router.add('/topic/PRICE.*', 'star')
+        router.add('/topic/PRICE.>', 'rest')
+        router.add('/topic/PRICE.*.NYSE', 'middle')
+        router.add('>', 'all')
+        self.assertEqual(len(router), 5)
+
+        self.assertEqual(router.match('/topic/PRICE.IBM'), ('all', 'rest', 'exact', 'star'))
+        self.assertEqual(router.match('/topic/PRICE.IBM.NYSE'), ('all', 'rest', 'middle'))
+        self.assertEqual(router.match('/topic/PRICE'), ('all',))
+        self.assertEqual(router.match('/topic/ORDER.IBM'), ('all',))
+
+        router.remove('>', 'all')
+        router.remove('/topic/PRICE.>', 'rest')
+        router.remove('/topic/NOT.THERE', 'rest')
+        self.assertEqual(router.match('/topic/PRICE.IBM'), ('exact', 'star'))
+        self.assertEqual(router.match('/topic/PRICE.IBM.NYSE'), ('middle',))
+        self.assertEqual(router.match('/topic/ORDER.IBM'), ())
+        self.assertEqual(len(router), 3)
+
+    def testCache(self):
+        router = MessageRouter(cacheSize=2)
+        router.add('/queue/x.a', 'a')
+        self.assertTrue(router.match('/queue/x.a') is router.match('/queue/x.a'))
+        router.match('/queue/x.b')
+        router.match('/queue/x.c')
+        self.assertEqual(len(router._cache), 1)
+        router.add('/queue/x.*', 'any')
+        self.assertEqual(router.match('/queue/x.a'), ('a', 'any'))
+
+    def testSubscriptions(self):
+        router = MessageRouter()
+        router.add('/queue/a', 'dest')
+        router.addSubscription(1, 'sub')
+        self.assertEqual(router.handlers('1', '/queue/a'), ['sub'])
+        self.assertEqual(router.handlers('2', '/queue/a'), ('dest',))
+        router.removeSubscription(1)
+        self.assertEqual(router.handlers('1', '/queue/a'), ('dest',))
+        self.assertEqual(router.handlers('1', '/queue/b'), ())
+
+    def testEngine(self):
+        e = stomper.Engine()
+        got = []
+
+        def prices(msg):
+            got.append(('prices', msg['headers']['destination']))
+            return stomper.ack(msg['headers']['message-id'], msg['headers']['subscription'])
+
+        def orders(msg):
+            got.append(('orders', msg['headers']['destination']))
+            return stomper.NO_RESPONSE_NEEDED
+
+        e.addHandler(prices, destination='/topic/PRICE.>')
+        e.addHandler(orders, subscription='2')
+        self.assertRaises(ValueError, e.addHandler, orders)
+
+        self.assertEqual(e.react(message(destination='/topic/PRICE.IBM')), stomper.ack('m1', '1'))
+        self.assertEqual(e.react(message(subscription='2', destination='/topic/PRICE.IBM')), '')
+        # No handler so the message is acknowledged by Engine.ack:
+        self.assertEqual(e.react(message('m3', '3', '/topic/OTHER')), stomper.ack('m3', '3'))
+        self.assertEqual(got, [('prices', '/topic/PRICE.IBM'), ('orders', '/topic/PRICE.IBM')])
+
+        # The handlers of a LazyFrame are found without parsing its headers:
+        def skip(msg):
+            return stomper.NO_RESPONSE_NEEDED
+
+        e.addHandler(skip, destination='/queue/lazy')
+        frame = stomper.LazyFrame().unpack(message_frame(destination='/queue/lazy'))
+        self.assertEqual(e.react(frame), '')
+        self.assertIsNone(frame._headers)
+        e.removeHandler(skip, destination='/queue/lazy')
+
+        e.removeHandler(prices, destination='/topic/PRICE.>')
+        e.removeHandler(orders, subscription='2')
+        self.assertEqual(len(e.router), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+This is the unittest to verify the Engine and StompBuffer instrumentation.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.stats import Stats
+from stomper.stompbuffer import StompBuffer
+from stomper.tests.helpers import Clock, message_frame
+
+
+MESSAGE = message_frame()
+RECEIPT = "RECEIPT\nreceipt-id:r1\n\n\x00\n"
+
+
+class StatsTest(unittest.TestCase):
+
+    def testEngine(self):
+        # Each reading of the clock takes 2ms.
+        stats = Stats(buckets=(0.001, 0.01), clock=Clock(step=0.002))
+        e = stomper.Engine(stats=stats)
+        e.react(MESSAGE)
+        e.react(stomper.unpack_frame(MESSAGE))
+        e.react(RECEIPT)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['received'], {
+            'MESSAGE': {'frames': 1, 'bytes': len(MESSAGE)},
+            'RECEIPT': {'frames': 1, 'bytes': len(RECEIPT)},
+        })
+        handled = snapshot['handled']['MESSAGE']
+        self.assertEqual(handled['frames'], 2)
+        self.assertAlmostEqual(handled['seconds'], 0.004)
+        self.assertEqual(handled['histogram'], [(0.001, 0), (0.01, 2), (None, 0)])
+        self.assertEqual(snapshot['handled']['RECEIPT']['frames'], 1)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()['handled'], {})
+
+    def testEngineCountsBytes(self):
+        stats = Stats(clock=Clock(step=0.002))
+        e = stomper.Engine(stats=stats)
+        text = MESSAGE.replace('hi', u'h\xe9')
+        e.react(text)
+        e.react(text.encode('utf-8'))
+        self.assertEqual(stats.snapshot()['received'], {
+            'MESSAGE': {'frames': 2, 'bytes': 2 * len(text.encode('utf-8'))},
+        })
+
+    def testStompBuffer(self):
+        stats = Stats()
+        for lazy in (False, True):
+            sb = StompBuffer(lazy=lazy, stats=stats)
+            sb.appendData('rubbish\x00\n' + MESSAGE + MESSAGE + RECEIPT)
+            self.assertEqual(len(sb.getAllMessages()), 3)
+            sb.appendData('more rubbish\n')
+            sb.getAllMessages()
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['received'], {
+            'MESSAGE': {'frames': 4, 'bytes': 4 * len(MESSAGE)},
+            'RECEIPT': {'frames': 2, 'bytes': 2 * len(RECEIPT)},
+        })
+        self.assertEqual(snapshot['resyncs'], 4)
+        self.assertEqual(snapshot['discarded_bytes'], 2 * (len('rubbish\x00\n') + len('more rubbish\n')))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,10 +2,12 @@
 # Unit tests for StompBuffer
 ######################################################################
 
+import io
 import unittest
 import types
 
 import stomper
+from stomper import stompbuffer
 from stomper.stompbuffer import StompBuffer
 
 CMD  = 'SEND'
@@ -294,7 +296,406 @@ class StompBufferTestCase ( unittest.TestCase ):
             self.assertTrue ( messageIsGood ( m, BODY, cmd ) )
             self.assertTrue ( self.sb.bufferIsEmpty() )
 
-        
+
+
+    def test018_compactAfterManyMessages ( self ):
+        """
+        Pull enough messages off the buffer to trigger compaction and check
+        that the remainder (a partial message) is preserved.
+        """
+        msg = makeTextMessage()
+        count = ( stompbuffer.COMPACT_THRESHOLD // len ( msg ) ) + 10
+        partial = msg [:10]
+        self.sb.appendData ( msg * count + partial )
+        for i in range ( count ):
+            self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertEqual ( self.sb.buffer, partial )
+        self.sb.appendData ( msg [10:] )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test019_separatorsSplitAcrossAppends ( self ):
+        """
+        Split the message just inside the header separator and just inside
+        the terminator, so the resumed scans must back up to find them.
+        """
+        msg = makeTextMessage()
+        i = msg.index ( '\n\n' ) + 1
+        j = msg.index ( '\x00\n' ) + 1
+        self.sb.appendData ( msg [:i] )
+        self.assertTrue ( self.sb.getOneMessage() is None )
+        self.sb.appendData ( msg [i:j] )
+        self.assertTrue ( self.sb.getOneMessage() is None )
+        self.sb.appendData ( msg [j:] )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test020_scanResumes ( self ):
+        """
+        Feed a large body in pieces and check that the terminator search
+        carries on from where it stopped rather than from the start.
+        """
+        body = 'x' * 10000
+        msg = makeTextMessage ( body )
+        self.sb.appendData ( msg [:100] )
+        self.assertTrue ( self.sb.getOneMessage() is None )
+        end = len ( msg ) - 2
+        for k in range ( 100, end, 1000 ):
+            self.sb.appendData ( msg [k:min ( k + 1000, end )] )
+            self.assertTrue ( self.sb.getOneMessage() is None )
+            self.assertEqual ( self.sb._nulScan, self.sb.bufferLen() - 1 )
+        self.sb.appendData ( msg [end:] )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage(), body ) )
+
+
+    def test021_getAllMessages ( self ):
+        """
+        Drain several messages, text and binary, in one call and leave a
+        partial one behind.
+        """
+        msgs = [ makeTextMessage ( 'blah%d' % i ) for i in range ( 5 ) ]
+        msgs.append ( makeBinaryMessage() )
+        partial = makeTextMessage()
+        self.sb.appendData ( ''.join ( msgs ) + partial [:20] )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 6 )
+        for i in range ( 5 ):
+            self.assertTrue ( messageIsGood ( got [i], 'blah%d' % i ) )
+        self.assertTrue ( messageIsGood ( got [5], BINBODY ) )
+        self.assertEqual ( self.sb.buffer, partial [:20] )
+        self.assertEqual ( self.sb.getAllMessages(), [] )
+
+
+    def test022_iterMessages ( self ):
+        """
+        Iterate over the messages in the buffer, stopping part way.
+        """
+        self.sb.appendData ( makeTextMessage ( 'a' ) + makeTextMessage ( 'b' ) )
+        it = self.sb.iterMessages()
+        self.assertTrue ( messageIsGood ( next ( it ), 'a' ) )
+        it.close()
+        got = list ( self.sb.iterMessages() )
+        self.assertEqual ( len ( got ), 1 )
+        self.assertTrue ( messageIsGood ( got [0], 'b' ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test023_lazyFrames ( self ):
+        """
+        Ask for LazyFrame instances rather than dicts.
+        """
+        self.sb = StompBuffer ( lazy = True )
+        self.sb.appendData ( makeTextMessage() + makeBinaryMessage() )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 2 )
+        for m, body in zip ( got, [ BODY, BINBODY ] ):
+            self.assertTrue ( isinstance ( m, stomper.LazyFrame ) )
+            self.assertEqual ( m.cmd, CMD )
+            self.assertEqual ( m.header ( 'destination' ), DEST )
+            self.assertEqual ( m [ 'headers' ] [ 'destination' ], DEST )
+            self.assertEqual ( m.body, body )
+
+
+    def test024_escapedHeaders ( self ):
+        """
+        Escaped header names and values are unescaped, other than for
+        CONNECTED frames.
+        """
+        self.sb.appendData (
+            'MESSAGE\ndestination:/queue/a\\cb\nx\\ny:1\\\\2\n\nbody\x00\n'
+            'CONNECTED\nsession:a\\cb\n\n\x00\n' )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( got [ 0 ] [ 'headers' ],
+                           { 'destination' : '/queue/a:b', 'x\ny' : '1\\2' } )
+        self.assertEqual ( got [ 1 ] [ 'headers' ], { 'session' : 'a\\cb' } )
+
+
+    def test025_compactFrames ( self ):
+        """
+        Ask for FrameRecord tuples rather than dicts.
+        """
+        self.sb = StompBuffer ( compact = True )
+        self.sb.appendData ( makeTextMessage() )
+        m = self.sb.getOneMessage()
+        self.assertTrue ( isinstance ( m, stomper.FrameRecord ) )
+        self.assertTrue ( m.cmd is stomper.VALID_COMMANDS [ stomper.VALID_COMMANDS.index ( CMD ) ] )
+        self.assertEqual ( m [ 'headers' ] [ 'destination' ], DEST )
+        self.assertEqual ( m [ 'body' ], BODY )
+
+
+    def test026_limits ( self ):
+        """
+        Exceeding a limit throws the buffer away and raises LimitExceeded,
+        or calls onLimit.
+        """
+        self.sb = StompBuffer ( maxHeaderBytes = 30 )
+        self.sb.appendData ( 'SEND\ndestination:/queue/a\nx:' )
+        self.assertTrue ( self.sb.getOneMessage() is None )
+        self.sb.appendData ( 'yyyy' )
+        self.assertRaises ( stompbuffer.LimitExceeded, self.sb.getOneMessage )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+        errors = []
+        self.sb = StompBuffer ( maxBodyBytes = 10, onLimit = errors.append )
+        self.sb.appendData ( makeBinaryMessage ( 'x' * 11 ) + makeTextMessage() )
+        self.assertEqual ( self.sb.getAllMessages(), [] )
+        self.assertEqual ( ( errors [ 0 ].what, errors [ 0 ].size,
+                             errors [ 0 ].limit ), ( 'body', 11, 10 ) )
+        self.assertTrue ( isinstance ( errors [ 0 ], stomper.FrameError ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+        # Without a content-length the body is measured as it arrives.
+        self.sb.appendData ( 'SEND\n\n' + 'x' * 11 )
+        self.assertEqual ( self.sb.getAllMessages(), [] )
+        self.assertEqual ( errors [ 1 ].what, 'body' )
+        self.sb.appendData ( makeBinaryMessage ( 'x' * 10 ) )
+        self.assertEqual ( len ( self.sb.getAllMessages() ), 1 )
+
+        self.sb = StompBuffer ( maxBufferBytes = 100 )
+        self.sb.appendData ( 'x' * 100 )
+        self.assertRaises ( stompbuffer.LimitExceeded,
+                            self.sb.appendData, 'x' )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+        # A burst of complete frames isn't held against the limit.
+        msg = 'SEND\ndestination:/q\n\nhi\x00\n'
+        self.sb.appendData ( msg * 10 )
+        self.assertEqual ( len ( self.sb.getAllMessages() ), 10 )
+        self.assertRaises ( stompbuffer.LimitExceeded, self.sb.appendData,
+                            msg * 10 + 'SEND\n\n' + 'x' * 95 )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+        self.sb.appendData ( msg * 10 + 'SEND\n\n' + 'x' * 94 )
+        self.assertTrue ( self.sb.bufferLen() > 100 )
+        self.assertEqual ( len ( self.sb.getAllMessages() ), 10 )
+
+
+    def test027_waterMarks ( self ):
+        """
+        Reading is paused above the high water mark and resumed once the
+        buffer is down to the low water mark.
+        """
+        calls = []
+        msg = makeTextMessage()
+        self.sb.setWaterMarks ( len ( msg ) * 2, len ( msg ),
+                                lambda: calls.append ( 'pause' ),
+                                lambda: calls.append ( 'resume' ) )
+        self.sb.appendData ( msg )
+        self.assertFalse ( self.sb.paused )
+        self.sb.appendData ( msg + msg )
+        self.assertTrue ( self.sb.paused )
+        self.assertEqual ( calls, [ 'pause' ] )
+        self.sb.appendData ( msg )
+        self.assertEqual ( calls, [ 'pause' ] )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertTrue ( self.sb.paused )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertFalse ( self.sb.paused )
+        self.assertEqual ( calls, [ 'pause', 'resume' ] )
+        self.assertRaises ( ValueError, self.sb.setWaterMarks, 1, 2 )
+
+        # An incomplete frame doesn't count, however big it gets, and the
+        # water marks are checked alongside maxBufferBytes.
+        calls = []
+        self.sb = StompBuffer ( maxBufferBytes = len ( msg ) * 10 )
+        self.sb.setWaterMarks ( len ( msg ) * 2, 0,
+                                lambda: calls.append ( 'pause' ),
+                                lambda: calls.append ( 'resume' ) )
+        self.sb.appendData ( 'SEND\n\n' + 'x' * len ( msg ) * 3 )
+        self.assertFalse ( self.sb.paused )
+        self.sb.buffer = ''
+        self.sb.appendData ( msg * 3 + 'SEND\n\nx' )
+        self.assertTrue ( self.sb.paused )
+        self.assertEqual ( len ( self.sb.getAllMessages() ), 3 )
+        self.assertFalse ( self.sb.paused )
+        self.assertEqual ( calls, [ 'pause', 'resume' ] )
+
+
+    def test028_resyncOnDemand ( self ):
+        """
+        syncBuffer is only used when a command line is bad or can't be
+        checked yet, skips to the next '\x00\n' and returns the bytes it
+        skipped.
+        """
+        calls = []
+        syncBuffer = self.sb.syncBuffer
+        def countingSync():
+            calls.append ( 1 )
+            return syncBuffer()
+        self.sb.syncBuffer = countingSync
+
+        msg = makeTextMessage()
+        self.sb.appendData ( msg * 3 )
+        self.assertEqual ( len ( self.sb.getAllMessages() ), 3 )
+        self.assertEqual ( calls, [] )
+
+        self.sb.appendData ( 'rubbish\nmore\x00\n' + msg )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 1 )
+        self.assertTrue ( messageIsGood ( got [ 0 ] ) )
+        self.assertEqual ( len ( calls ), 1 )
+
+        self.sb.buffer = 'rubbish\x00\nNOTACOMMAND\n'
+        self.assertEqual ( syncBuffer(), 21 )
+        self.assertEqual ( syncBuffer(), 0 )
+
+        self.sb.buffer = 'rubbish\x00\n\n' + msg
+        self.assertEqual ( syncBuffer(), 9 )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+
+
+    def test029_heartbeats ( self ):
+        """
+        Heart-beat EOLs between frames are skipped without resynchronising
+        (which would throw the following frame away) and reported.
+        """
+        beats = []
+        self.sb = StompBuffer ( onHeartbeat = beats.append,
+                                clock = lambda: 42 )
+        msg = makeTextMessage()
+        self.sb.appendData ( '\n\r\n' + msg + '\n\r' )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 1 )
+        self.assertTrue ( messageIsGood ( got [ 0 ] ) )
+        self.assertEqual ( beats, [ 42, 42, 42 ] )
+        # The '\r' waits for the rest of its EOL.
+        self.assertEqual ( self.sb.buffer, '\r' )
+
+        self.sb.appendData ( '\n' + msg )
+        self.assertTrue ( messageIsGood ( self.sb.getOneMessage() ) )
+        self.assertEqual ( len ( beats ), 4 )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+        # Heart-beats after a resynchronised boundary are still skipped.
+        self.sb.appendData ( 'BAD\nx\x00\n\n\r\n' + msg + msg )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 2 )
+        self.assertTrue ( messageIsGood ( got [ 0 ] ) )
+        self.assertEqual ( len ( beats ), 6 )
+
+
+    def test030_unicodeText ( self ):
+        """
+        Text is held UTF-8 encoded, so a content-length counts bytes and a
+        character split across appends is put back together.
+        """
+        body = u'caf\xe9 \u2603'
+        msg = u'SEND\ndestination:/queue/a\ncontent-length:9\n\n' + body + \
+              u'\x00\n'
+        self.sb.appendData ( msg [ :-5 ] )
+        self.assertTrue ( self.sb.getOneMessage() is None )
+        self.sb.appendData ( msg [ -5: ] + msg )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( [ m [ 'body' ] for m in got ], [ body, body ] )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+class BinaryStompBufferTestCase ( unittest.TestCase ):
+
+    def setUp ( self ):
+        self.sb = StompBuffer ( binary = True )
+
+
+    def test001_oneCompleteTextMessage ( self ):
+        """
+        Bytes go in, bytes bodies come out and the headers are text.
+        """
+        self.sb.appendData ( makeTextMessage().encode ( 'utf-8' ) )
+        m = self.sb.getOneMessage()
+        self.assertTrue ( messageIsGood ( m, BODY.encode ( 'utf-8' ) ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test002_binaryBodyWithNulls ( self ):
+        """
+        A content-length body containing null bytes and newlines is
+        returned unchanged.
+        """
+        body = b'\x00\n\xff\xfe\n\n\x00\n'
+        msg = ( 'SEND\ndestination:%s\ncontent-length:%d\n\n' % (
+            DEST, len ( body ) ) ).encode ( 'ascii' ) + body + b'\x00\n'
+        self.sb.appendData ( bytearray ( msg ) )
+        m = self.sb.getOneMessage()
+        self.assertTrue ( messageIsGood ( m, body ) )
+        self.assertTrue ( type ( m [ 'body' ] ) is bytes )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test003_messageFragments ( self ):
+        """
+        Feed several messages in one byte at a time.
+        """
+        data = makeTextMessage().encode ( 'utf-8' ) * 3
+        got = []
+        for i in range ( len ( data ) ):
+            self.sb.appendData ( data [i:i+1] )
+            m = self.sb.getOneMessage()
+            if m is not None:
+                got.append ( m )
+        self.assertEqual ( len ( got ), 3 )
+        for m in got:
+            self.assertTrue ( messageIsGood ( m, BODY.encode ( 'utf-8' ) ) )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test004_syncBuffer ( self ):
+        """
+        Resynchronisation works on bytes too.
+        """
+        msg = makeTextMessage().encode ( 'utf-8' )
+        self.sb.buffer = b'rubbish\x00\nmorerubbish\x00\n' + msg
+        self.sb.syncBuffer()
+        self.assertEqual ( self.sb.buffer, msg )
+        m = self.sb.getOneMessage()
+        self.assertTrue ( messageIsGood ( m, BODY.encode ( 'utf-8' ) ) )
+
+
+    def test005_streamedBody ( self ):
+        """
+        Large content-length bodies are written to a sink as they arrive
+        rather than buffered, small ones are not.
+        """
+        sinks = []
+        def sinkFactory ( cmd, headers ):
+            self.assertEqual ( cmd, CMD )
+            self.assertEqual ( headers [ 'destination' ], DEST )
+            sinks.append ( io.BytesIO() )
+            return sinks [ -1 ]
+
+        self.sb = StompBuffer ( binary = True, sinkFactory = sinkFactory,
+                                streamThreshold = 100 )
+        body = BINBODY * 100
+        data = ( makeBinaryMessage ( body ) + makeBinaryMessage() ).encode ( 'utf-8' )
+        got = []
+        for i in range ( 0, len ( data ), 50 ):
+            self.sb.appendData ( data [ i:i + 50 ] )
+            # Nothing more than a piece is ever held in the buffer.
+            self.assertTrue ( self.sb.bufferLen() <= 100 )
+            got.extend ( self.sb.getAllMessages() )
+
+        self.assertEqual ( len ( got ), 2 )
+        self.assertTrue ( got [ 0 ] [ 'body' ] is sinks [ 0 ] )
+        self.assertEqual ( sinks [ 0 ].getvalue(), body.encode ( 'utf-8' ) )
+        self.assertEqual ( got [ 0 ] [ 'headers' ] [ 'destination' ], DEST )
+        self.assertTrue ( messageIsGood ( got [ 1 ], BINBODY.encode ( 'utf-8' ) ) )
+        self.assertEqual ( len ( sinks ), 1 )
+        self.assertTrue ( self.sb.bufferIsEmpty() )
+
+
+    def test006_heartbeats ( self ):
+        """
+        Heart-beats are skipped in bytes too.
+        """
+        msg = makeTextMessage().encode ( 'utf-8' )
+        self.sb.appendData ( b'\n' + msg + b'\r\n' + msg )
+        got = self.sb.getAllMessages()
+        self.assertEqual ( len ( got ), 2 )
+        for m in got:
+            self.assertTrue ( messageIsGood ( m, BODY.encode ( 'utf-8' ) ) )
+
+
 if __name__ == "__main__":
     unittest.main() # run all tests
     
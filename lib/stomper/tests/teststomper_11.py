@@ -21,6 +21,7 @@ import unittest
 
 import stomper
 #.stomp_11 as stomper
+from stomper.stompbuffer import StompBuffer
 
 
 class TestEngine(stomper.Engine):
@@ -60,8 +61,8 @@ class Stomper11Test(unittest.TestCase):
         msg.cmd = 'MESSAGE'
         msg.headers = {
             'subscription': 1,
-            'destination:': '/queue/a',
-            'message-id:': 'some-message-id',
+            'destination': '/queue/a',
+            'message-id': 'some-message-id',
             'content-type': 'text/plain',
         }
         msg.body = "hello queue a"
@@ -73,7 +74,7 @@ class Stomper11Test(unittest.TestCase):
         # React to an error:
         error = stomper.Frame()
         error.cmd = 'ERROR'
-        error.headers = {'message:': 'malformed packet received!'}
+        error.headers = {'message': 'malformed packet received!'}
         error.body = """The message:
 -----
 MESSAGE
@@ -92,7 +93,7 @@ Did not contain a destination header, which is required for message propagation.
         # React to an receipt:
         receipt = stomper.Frame()
         receipt.cmd = 'RECEIPT'
-        receipt.headers = {'receipt-id:': 'message-12345'}
+        receipt.headers = {'receipt-id': 'message-12345'}
 
         rc = e.react(receipt.pack())
         self.assertEqual(rc, 'receipt')
@@ -258,6 +259,195 @@ hello queue a
         self.assertEqual(result['headers']['message-id'], 'card_data')
         self.assertEqual(result['body'], 'hello queue a')
 
+    def testFrameUnpackContentLength(self):
+        """Testing a content-length body is returned unchanged.
+        """
+        body = "line one\n  line two\n\n\x00 and a null\n"
+        msg = "MESSAGE\ndestination:/queue/a\ncontent-length:%d\n\n%s\x00\n" % (
+            len(body), body)
+
+        result = stomper.unpack_frame(msg)
+
+        self.assertEqual(result['cmd'], 'MESSAGE')
+        self.assertEqual(result['headers']['destination'], '/queue/a')
+        self.assertEqual(result['headers']['content-length'], str(len(body)))
+        self.assertEqual(result['body'], body)
+
+    def testFrameUnpackContentLengthUnicode(self):
+        """Testing content-length counts the UTF-8 bytes of a text body.
+        """
+        body = u'caf\xe9'
+        msg = u"MESSAGE\ndestination:/queue/a\ncontent-length:5\n\n%s\x00\n" % body
+
+        self.assertEqual(stomper.unpack_frame(msg)['body'], body)
+        self.assertEqual(stomper.LazyFrame().unpack(msg).body, body)
+
+    def testFrameUnpackBytes(self):
+        """Testing unpack frame function against a binary MESSAGE
+        """
+        body = b'\xff\x00\n\xfe'
+        msg = b"MESSAGE\ndestination:/queue/a\ncontent-length:4\n\n" + body + b"\x00\n"
+
+        result = stomper.unpack_frame(msg)
+
+        self.assertEqual(result['cmd'], 'MESSAGE')
+        self.assertEqual(result['headers']['destination'], '/queue/a')
+        self.assertEqual(result['body'], body)
+
+        msg = b"MESSAGE\ndestination:/queue/a\n\nhello queue a\n\x00\n"
+        result = stomper.unpack_frame(msg)
+        self.assertEqual(result['headers']['destination'], '/queue/a')
+        self.assertEqual(result['body'], b'hello queue a')
+
+    def testLazyFrame(self):
+        """Testing the LazyFrame only parses headers when needed.
+        """
+        msg = """MESSAGE
+subscription:1
+destination:/queue/a
+message-id:ID:some-message-id:1
+content-length:13
+
+hello queue a\x00
+"""
+        frame = stomper.LazyFrame().unpack(msg)
+
+        self.assertEqual(frame.cmd, 'MESSAGE')
+        self.assertEqual(frame.body, 'hello queue a')
+        self.assertEqual(frame.header('destination'), '/queue/a')
+        self.assertEqual(frame.header('message-id'), 'ID:some-message-id:1')
+        self.assertEqual(frame.header('receipt'), None)
+        self.assertEqual(frame.header('receipt', 'none'), 'none')
+        self.assertEqual(frame._headers, None)
+
+        self.assertEqual(frame['headers'], {
+            'subscription': '1',
+            'destination': '/queue/a',
+            'message-id': 'ID:some-message-id:1',
+            'content-length': '13',
+        })
+        self.assertEqual(frame['cmd'], 'MESSAGE')
+        self.assertEqual(frame['body'], 'hello queue a')
+        self.assertRaises(KeyError, lambda: frame['other'])
+        self.assertRaises(AttributeError, setattr, frame, 'other', 1)
+
+        frame = stomper.LazyFrame().unpack('DISCONNECT\n\n\x00\n')
+        self.assertEqual(frame.cmd, 'DISCONNECT')
+        self.assertEqual(frame.headers, {})
+        self.assertEqual(frame.header('receipt'), None)
+
+        self.assertRaises(stomper.FrameError, stomper.LazyFrame().unpack, '')
+
+        e = stomper.Engine()
+        frame = stomper.LazyFrame().unpack(msg)
+        correct = 'ACK\nsubscription:1\nmessage-id:ID\\csome-message-id\\c1\n\n\x00\n'
+        self.assertEqual(e.react(frame), correct)
+
+    def testFrameRecord(self):
+        msg = """MESSAGE
+subscription:1
+destination:/queue/a
+message-id:some-message-id
+
+hello queue a\x00
+"""
+        frame = stomper.unpack_frame(msg, compact=True)
+        self.assertTrue(isinstance(frame, stomper.FrameRecord))
+        self.assertEqual(frame, stomper.FrameRecord(
+            'MESSAGE', stomper.unpack_frame(msg)['headers'], 'hello queue a'))
+
+        # The command is shared with VALID_COMMANDS:
+        self.assertTrue(frame.cmd is stomper.VALID_COMMANDS[7])
+        self.assertEqual(frame['cmd'], 'MESSAGE')
+        self.assertEqual(frame['headers']['destination'], '/queue/a')
+        self.assertEqual(frame['body'], frame.body)
+        self.assertEqual(frame[0], 'MESSAGE')
+        self.assertRaises(KeyError, lambda: frame['other'])
+        self.assertRaises(AttributeError, setattr, frame, 'cmd', 'ERROR')
+
+        e = stomper.Engine()
+        correct = 'ACK\nsubscription:1\nmessage-id:some-message-id\n\n\x00\n'
+        self.assertEqual(e.react(frame), correct)
+
+    def testHeaderEscaping(self):
+        self.assertEqual(stomper.escape_header('a\\b\nc:d'), 'a\\\\b\\nc\\cd')
+        self.assertEqual(stomper.unescape_header('a\\\\b\\nc\\cd\\r'), 'a\\b\nc:d\r')
+        self.assertEqual(stomper.unescape_header('a\\tb'), 'a\\tb')
+        self.assertEqual(stomper.unescape_header('plain'), 'plain')
+
+        frame = stomper.Frame()
+        frame.cmd = 'MESSAGE'
+        frame.headers = {
+            'destination': '/queue/a:b',
+            'x\ny': '1\\2',
+            'subscription': 1,
+        }
+        frame.body = 'hello'
+        packed = frame.pack()
+        self.assertEqual(
+            packed,
+            'MESSAGE\ndestination:/queue/a\\cb\nsubscription:1\n'
+            'x\\ny:1\\\\2\n\nhello\x00\n')
+
+        expected = {
+            'destination': '/queue/a:b',
+            'x\ny': '1\\2',
+            'subscription': '1',
+        }
+        self.assertEqual(stomper.unpack_frame(packed)['headers'], expected)
+        lazy = stomper.LazyFrame().unpack(packed)
+        self.assertEqual(lazy.header('destination'), '/queue/a:b')
+        self.assertEqual(lazy.header('x\ny'), '1\\2')
+        self.assertEqual(lazy.headers, expected)
+
+        # Nothing needing escaping packs as before:
+        frame.headers = {'destination': '/queue/a'}
+        self.assertEqual(
+            frame.pack(), 'MESSAGE\ndestination:/queue/a\n\nhello\x00\n')
+
+        # CONNECT and CONNECTED frames are never escaped:
+        frame.cmd = 'CONNECT'
+        frame.headers = {'passcode': 'a:b\\c'}
+        frame.body = ''
+        packed = frame.pack()
+        self.assertEqual(packed, 'CONNECT\npasscode:a:b\\c\n\n\x00\n')
+        self.assertEqual(
+            stomper.unpack_frame(packed)['headers'], {'passcode': 'a:b\\c'})
+
+        self.assertEqual(
+            stomper.send('/queue/a:b', 'hi'),
+            'SEND\ndestination:/queue/a\\cb\ncontent-type:text/plain\n\nhi\x00\n')
+        self.assertEqual(
+            stomper.SendTemplate('/queue/a:b').pack('hi'),
+            stomper.send('/queue/a:b', 'hi'))
+        self.assertEqual(
+            stomper.ack('ID:1', '1'),
+            'ACK\nsubscription:1\nmessage-id:ID\\c1\n\n\x00\n')
+
+    def testWithReceipt(self):
+        frame = stomper.send('/queue/a', 'hi')
+        correct = 'SEND\nreceipt:r\\c1\ndestination:/queue/a\ncontent-type:text/plain\n\nhi\x00\n'
+        self.assertEqual(stomper.with_receipt(frame, 'r:1'), correct)
+        self.assertEqual(
+            stomper.with_receipt(frame.encode('utf-8'), 'r:1'),
+            correct.encode('utf-8'))
+        self.assertEqual(
+            stomper.unpack_frame(stomper.with_receipt(frame, 'r:1'))['headers']['receipt'],
+            'r:1')
+        self.assertRaises(stomper.FrameError, stomper.with_receipt, 'SEND', 'r')
+
+        e = stomper.Engine()
+        receipt, future = e.receipts.track()
+        e.react('RECEIPT\nreceipt-id:%s\n\n\x00\n' % receipt)
+        self.assertEqual(future.result(0)['headers']['receipt-id'], receipt)
+
+    def testDisconnectFollowedByFrame(self):
+        sb = StompBuffer()
+        sb.appendData(stomper.disconnect('r1') + stomper.send('/q', 'hi'))
+        frames = sb.getAllMessages()
+        self.assertEqual([f['cmd'] for f in frames], ['DISCONNECT', 'SEND'])
+        self.assertEqual(frames[0]['headers'], {'receipt': 'r1'})
+
     def testCommit(self):
         transactionid = '1234'
         correct = "COMMIT\ntransaction:%s\n\n\x00\n" % transactionid
@@ -322,6 +512,12 @@ hello queue a
         correct = "SUBSCRIBE\nid:0\ndestination:%s\nack:%s\n\n\x00\n" % (dest, ack)
         self.assertEqual(stomper.subscribe(dest, 0), correct)
 
+        correct = "SUBSCRIBE\nid:0\ndestination:%s\nack:client\nactivemq.prefetchSize:10\nselector:a\\cb\n\n\x00\n" % dest
+        self.assertEqual(
+            stomper.subscribe(dest, 0, 'client',
+                              {'selector': 'a:b', 'activemq.prefetchSize': 10}),
+            correct)
+
     def testConnect(self):
         username, password = 'bob', '123'
         correct = "CONNECT\naccept-version:1.1\nhost:localhost\nheart-beat:0,0\nlogin:%s\npasscode:%s\n\n\x00\n" % (username, password)
@@ -334,7 +530,7 @@ hello queue a
         self.assertEqual(stomper.connect(username, password, 'localhost', heartbeats=heartbeats), correct)
 
     def testDisconnect(self):
-        correct = "DISCONNECT\nreceipt:77\n\x00\n"
+        correct = "DISCONNECT\nreceipt:77\n\n\x00\n"
         self.assertEqual(stomper.disconnect(77), correct)
 
     def testSend(self):
@@ -348,5 +544,76 @@ hello queue a
         correct = "SEND\ndestination:%s\ncontent-type:text/plain\ntransaction:%s\n\n%s\x00\n" % (dest, transactionid, msg)
         self.assertEqual(stomper.send(dest, msg, transactionid), correct)
 
+    def testSendTemplate(self):
+        dest, msg = '/queue/myplace', '123 456 789'
+        template = stomper.SendTemplate(dest)
+        self.assertEqual(template.pack(msg), stomper.send(dest, msg))
+        self.assertEqual(template.pack(msg, '987'), stomper.send(dest, msg, '987'))
+
+        template = stomper.SendTemplate(dest, 'application/json')
+        self.assertEqual(
+            template.pack(msg), stomper.send(dest, msg, content_type='application/json'))
+
+        template = stomper.SendTemplate(
+            dest, extra_headers={'persistent': 'true', 'priority': 4},
+            content_length=True)
+        correct = "SEND\ndestination:%s\ncontent-type:text/plain\npersistent:true\npriority:4\ncontent-length:11\ntransaction:987\n\n%s\x00\n" % (dest, msg)
+        self.assertEqual(template.pack(msg, '987'), correct)
+
+        correct = correct.encode('utf-8').replace(b'123', b'\x00\x01\x02')
+        self.assertEqual(template.pack(b'\x00\x01\x02 456 789', '987'), correct)
+
+        result = stomper.unpack_frame(template.pack(b'\x00\x01\x02'))
+        self.assertEqual(result['headers']['priority'], '4')
+        self.assertEqual(result['body'], b'\x00\x01\x02')
+
+        body = u'caf\xe9 \u2603'
+        frame = template.pack(body)
+        self.assertTrue(u'content-length:9\n' in frame)
+        self.assertEqual(stomper.unpack_frame(frame.encode('utf-8'))['body'],
+                         body.encode('utf-8'))
+
+    def testFrameBatch(self):
+        frame = stomper.Frame()
+        frame.cmd = 'DISCONNECT'
+
+        batch = stomper.FrameBatch()
+        batch.add(stomper.send, '/queue/a', 'hello')
+        batch.add(stomper.ack('1234', '1'))
+        batch.add(frame)
+        self.assertEqual(len(batch), 3)
+
+        correct = stomper.send('/queue/a', 'hello') + stomper.ack('1234', '1') + frame.pack()
+        self.assertEqual(batch.pack(), correct.encode('utf-8'))
+        self.assertEqual(b''.join(batch.buffers()), correct.encode('utf-8'))
+        self.assertEqual(len(batch.buffers()), 3)
+
+        batch.add(stomper.SendTemplate('/queue/b').pack, b'\xff')
+        self.assertEqual(
+            batch.pack(),
+            correct.encode('utf-8') + stomper.SendTemplate('/queue/b').pack(b'\xff'))
+
+        batch.clear()
+        template = stomper.SendTemplate('/queue/c')
+        batch.add(template, 'hello', transactionid='t1')
+        batch.add(template, b'bytes')
+        self.assertEqual(
+            batch.pack(),
+            template.pack('hello', 't1').encode('utf-8') + template.pack(b'bytes'))
+
+        batch.clear()
+        self.assertEqual(batch.pack(), b'')
+
+        frames = [stomper.commit('1'), stomper.abort('2')]
+        self.assertEqual(stomper.pack_frames(frames), ''.join(frames).encode('utf-8'))
+
+        self.assertEqual(
+            stomper.pack_frames([(stomper.send, '/q', 'x'), memoryview(b'\n'),
+                                 (stomper.SendTemplate('/q'), b'y', 't1')]),
+            stomper.send('/q', 'x').encode('utf-8') + b'\n' +
+            stomper.SendTemplate('/q').pack(b'y', 't1'))
+        self.assertRaises(TypeError, stomper.pack_frames, [[1, 2]])
+        self.assertRaises(TypeError, stomper.FrameBatch().add, 12)
+
 if __name__ == "__main__":
     unittest.main()
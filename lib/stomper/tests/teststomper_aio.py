@@ -0,0 +1,310 @@
+"""
+This is the unittest to verify the asyncio transport.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import gc
+import asyncio
+import unittest
+import weakref
+
+import stomper
+from stomper import aio
+from stomper.receipts import PublishWindow
+from stomper.stompbuffer import StompBuffer
+
+
+class FakeServer(asyncio.Protocol):
+    """Just enough of a STOMP server to talk to the client.
+    """
+    def __init__(self, received):
+        self.received = received
+        self.sb = StompBuffer(binary=True)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if not data.strip(b'\n'):
+            self.received.append({'cmd': 'HEARTBEAT'})
+            return
+
+        self.sb.appendData(data)
+        for msg in self.sb.getAllMessages():
+            self.received.append(msg)
+            if msg['cmd'] == 'CONNECT':
+                if msg['headers']['login'] == 'bad':
+                    self.transport.write(b'ERROR\nmessage:bad login\n\n\x00\n')
+                elif msg['headers']['login'] == 'hb':
+                    self.transport.write(b'CONNECTED\nversion:1.1\nsession:s1\nheart-beat:100,50\n\n\x00\n')
+                else:
+                    self.transport.write(b'CONNECTED\nversion:1.1\nsession:s1\n\n\x00\n')
+            elif msg['cmd'] == 'DISCONNECT':
+                self.transport.write(
+                    b'RECEIPT\nreceipt-id:' +
+                    msg['headers']['receipt'].encode('utf-8') + b'\n\n\x00\n')
+            elif msg['cmd'] == 'SEND':
+                self.transport.write(
+                    b'MESSAGE\nsubscription:1\nmessage-id:m1\ndestination:' +
+                    msg['headers']['destination'].encode('utf-8') +
+                    b'\ncontent-length:' + str(len(msg['body'])).encode('utf-8') +
+                    b'\n\n' + msg['body'] + b'\x00\n')
+
+
+class RecordingEngine(stomper.Engine):
+
+    def __init__(self):
+        super(RecordingEngine, self).__init__()
+        self.messages = []
+
+    def ack(self, msg):
+        self.messages.append(msg)
+        return super(RecordingEngine, self).ack(msg)
+
+
+class StomperAioTest(unittest.TestCase):
+
+    def run_with_server(self, client):
+        received = []
+
+        async def main():
+            loop = asyncio.get_event_loop()
+            server = await loop.create_server(
+                lambda: FakeServer(received), '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                await client(port)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+        return received
+
+    def testConversation(self):
+        engine = RecordingEngine()
+
+        async def client(port):
+            stomp = await aio.open_connection(
+                '127.0.0.1', port, engine=engine, username='bob', password='123')
+            self.assertEqual(engine.sessionId, 's1')
+            await stomp.subscribe('/queue/a', 1, ack='client')
+            await stomp.send('/queue/a', 'hello')
+            while not engine.messages:
+                await asyncio.sleep(0.01)
+            await stomp.disconnect(timeout=5)
+            await stomp.wait_closed()
+
+        received = self.run_with_server(client)
+
+        self.assertEqual(
+            [msg['cmd'] for msg in received],
+            ['CONNECT', 'SUBSCRIBE', 'SEND', 'ACK', 'DISCONNECT'])
+        self.assertEqual(received[0]['headers']['host'], '127.0.0.1')
+        self.assertEqual(received[3]['headers']['message-id'], 'm1')
+        self.assertEqual(engine.messages[0]['body'], b'hello')
+
+    def testConnectError(self):
+
+        async def client(port):
+            with self.assertRaises(stomper.FrameError):
+                await aio.open_connection('127.0.0.1', port, username='bad')
+
+        self.run_with_server(client)
+
+    def testHeartbeats(self):
+
+        async def client(port):
+            stomp = await aio.open_connection(
+                '127.0.0.1', port, username='hb', heartbeats=(50, 100))
+            self.assertEqual(stomp.heartbeats, (50, 100))
+            self.assertTrue(stomp in stomp.heartbeatDriver.manager)
+            # The server never sends anything so the connection is
+            # aborted after twice the receive interval.
+            await asyncio.wait_for(stomp.wait_closed(), 5)
+            self.assertFalse(stomp in stomp.heartbeatDriver.manager)
+
+        received = self.run_with_server(client)
+
+        self.assertEqual(received[0]['cmd'], 'CONNECT')
+        self.assertTrue(len(received) >= 2)
+        for msg in received[1:]:
+            self.assertEqual(msg['cmd'], 'HEARTBEAT')
+
+    def testDriverReleasesLoop(self):
+        refs = []
+        for i in range(3):
+            loop = asyncio.new_event_loop()
+            driver = aio.get_heartbeat_driver(loop)
+            self.assertTrue(driver.loop is loop)
+            driver.register(self, 100, 100)
+            driver.unregister(self)
+            loop.close()
+            refs.append(weakref.ref(loop))
+            del loop, driver
+        gc.collect()
+        self.assertEqual([ref() for ref in refs], [None, None, None])
+
+    def testPauseWriting(self):
+        written = []
+
+        class FakeTransport(object):
+            def write(self, data):
+                written.append(data)
+
+        async def main():
+            stomp = aio.StompProtocol()
+            stomp.connection_made(FakeTransport())
+            stomp.pause_writing()
+            task = asyncio.ensure_future(stomp.send('/queue/a', 'hello'))
+            await asyncio.sleep(0)
+            self.assertFalse(task.done())
+            self.assertEqual(written, [stomper.send('/queue/a', 'hello').encode('utf-8')])
+            stomp.resume_writing()
+            await task
+
+            stomp.pause_writing()
+            task = asyncio.ensure_future(stomp.send('/queue/a', 'hello'))
+            await asyncio.sleep(0)
+            stomp.connection_lost(None)
+            with self.assertRaises(ConnectionError):
+                await task
+
+        asyncio.run(main())
+
+    def testReadLimits(self):
+        calls = []
+
+        class FakeTransport(object):
+            def pause_reading(self):
+                calls.append('pause')
+
+            def resume_reading(self):
+                calls.append('resume')
+
+            def abort(self):
+                calls.append('abort')
+
+            def write(self, data):
+                pass
+
+        async def main():
+            stomp = aio.StompProtocol(
+                stompBuffer=stomper.stompbuffer.StompBuffer(
+                    binary=True, maxBodyBytes=100),
+                readHighWater=50, readLowWater=0)
+            stomp.connection_made(FakeTransport())
+            # Complete frames over the high water mark pause reading until
+            # they have been pulled off:
+            frame = b'MESSAGE\nsubscription:1\nmessage-id:m1\n\nhi\x00\n'
+            stomp.data_received(frame * 2)
+            self.assertEqual(calls, ['pause', 'resume'])
+            # An incomplete frame never does, as only reading completes it:
+            stomp.data_received(b'MESSAGE\ndestination:/queue/a\n\n' + b'x' * 60)
+            self.assertEqual(calls, ['pause', 'resume'])
+            stomp.data_received(b'x' * 41)
+            self.assertEqual(calls, ['pause', 'resume', 'abort'])
+
+        asyncio.run(main())
+
+    def testLargeFrameOverReadHighWater(self):
+        body = b'x' * 200000
+        frame = (b'MESSAGE\nsubscription:1\nmessage-id:m1\ndestination:/queue/a\n'
+                 b'content-length:%d\n\n' % len(body)) + body + b'\x00\n'
+
+        class BigSender(asyncio.Protocol):
+            def connection_made(self, transport):
+                transport.write(frame)
+
+        async def main():
+            loop = asyncio.get_event_loop()
+            server = await loop.create_server(BigSender, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            engine = RecordingEngine()
+            transport, stomp = await loop.create_connection(
+                lambda: aio.StompProtocol(engine, readHighWater=65536),
+                '127.0.0.1', port)
+            try:
+                for i in range(500):
+                    if engine.messages:
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertEqual(len(engine.messages), 1)
+                self.assertEqual(engine.messages[0]['body'], body)
+                self.assertFalse(stomp.stompBuffer.paused)
+            finally:
+                transport.close()
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    def testReceipts(self):
+        written = []
+
+        class FakeTransport(object):
+            def write(self, data):
+                written.append(data)
+
+        async def main():
+            stomp = aio.StompProtocol()
+            stomp.connection_made(FakeTransport())
+
+            future = stomp.sendFrame(stomper.send('/queue/a', 'hi'), receipt='r1')
+            failed = stomp.sendFrame(stomper.send('/queue/a', 'hi'), receipt='r2')
+            slow = stomp.sendFrame(
+                stomper.send('/queue/a', 'hi'), receipt=True, timeout=0.01)
+            self.assertTrue(written[0].startswith(b'SEND\nreceipt:r1\n'))
+
+            stomp.data_received(
+                b'RECEIPT\nreceipt-id:r1\n\n\x00\n'
+                b'ERROR\nreceipt-id:r2\nmessage:nope\n\n\x00\n')
+            msg = await asyncio.wrap_future(future)
+            self.assertEqual(msg['cmd'], 'RECEIPT')
+            with self.assertRaises(stomper.FrameError):
+                await asyncio.wrap_future(failed)
+            with self.assertRaises(TimeoutError):
+                await asyncio.wait_for(asyncio.wrap_future(slow), 5)
+
+            window = PublishWindow(stomp, size=1)
+            first = window.publish(stomper.send('/queue/a', '1'))
+            second = window.publish(stomper.send('/queue/a', '2'))
+            self.assertEqual(len(written), 4)
+            stomp.connection_lost(None)
+            with self.assertRaises(ConnectionError):
+                await asyncio.wrap_future(first)
+            self.assertTrue(isinstance(second.exception(0), ConnectionError))
+            self.assertEqual(len(stomp.receipts), 0)
+
+        asyncio.run(main())
+
+    def testExpiryTimer(self):
+
+        class FakeTransport(object):
+            def write(self, data):
+                pass
+
+        async def main():
+            stomp = aio.StompProtocol()
+            stomp.connection_made(FakeTransport())
+            send = stomper.send('/queue/a', 'hi')
+
+            # The timer is only replaced for an earlier timeout:
+            for i in range(3):
+                stomp.sendFrame(send, receipt=True, timeout=60)
+            handle = stomp._expiryHandle
+            stomp.sendFrame(send, receipt=True, timeout=90)
+            self.assertTrue(stomp._expiryHandle is handle)
+            stomp.sendFrame(send, receipt=True, timeout=30)
+            self.assertFalse(stomp._expiryHandle is handle)
+            self.assertTrue(handle.cancelled())
+
+            stomp.connection_lost(None)
+            self.assertEqual(stomp._expiryHandle, None)
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+This is the unittest to verify the selectors based socket client.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import socket
+import unittest
+
+import stomper
+from stomper import sync
+from stomper import connection
+from stomper.stompbuffer import StompBuffer
+
+
+class StompClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server, sock = socket.socketpair()
+        self.server.settimeout(5)
+        self.client = sync.StompClient(bufferSize=16)
+        self.client.open(sock)
+        self.sb = StompBuffer(binary=True)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def received(self):
+        """Return the frames the client has sent to the server."""
+        frames = []
+        while not frames:
+            self.sb.appendData(self.server.recv(65536))
+            frames = self.sb.getAllMessages()
+        return frames
+
+    def testConversation(self):
+        self.server.sendall(b'CONNECTED\nversion:1.1\nsession:s1\n\n\x00\n')
+        event = self.client.connect('bob', '123', timeout=5)
+        self.assertTrue(isinstance(event, connection.Connected))
+        self.assertEqual(self.client.engine.sessionId, 's1')
+        self.assertEqual(self.received()[0]['cmd'], 'CONNECT')
+
+        self.client.subscribe('/queue/a', 1, ack='client')
+        self.assertEqual(self.received()[0]['cmd'], 'SUBSCRIBE')
+
+        # The small read buffer means the frame arrives over many reads.
+        self.server.sendall(
+            b'MESSAGE\nsubscription:1\nmessage-id:m1\ndestination:/queue/a\n'
+            b'content-length:40\n\n' + b'x' * 40 + b'\x00\n')
+        event = self.client.waitFor(
+            lambda e: isinstance(e, connection.MessageReceived), 5)
+        self.assertEqual(event.body, b'x' * 40)
+        ack = self.received()[0]
+        self.assertEqual(ack['cmd'], 'ACK')
+        self.assertEqual(ack['headers']['message-id'], 'm1')
+
+        self.server.sendall(b'RECEIPT\nreceipt-id:r1\n\n\x00\n')
+        self.client.disconnect('r1', timeout=5)
+        self.assertTrue(self.client.sock is None)
+        self.assertEqual(self.client.connection.state, connection.CLOSED)
+
+    def testBacklog(self):
+        self.server.sendall(
+            b'CONNECTED\nversion:1.1\nsession:s1\n\n\x00\n'
+            b'RECEIPT\nreceipt-id:r1\n\n\x00\n')
+        self.client.connect(timeout=5)
+        events = self.client.poll(0)
+        self.assertTrue(isinstance(events[0], connection.ReceiptReceived))
+
+    def testConnectError(self):
+        self.server.sendall(b'ERROR\nmessage:bad login\n\n\x00\n')
+        self.assertRaises(stomper.FrameError, self.client.connect, timeout=5)
+        self.assertTrue(self.client.sock is None)
+
+    def testTimeoutAndClose(self):
+        self.assertRaises(
+            socket.timeout, self.client.waitFor, lambda e: True, 0.05)
+        self.server.close()
+        events = self.client.poll(5)
+        self.assertTrue(isinstance(events[0], connection.ConnectionClosed))
+        self.assertTrue(self.client.sock is None)
+
+    def testHeartbeats(self):
+        self.server.sendall(
+            b'CONNECTED\nversion:1.1\nsession:s1\nheart-beat:50,50\n\n\x00\n')
+        self.client.connect(heartbeats=(50, 50), timeout=5)
+        self.received()
+        self.assertEqual(self.client.connection.heartbeats, (50, 50))
+        # The client sends heart-beats, then gives up on the silent server.
+        events = []
+        while not events:
+            events = self.client.poll(1)
+        self.assertTrue(isinstance(events[0], connection.ConnectionClosed))
+        self.assertEqual(self.server.recv(100).strip(b'\n'), b'')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+This is the unittest to verify the transactional batch publishing.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+import unittest
+
+import stomper
+from stomper.txbatch import TransactionalPublisher
+from stomper.tests.helpers import parse_frames
+
+
+class TransactionalPublisherTest(unittest.TestCase):
+
+    def testCount(self):
+        publisher = TransactionalPublisher(maxCount=3, maxDelay=1.0)
+        sent = ''.join([publisher.send('/queue/a', 'm%d' % i, now=0)
+                        for i in range(4)])
+        sent += publisher.flush()
+        self.assertEqual(publisher.flush(), '')
+
+        sent = parse_frames(sent)
+        self.assertEqual(
+            [f['cmd'] for f in sent],
+            ['BEGIN', 'SEND', 'SEND', 'SEND', 'COMMIT', 'BEGIN', 'SEND', 'COMMIT'])
+        first = sent[0]['headers']['transaction']
+        second = sent[5]['headers']['transaction']
+        self.assertNotEqual(first, second)
+        for f in sent[:5]:
+            self.assertEqual(f['headers']['transaction'], first)
+        for f in sent[5:]:
+            self.assertEqual(f['headers']['transaction'], second)
+        self.assertEqual(publisher.committed, 2)
+
+    def testBytes(self):
+        publisher = TransactionalPublisher(maxCount=100, maxBytes=10)
+        publisher.send('/queue/a', 'x' * 6)
+        self.assertEqual(publisher.size, 6)
+        transactionid = publisher.transactionid
+        sent = publisher.send('/queue/a', u'\xe9\xe9')
+        self.assertTrue(sent.endswith(stomper.commit(transactionid)))
+        self.assertEqual(len(publisher), 0)
+        self.assertEqual(publisher.transactionid, None)
+
+    def testBinaryBody(self):
+        publisher = TransactionalPublisher(maxCount=2)
+        body = b'\x00\xff\n'
+        sent = publisher.send('/queue/a', body, 'application/octet-stream')
+        sent += publisher.send('/queue/a', body)
+        self.assertTrue(isinstance(sent, bytes))
+        self.assertEqual(publisher.committed, 1)
+
+        sent = parse_frames(sent)
+        self.assertEqual([f['cmd'] for f in sent], ['BEGIN', 'SEND', 'SEND', 'COMMIT'])
+        self.assertEqual(sent[1]['headers']['content-length'], '3')
+        self.assertEqual(sent[1]['headers']['content-type'], 'application/octet-stream')
+        self.assertEqual(sent[1]['headers']['transaction'],
+                         sent[0]['headers']['transaction'])
+        self.assertEqual(sent[1]['body'], body)
+        self.assertEqual(sent[2]['headers']['content-type'], 'text/plain')
+
+        # One template is made per destination and content type:
+        publisher.send('/queue/a', body)
+        publisher.send('/queue/b', body)
+        self.assertEqual(len(publisher._templates), 3)
+
+    def testPoll(self):
+        publisher = TransactionalPublisher(maxCount=10, maxDelay=1.0)
+        self.assertFalse(publisher.due(now=100))
+        self.assertEqual(publisher.poll(now=100), '')
+
+        publisher.send('/queue/a', 'hi', now=10)
+        transactionid = publisher.transactionid
+        publisher.send('/queue/a', 'hi', now=10.5)
+        self.assertEqual(publisher.poll(now=10.9), '')
+        self.assertEqual(publisher.poll(now=11), stomper.commit(transactionid))
+        self.assertFalse(publisher.due(now=100))
+
+    def testAbort(self):
+        publisher = TransactionalPublisher()
+        self.assertEqual(publisher.abort(), '')
+        publisher.send('/queue/a', 'hi')
+        transactionid = publisher.transactionid
+        self.assertEqual(publisher.abort(), stomper.abort(transactionid))
+        self.assertEqual(len(publisher), 0)
+        self.assertEqual(publisher.flush(), '')
+        self.assertEqual((publisher.committed, publisher.aborted), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+Transactional batch publishing.
+
+TransactionalPublisher groups SEND frames into transactions. The first
+message opens a transaction with a BEGIN frame, every SEND carries its
+transaction header and a COMMIT closes it once maxCount messages or
+maxBytes of bodies are in it, or the transaction has been open for
+maxDelay seconds. Brokers such as ActiveMQ persist once per COMMIT
+rather than once per message, so this can be much faster than sending
+each message on its own.
+
+The publisher doesn't write anything itself. Each call hands back the
+frames to pass on to whatever the connection is e.g.
+
+    publisher = TransactionalPublisher(maxCount=500, maxDelay=0.05)
+    try:
+        for body in bodies:
+            conn.sendFrame(publisher.send('/queue/a', body))
+        conn.sendFrame(publisher.flush())
+    except Exception:
+        conn.sendFrame(publisher.abort())
+        raise
+
+A publisher that sends in bursts should also be polled, from a timer or
+its event loop, so that the last transaction of a burst is committed
+without waiting for the next message. An aborted transaction's messages
+are dropped by the broker; sending them again is up to the caller.
+
+License: http://www.apache.org/licenses/LICENSE-2.0
+
+"""
+from builtins import object
+import time
+import uuid
+
+from . import stomp_11
+
+
+class TransactionalPublisher(object):
+    """This class opens, fills and commits transactions around the
+    messages sent through it, one transaction at a time.
+
+    Text bodies are sent as stomper.send(...) sends them. A bytes body is
+    sent with a content-length header giving its size, so it can hold
+    null bytes, and the frames returned with it are bytes too.
+
+    maxCount:
+        The transaction is committed once it holds this many messages.
+
+    maxBytes:
+        The transaction is committed once the bodies of its messages
+        come to this many bytes.
+
+    maxDelay:
+        The transaction is committed by poll() once it has been open
+        this many seconds.
+
+    clock:
+        The function returning the current time in seconds.
+
+    """
+    def __init__(self, maxCount=100, maxBytes=1024 * 1024, maxDelay=0.1,
+                 clock=time.monotonic):
+        """Setup the internal state."""
+        self.maxCount = maxCount
+        self.maxBytes = maxBytes
+        self.maxDelay = maxDelay
+        self.clock = clock
+        # The number of transactions committed and aborted:
+        self.committed = 0
+        self.aborted = 0
+        # (destination, content type) : the SendTemplate for bytes bodies
+        self._templates = {}
+        self._reset()
+
+    def _reset(self):
+        self.transactionid = None
+        self._count = 0
+        self._bytes = 0
+        self._opened = None
+
+    def __len__(self):
+        """The number of messages in the open transaction."""
+        return self._count
+
+    @property
+    def size(self):
+        """The number of body bytes in the open transaction."""
+        return self._bytes
+
+    def send(self, dest, msg, content_type='text/plain', now=None):
+        """Add a message to the open transaction, opening one if needed.
+
+        returned:
+            The frames to send: the SEND frame, preceded by a BEGIN frame
+            if a transaction was opened and followed by a COMMIT frame if
+            the transaction is full. They are bytes if msg is bytes.
+
+        """
+        frames = ''
+        if self.transactionid is None:
+            self.transactionid = str(uuid.uuid4())
+            self._opened = self.clock() if now is None else now
+            frames = stomp_11.begin(self.transactionid)
+
+        if isinstance(msg, (bytes, bytearray)):
+            template = self._templates.get((dest, content_type))
+            if template is None:
+                template = self._templates[(dest, content_type)] = \
+                    stomp_11.SendTemplate(dest, content_type, content_length=True)
+            frames = frames.encode('utf-8') + template.pack(
+                bytes(msg), self.transactionid)
+            self._bytes += len(msg)
+        else:
+            frames += stomp_11.send(
+                dest, msg, self.transactionid, content_type)
+            self._bytes += len(msg.encode('utf-8'))
+        self._count += 1
+
+        if self._count >= self.maxCount or self._bytes >= self.maxBytes:
+            commit = self.flush()
+            if isinstance(frames, bytes):
+                commit = commit.encode('utf-8')
+            frames += commit
+
+        return frames
+
+    def due(self, now=None):
+        """Return True if the open transaction has been open maxDelay."""
+        if self._opened is None:
+            return False
+        if now is None:
+            now = self.clock()
+        return now - self._opened >= self.maxDelay
+
+    def poll(self, now=None):
+        """Return the COMMIT frame if the open transaction is due, else
+        NO_RESPONSE_NEEDED.
+        """
+        if self.due(now):
+            return self.flush()
+        return stomp_11.NO_RESPONSE_NEEDED
+
+    def flush(self):
+        """Return the COMMIT frame for the open transaction, or
+        NO_RESPONSE_NEEDED if there is none.
+        """
+        if self.transactionid is None:
+            return stomp_11.NO_RESPONSE_NEEDED
+        frame = stomp_11.commit(self.transactionid)
+        self.committed += 1
+        self._reset()
+        return frame
+
+    def abort(self):
+        """Return the ABORT frame for the open transaction, or
+        NO_RESPONSE_NEEDED if there is none. This is called when sending
+        the transaction's frames has failed.
+        """
+        if self.transactionid is None:
+            return stomp_11.NO_RESPONSE_NEEDED
+        frame = stomp_11.abort(self.transactionid)
+        self.aborted += 1
+        self._reset()
+        return frame